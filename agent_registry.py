@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Registro de agentes a partir de la definición declarativa de agents.toml.
+Los agentes se construyen de forma perezosa la primera vez que se piden y se
+guardan en caché por proceso, uno por canal (voz o texto) porque cada canal
+tiene su presupuesto de salida. Si el archivo cambia, las definiciones se
+recargan y solo se reconstruyen los agentes afectados.
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import output_budget
+from cascade import TEXT, VERIFIERS
+from output_budget import CHANNELS, TEXT_CHANNEL
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+logger = logging.getLogger(__name__)
+
+AGENTS_CONFIG_PATH = os.environ.get(
+    "BOB_AGENTS_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "agents.toml")
+)
+
+# Servidor de Ollama de los agentes (p. ej. el proxy /ollama del servidor); si no, el de por defecto
+OLLAMA_HOST = os.environ.get("BOB_OLLAMA_HOST")
+
+# Campos de la definición que no se pasan directamente a Agent
+RESERVED_FIELDS = ("model", "team", "draft_model", "verifier", "sql_schema", "budget")
+
+
+class AgentConfigError(Exception):
+    """La definición de agentes no es válida."""
+
+
+def config_mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError as e:
+        raise AgentConfigError(f"Cannot read agents config {path}: {e}") from e
+
+
+def _check_team_cycles(definitions: Dict[str, Dict[str, Any]]):
+    """Un equipo no puede contenerse a sí mismo, ni directa ni indirectamente."""
+    done = set()
+
+    def visit(key: str, path: List[str]):
+        if key in path:
+            cycle = " -> ".join(path[path.index(key):] + [key])
+            raise AgentConfigError(f"Agent teams form a cycle: {cycle}")
+        if key in done:
+            return
+        for member in definitions[key].get("team", []):
+            visit(member, path + [key])
+        done.add(key)
+
+    for key in definitions:
+        visit(key, [])
+
+
+def load_definitions(path: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path, "rb") as f:
+            config = tomllib.load(f)
+    except OSError as e:
+        raise AgentConfigError(f"Cannot read agents config {path}: {e}") from e
+    except tomllib.TOMLDecodeError as e:
+        raise AgentConfigError(f"Invalid agents config {path}: {e}") from e
+    definitions = config.get("agents", {})
+    defaults = config.get("budgets", {})
+    for channel, budget in defaults.items():
+        problem = "unknown channel" if channel not in CHANNELS else output_budget.check(budget)
+        if problem:
+            raise AgentConfigError(f"Invalid budget [budgets.{channel}]: {problem}")
+    for key, definition in definitions.items():
+        if "model" not in definition:
+            raise AgentConfigError(f"Agent '{key}' has no model")
+        for member in definition.get("team", []):
+            if member not in definitions:
+                raise AgentConfigError(f"Agent '{key}' references unknown team member '{member}'")
+        if definition.get("verifier", TEXT) not in VERIFIERS:
+            raise AgentConfigError(f"Agent '{key}' has unknown verifier '{definition['verifier']}'")
+        if definition.get("sql_schema"):
+            # Rutas relativas al archivo de configuración
+            definition["sql_schema"] = os.path.join(os.path.dirname(os.path.abspath(path)), definition["sql_schema"])
+        budget = definition.get("budget", {})
+        for layer in [budget] + [budget[channel] for channel in CHANNELS if channel in budget]:
+            problem = output_budget.check(layer)
+            if problem:
+                raise AgentConfigError(f"Agent '{key}' has an invalid budget: {problem}")
+        # Presupuesto efectivo por canal: así un cambio en [budgets] invalida los agentes afectados
+        definition["budget"] = {channel: output_budget.resolve(defaults, budget, channel) for channel in CHANNELS}
+    _check_team_cycles(definitions)
+    return definitions
+
+
+class AgentRegistry:
+    def __init__(self, path: str = AGENTS_CONFIG_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._definitions: Dict[str, Dict[str, Any]] = {}
+        self._mtime: Optional[float] = None
+        self._agents: Dict[Tuple[str, str], Any] = {}
+
+    def definitions(self) -> Dict[str, Dict[str, Any]]:
+        self._reload_if_changed()
+        return self._definitions
+
+    def names(self) -> List[str]:
+        return list(self.definitions())
+
+    def get(self, key: str, channel: str = TEXT_CHANNEL):
+        """Devuelve el agente `key` para `channel`, construyéndolo (y a su equipo) si hace falta."""
+        if channel not in CHANNELS:
+            raise ValueError(f"Unknown channel: {channel}")
+        with self._lock:
+            self._reload_if_changed()
+            return self._get(key, channel)
+
+    def budget(self, key: str, channel: str = TEXT_CHANNEL) -> Dict[str, Any]:
+        """Presupuesto de salida efectivo del agente `key` en `channel`."""
+        return self.definitions()[key]["budget"][channel]
+
+    def built(self) -> List[str]:
+        with self._lock:
+            return list(dict.fromkeys(key for key, _ in self._agents))
+
+    def reload(self, force: bool = False) -> List[str]:
+        """Vuelve a leer el archivo y devuelve las claves de los agentes invalidados."""
+        with self._lock:
+            mtime = config_mtime(self.path)
+            if not force and mtime == self._mtime:
+                return []
+            definitions = load_definitions(self.path)
+            changed = {key for key in set(definitions) | set(self._definitions)
+                       if definitions.get(key) != self._definitions.get(key)}
+            # Un equipo se invalida si cambia cualquiera de sus miembros
+            invalidated = set(changed)
+            while True:
+                dependents = {key for key, definition in definitions.items()
+                              if key not in invalidated and invalidated & set(definition.get("team", []))}
+                if not dependents:
+                    break
+                invalidated |= dependents
+            for key in invalidated:
+                for channel in CHANNELS:
+                    self._agents.pop((key, channel), None)
+            if self._mtime is not None and invalidated:
+                logger.info(f"Definiciones de agentes recargadas: {sorted(invalidated)}")
+            self._definitions = definitions
+            self._mtime = mtime
+            return sorted(invalidated)
+
+    def _reload_if_changed(self):
+        if self._mtime is None or config_mtime(self.path) != self._mtime:
+            self.reload()
+
+    def _get(self, key: str, channel: str):
+        agent = self._agents.get((key, channel))
+        if agent is None:
+            if key not in self._definitions:
+                raise KeyError(key)
+            agent = self._agents[(key, channel)] = self._build(key, self._definitions[key], channel)
+        return agent
+
+    def _build(self, key: str, definition: Dict[str, Any], channel: str):
+        # Importar agno aquí para que cargar el registro no cueste nada
+        from agno.agent import Agent
+
+        from llm_ledger import ledger_model
+
+        kwargs = {field: value for field, value in definition.items() if field not in RESERVED_FIELDS}
+        # Cada llamada al modelo queda registrada en el ledger con el nombre del agente
+        model_kwargs = {"host": OLLAMA_HOST} if OLLAMA_HOST else {}
+        # El presupuesto del canal corta la generación en Ollama (num_predict y stop)
+        budget = definition["budget"][channel]
+        options = output_budget.model_options(budget)
+        if options:
+            model_kwargs["options"] = options
+        kwargs["model"] = ledger_model(
+            key,
+            id=definition["model"],
+            draft_id=definition.get("draft_model"),
+            verifier=definition.get("verifier", TEXT),
+            sql_schema=definition.get("sql_schema"),
+            ledger_channel=channel,
+            **model_kwargs,
+        )
+        concise = output_budget.instruction(budget)
+        if concise:
+            instructions = kwargs.get("instructions") or []
+            kwargs["instructions"] = ([instructions] if isinstance(instructions, str) else list(instructions)) + [concise]
+        if definition.get("team"):
+            kwargs["team"] = [self._get(member, channel) for member in definition["team"]]
+        return Agent(**kwargs)
+
+
+# Registro compartido por el proceso
+registry = AgentRegistry()
@@ -4,29 +4,115 @@ Script auxiliar para ejecutar los agentes sin interferencia con Streamlit.
 Este script se ejecuta como un proceso separado.
 """
 
+import os
 import sys
 import json
+import re
+import time
+from contextlib import redirect_stdout
 
-def run_agent(input_text):
-    """Ejecuta el equipo de agentes con el texto proporcionado y devuelve la respuesta."""
+# Prefijo de las herramientas con las que el equipo delega en un miembro
+TRANSFER_TOOL_PREFIX = "transfer_task_to_"
+
+# Eventos de agno que traen texto de la respuesta al hacer streaming (según la versión)
+CONTENT_EVENTS = ("RunResponse", "RunResponseContent", "TeamRunResponseContent")
+
+def _as_dict(obj):
+    """Convierte los objetos de agno (dataclasses, pydantic) en diccionarios."""
+    if obj is None or isinstance(obj, dict):
+        return obj or {}
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return dict(vars(obj))
+
+def _tool_name_for(agent_name):
+    return TRANSFER_TOOL_PREFIX + re.sub(r"[^a-z0-9]+", "_", agent_name.lower()).strip("_")
+
+def _tool_calls(run_response):
+    calls = []
+    for tool in getattr(run_response, "tools", None) or []:
+        tool = _as_dict(tool)
+        content = tool.get("content")
+        calls.append({
+            "name": tool.get("tool_name"),
+            "args": tool.get("tool_args"),
+            "result": None if content is None else str(content),
+        })
+    return calls
+
+def _answering_agent(agent, tool_calls):
+    """El último miembro al que se transfirió la tarea; si no hubo transferencias, el propio agente."""
+    members = {_tool_name_for(member.name): member.name for member in agent.team or []}
+    for call in reversed(tool_calls):
+        if call["name"] in members:
+            return members[call["name"]]
+    return agent.name
+
+def _model_calls(run_response):
+    """Tokens y tiempos de cada respuesta del modelo."""
+    calls = []
+    for message in getattr(run_response, "messages", None) or []:
+        if message.role != "assistant":
+            continue
+        metrics = _as_dict(message.metrics)
+        calls.append({
+            "input_tokens": metrics.get("input_tokens", 0),
+            "output_tokens": metrics.get("output_tokens", 0),
+            "total_tokens": metrics.get("total_tokens", 0),
+            "time": metrics.get("time"),
+            "time_to_first_token": metrics.get("time_to_first_token"),
+        })
+    return calls
+
+def _success(agent, run_response, content, elapsed, channel):
+    """Resultado estructurado de una ejecución que terminó bien."""
+    from llm_ledger import last_call_truncated
+
+    tool_calls = _tool_calls(run_response)
+    model_calls = _model_calls(run_response)
+    return {
+        "status": "success",
+        "response": content if isinstance(content, str) else json.dumps(content, default=str),
+        "agent": _answering_agent(agent, tool_calls),
+        "channel": channel,
+        # La respuesta final se cortó al agotar el presupuesto de salida: se puede pedir que continúe
+        "truncated": last_call_truncated(),
+        "tool_calls": tool_calls,
+        "metrics": {
+            "input_tokens": sum(call["input_tokens"] or 0 for call in model_calls),
+            "output_tokens": sum(call["output_tokens"] or 0 for call in model_calls),
+            "total_tokens": sum(call["total_tokens"] or 0 for call in model_calls),
+            "model_calls": model_calls,
+            "run_time": elapsed,
+        },
+    }
+
+def run_agent(input_text, agent_key="bob_team", channel="text"):
+    """Ejecuta el equipo de agentes con el texto proporcionado y devuelve un resultado estructurado.
+
+    `agent_key` permite ejecutar directamente un solo agente de agents.toml;
+    en ese caso solo se construye ese agente. `channel` ("voice" o "text") elige
+    el presupuesto de salida de los agentes.
+    """
     try:
-        from agents import bob_team
-        
-        # Capturar la salida del equipo de agentes
-        import io
-        from contextlib import redirect_stdout
-        
-        f = io.StringIO()
-        with redirect_stdout(f):
-            bob_team.print_response(input_text, stream=False)
-        
-        response = f.getvalue()
-        
-        # Devolver un resultado exitoso
-        return {
-            "status": "success",
-            "response": response
-        }
+        from agent_registry import registry
+        if agent_key not in registry.names():
+            return {
+                "status": "error",
+                "error": f"Unknown agent: {agent_key}"
+            }
+        agent = registry.get(agent_key, channel)
+
+        # Llamar directamente a la API del agente, sin el formateo de print_response.
+        # Cualquier salida de las librerías va a stderr para no corromper el JSON de stdout.
+        start = time.perf_counter()
+        with redirect_stdout(sys.stderr):
+            run_response = agent.run(input_text, stream=False)
+        elapsed = time.perf_counter() - start
+
+        return _success(agent, run_response, run_response.content, elapsed, channel)
     except Exception as e:
         # Devolver error si algo salió mal
         return {
@@ -34,17 +120,74 @@ def run_agent(input_text):
             "error": str(e)
         }
 
+def stream_agent(input_text, agent_key="bob_team", out=None, channel="text"):
+    """Como `run_agent`, pero escribe cada trozo de la respuesta en `out` según se genera.
+
+    Cada línea de `out` es un JSON: `{"type": "chunk", "text": ...}` por cada trozo y,
+    al final, el resultado de `run_agent` con `"type": "result"`.
+    """
+    out = out or sys.stdout
+
+    def emit(payload):
+        out.write(json.dumps(payload) + "\n")
+        out.flush()
+
+    try:
+        from agent_registry import registry
+        if agent_key not in registry.names():
+            result = {"status": "error", "error": f"Unknown agent: {agent_key}"}
+        else:
+            agent = registry.get(agent_key, channel)
+            start = time.perf_counter()
+            parts = []
+            with redirect_stdout(sys.stderr):
+                for event in agent.run(input_text, stream=True):
+                    # Solo los eventos con contenido; los de herramientas y razonamiento no se leen
+                    text = getattr(event, "content", None)
+                    if getattr(event, "event", CONTENT_EVENTS[0]) in CONTENT_EVENTS and isinstance(text, str) and text:
+                        parts.append(text)
+                        emit({"type": "chunk", "text": text})
+            elapsed = time.perf_counter() - start
+            # Al terminar el stream, el agente guarda la respuesta completa (herramientas y métricas)
+            run_response = getattr(agent, "run_response", None)
+            result = _success(agent, run_response, "".join(parts), elapsed, channel)
+    except Exception as e:
+        result = {"status": "error", "error": str(e)}
+    emit({"type": "result", **result})
+    return result
+
 if __name__ == "__main__":
-    # Si no hay argumentos, mostrar ayuda
-    if len(sys.argv) < 2:
-        print("Uso: python agent_runner.py 'texto de entrada'")
-        sys.exit(1)
-    
-    # El primer argumento es el texto a procesar
-    input_text = sys.argv[1]
-    
+    import argparse
+
+    parser = argparse.ArgumentParser(usage="python agent_runner.py [--agent clave] [--] 'texto de entrada'")
+    # El texto a procesar; el servidor lo pasa después de "--" por si empieza por "-"
+    parser.add_argument("input_text")
+    parser.add_argument("--agent", default="bob_team", help="clave del agente en agents.toml")
+    parser.add_argument("--profile", action="store_true", help="perfilar esta ejecución (formato speedscope)")
+    parser.add_argument("--request-id", help="identificador de la petición (nombre del perfil y turno en el ledger)")
+    parser.add_argument("--stream", action="store_true", help="escribir la respuesta por trozos, un JSON por línea")
+    parser.add_argument("--channel", choices=["text", "voice"], default="text",
+                        help="canal del turno: elige el presupuesto de salida de los agentes")
+    args = parser.parse_args()
+
+    # Las llamadas a los modelos de este turno se agrupan en el ledger por este identificador
+    from llm_ledger import set_request_id
+    set_request_id(args.request_id or f"runner-{int(time.time() * 1000)}")
+
+    # En streaming los trozos y el resultado ya se han escrito en stdout
+    if args.stream:
+        stream_agent(args.input_text, args.agent, channel=args.channel)
+        sys.exit(0)
+
     # Ejecutar el agente y obtener la respuesta
-    result = run_agent(input_text)
-    
+    if args.profile:
+        # El profiler solo se importa y arranca cuando se pide
+        from profiler import SamplingProfiler
+        with SamplingProfiler(args.request_id or f"runner-{int(time.time() * 1000)}") as profiler:
+            result = run_agent(args.input_text, args.agent, args.channel)
+        result["profile"] = os.path.basename(profiler.save())
+    else:
+        result = run_agent(args.input_text, args.agent, args.channel)
+
     # Imprimir el resultado como JSON para que el llamador pueda analizarlo
-    print(json.dumps(result))
\ No newline at end of file
+    print(json.dumps(result))
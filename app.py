@@ -4,17 +4,39 @@ Servidor FastAPI con WebSockets para el Simple Speech Assistant.
 Proporciona endpoints para la comunicación en tiempo real con los agentes.
 """
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import json
 import subprocess
 import sys
 import os
 import asyncio
+import ipaddress
 import logging
+import uuid
 from typing import List, Dict, Any
 
+import httpx
+
+import wire_protocol
+from agent_registry import registry, AgentConfigError
+from profiler import PROFILE_DIR, PROFILE_SUFFIX, list_profiles
+from llm_ledger import LedgerTail
+from ollama_pool import (OllamaPool, NoHostAvailable, HOP_BY_HOP_HEADERS, OLLAMA_HOSTS_CONFIG_PATH, OLLAMA_PROXY_PATHS,
+                         load_hosts, proxy_timeout)
+from connections import ConnectionManager, RecentRequests, WS_HEARTBEAT_INTERVAL, WS_HEARTBEAT_TIMEOUT
+from jobs import JobStore, JobManager, FINISHED_STATES, JOB_EVENT_POLL_SECONDS
+from scheduler import FairScheduler, client_identity, BACKGROUND, TEXT, VOICE, SCHED_CONCURRENCY
+from shared_state import SharedState, worker_id
+import audio_io
+from voice_pipeline import VoiceTurn, VoiceLimitError, VOICE_MAX_OPEN_TURNS
+from embeddings import embeddings
+from workload_capture import capture_for, close_captures
+from output_budget import (Continuations, TEXT_CHANNEL, VOICE_CHANNEL, channel_from_name, complete_sentences,
+                           continuation_prompt)
+from whisper_pool import WhisperPool
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,156 +44,414 @@ logger = logging.getLogger(__name__)
 # Crear la aplicación FastAPI
 app = FastAPI(title="Simple Speech Assistant API")
 
-# Asegurarse de que el runner existe
+# Número de procesos de uvicorn y puerto del servidor
+WORKERS = int(os.environ.get("BOB_WORKERS", 1))
+PORT = int(os.environ.get("BOB_PORT", 8000))
+
+# Con varios workers, el estado que tienen que ver todos (conexiones, token buckets,
+# broadcasts) va en un SQLite compartido. BOB_SHARED_STATE=1 lo activa con un solo worker.
+shared_state = SharedState() if WORKERS > 1 or os.environ.get("BOB_SHARED_STATE") == "1" else None
+
+# Asegurarse de que el runner existe. No se genera uno por defecto: el servidor
+# espera el resultado estructurado en JSON del agent_runner.py del repositorio
 def ensure_agent_runner_exists():
     agent_runner_path = os.path.join(os.getcwd(), "agent_runner.py")
     if not os.path.exists(agent_runner_path):
-        with open(agent_runner_path, "w") as f:
-            f.write("""#!/usr/bin/env python3
-\"\"\"
-Script auxiliar para ejecutar los agentes sin interferencia con Streamlit.
-Este script se ejecuta como un proceso separado.
-\"\"\"
+        raise FileNotFoundError(
+            f"agent_runner.py not found in {os.getcwd()}; start the server from the repository directory"
+        )
+    return agent_runner_path
 
-import sys
-import json
+# Asegurarse de que el runner existe al inicio
+agent_runner_path = ensure_agent_runner_exists()
+
+# Instanciar el gestor de conexiones
+manager = ConnectionManager(shared=shared_state)
 
-def run_agent(input_text):
-    \"\"\"Ejecuta el equipo de agentes con el texto proporcionado y devuelve la respuesta.\"\"\"
+# Peticiones recientes de /ws/agent: un reenvío tras reconectar no vuelve a ejecutar el agente
+recent_requests = RecentRequests()
+
+# Ejecuta agent_runner.py y devuelve su resultado. La salida normal es una sola línea
+# JSON; con --stream, una por trozo ({"type": "chunk"}, que se pasa a `on_chunk`)
+# y el resultado al final ({"type": "result"})
+async def run_agent_runner(text, extra_args, on_chunk=None):
+    process = None
+    stderr_task = None
     try:
-        from agents import bob_team
-        
-        # Capturar la salida del equipo de agentes
-        import io
-        from contextlib import redirect_stdout
-        
-        f = io.StringIO()
-        with redirect_stdout(f):
-            bob_team.print_response(input_text, stream=False)
-        
-        response = f.getvalue()
-        
-        # Devolver un resultado exitoso
-        return {
-            "status": "success",
-            "response": response
-        }
+        # Límite de línea amplio: el resultado incluye las llamadas a herramientas
+        process = await asyncio.create_subprocess_exec(
+            # "--" antes del texto: un prompt que empieza por "-" no se lee como una opción
+            sys.executable, agent_runner_path, *extra_args, "--", text,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=16 * 1024 * 1024,
+        )
+        stderr_task = asyncio.create_task(process.stderr.read())
+        result = None
+        async for line in process.stdout:
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(message, dict):
+                continue
+            if message.get("type") == "chunk":
+                if on_chunk is not None:
+                    await on_chunk(message["text"])
+            else:
+                result = {key: value for key, value in message.items() if key != "type"}
+        stderr = await stderr_task
+        await process.wait()
+
+        if process.returncode != 0:
+            logger.error(f"Agent execution error: {stderr.decode()}")
+            return {"status": "error", "error": f"Process exited with {process.returncode}"}
+        if result is None:
+            logger.error("JSON decode error: no result in the agent output")
+            return {"status": "error", "error": "Could not parse agent response"}
+        return result
     except Exception as e:
-        # Devolver error si algo salió mal
-        return {
-            "status": "error",
-            "error": str(e)
-        }
+        logger.error(f"Agent execution error: {e}")
+        return {"status": "error", "error": str(e)}
+    finally:
+        # Turno cancelado (p. ej. el cliente se desconectó): no dejar el runner trabajando,
+        # y esperarlo para que no quede como zombi
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+        if stderr_task is not None and not stderr_task.done():
+            stderr_task.cancel()
 
-if __name__ == "__main__":
-    # Si no hay argumentos, mostrar ayuda
-    if len(sys.argv) < 2:
-        print("Uso: python agent_runner.py 'texto de entrada'")
-        sys.exit(1)
-    
-    # El primer argumento es el texto a procesar
-    input_text = sys.argv[1]
-    
-    # Ejecutar el agente y obtener la respuesta
-    result = run_agent(input_text)
-    
-    # Imprimir el resultado como JSON para que el llamador pueda analizarlo
-    print(json.dumps(result))
-""")
-        # Hacerlo ejecutable
-        os.chmod(agent_runner_path, 0o755)
-    return agent_runner_path
+# Función para obtener respuesta del agente
+async def get_agent_response(text, request_id=None, profile=False, channel=TEXT_CHANNEL):
+    # El request_id identifica la petición en el ledger de LLM y en el perfil,
+    # que solo se genera si se pidió para esta petición. El canal elige el presupuesto de salida
+    extra_args = [f"--channel={channel}"]
+    if request_id:
+        extra_args.append(f"--request-id={request_id}")
+    if profile:
+        extra_args.append("--profile")
+    return await run_agent_runner(text, extra_args)
 
-# Asegurarse de que el runner existe al inicio
-agent_runner_path = ensure_agent_runner_exists()
+# Igual que get_agent_response, pero con el runner en streaming: `on_chunk` recibe
+# cada trozo de la respuesta según se genera
+async def get_agent_response_stream(text, on_chunk, request_id=None, channel=TEXT_CHANNEL):
+    extra_args = ["--stream", f"--channel={channel}"]
+    if request_id:
+        extra_args.append(f"--request-id={request_id}")
+    return await run_agent_runner(text, extra_args, on_chunk)
 
-# Clase para gestionar las conexiones WebSocket
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+# Planificador por prioridad y cliente delante de la ejecución de agentes. Con varios
+# workers la concurrencia se reparte entre ellos y los token buckets son compartidos
+scheduler = FairScheduler(concurrency=max(1, SCHED_CONCURRENCY // WORKERS), shared=shared_state)
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(f"Nueva conexión WebSocket. Total: {len(self.active_connections)}")
+async def get_scheduled_agent_response(text, client_id, priority, request_id=None, profile=False,
+                                       channel=TEXT_CHANNEL):
+    return await scheduler.run(client_id, priority, lambda: get_agent_response(text, request_id, profile, channel))
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-        logger.info(f"Conexión WebSocket cerrada. Restantes: {len(self.active_connections)}")
+# Respuestas cortadas por el presupuesto de salida que el cliente puede pedir que continúen
+# (por proceso: la conexión WebSocket siempre la atiende el mismo worker)
+continuations = Continuations()
 
-    async def send_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+# Captura opcional de cada turno para reproducir la carga real (BOB_CAPTURE=1)
+agent_capture = capture_for("ws_agent")
+voice_capture = capture_for("ws_voice")
+job_capture = capture_for("job")
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+# Gestor de trabajos asíncronos persistidos en SQLite
+async def run_job(text, params, on_chunk):
+    arrival = job_capture.start()
+    # Los trabajos van siempre en segundo plano, pida lo que pida el cliente. El runner va
+    # en streaming para publicar el progreso del trabajo según se genera
+    channel = channel_from_name(params.get("channel"))
+    response = await scheduler.run(params.get("client_id", "jobs"), BACKGROUND,
+                                   lambda: get_agent_response_stream(text, on_chunk, channel=channel))
+    job_capture.record(arrival, text, response, kind="text", channel=channel, client=params.get("client_id"))
+    return response
 
-# Instanciar el gestor de conexiones
-manager = ConnectionManager()
+job_manager = JobManager(JobStore(), run_job)
 
-# Función para obtener respuesta del agente
-async def get_agent_response(text):
+# Pool de servidores Ollama. Si hay un ollama_hosts.toml, los agent runners hablan con
+# Ollama a través del proxy /ollama de este servidor para repartir la carga
+ollama_pool = OllamaPool(load_hosts(OLLAMA_HOSTS_CONFIG_PATH))
+ollama_http = httpx.AsyncClient(timeout=proxy_timeout())
+# Sin ollama_hosts.toml no hay pool que repartir: el proxy /ollama no se registra
+ollama_pool_configured = os.path.exists(OLLAMA_HOSTS_CONFIG_PATH)
+if ollama_pool_configured:
+    os.environ.setdefault("BOB_OLLAMA_HOST", os.environ.get("BOB_OLLAMA_PROXY_URL", f"http://127.0.0.1:{PORT}/ollama"))
+
+if shared_state is not None:
+    # Los demás workers expulsan también el servidor Ollama en cuanto uno lo expulsa
+    def publish_ejection(host, duration):
+        asyncio.get_running_loop().run_in_executor(
+            None, shared_state.publish, "ollama.eject", {"url": host.url, "duration": duration})
+
+    ollama_pool.on_eject = publish_ejection
+    shared_state.subscribe("ollama.eject", lambda message: ollama_pool.eject(message["url"], message["duration"]))
+    # Una recarga forzada de agents.toml se aplica en todos los workers
+    shared_state.subscribe("agents.reload", lambda message: registry.reload(force=True))
+
+# Agregados móviles del ledger de llamadas a los modelos (lo escriben los agent runners)
+ledger_tail = LedgerTail()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    if shared_state is not None:
+        await shared_state.start(lambda: {"pid": os.getpid(), "connections": len(manager.connections)})
+    await manager.start()
+    await job_manager.start()
+    await ollama_pool.start(ollama_http)
+    await scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await job_manager.stop()
+    await scheduler.stop()
+    await manager.stop()
+    await ollama_pool.stop()
+    await ollama_http.aclose()
+    await asyncio.to_thread(embeddings.close)
+    await asyncio.to_thread(close_captures)
+    if shared_state is not None:
+        await shared_state.stop()
+
+# Procesar un mensaje del cliente sin bloquear la lectura del socket
+async def handle_agent_message(websocket, message):
+    # "request_id" se devuelve en cada respuesta para que el cliente pueda emparejarlas
+    # (y pedir que continúe); si el cliente no lo envía, lo genera el servidor
+    client_request_id = message.get("request_id")
+    request_id = client_request_id or uuid.uuid4().hex
+    client_id = client_identity(websocket.client.host, message.get("client_id"))
+    arrival = agent_capture.start()
+    
+    def reply(payload):
+        return manager.send_json({**payload, "request_id": request_id}, websocket)
+    
+    # Un request_id ya visto es un reenvío del cliente tras reconectar: se contesta con
+    # el resultado de la ejecución original en lugar de repetirla
+    key = (client_id, client_request_id) if client_request_id else None
+    if key is not None:
+        original = recent_requests.get(key)
+        if original is not None:
+            response = await asyncio.shield(original)
+            if response is not None:
+                await reply(response)
+                return
+        recent_requests.start(key)
+    response = None
     try:
-        # Escape single quotes in the input text
-        escaped_text = text.replace("'", "\\'")
+        text = message.get("text", "")
+        prompt = None
+        previous = ""
+        # "channel" (o "mode": "voice") elige el presupuesto de salida de los agentes
+        channel = channel_from_name(message.get("channel"),
+                                    VOICE_CHANNEL if message.get("mode") == "voice" else TEXT_CHANNEL)
         
-        # Run the agent_runner.py script as a separate process
-        result = await asyncio.create_subprocess_exec(
-            sys.executable, agent_runner_path, escaped_text,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+        # "continue": <request_id> sigue una respuesta anterior cortada por el presupuesto
+        if message.get("continue"):
+            pending = continuations.pop(client_id, message["continue"])
+            if pending is None:
+                await reply({"status": "error", "error": "Nothing to continue for that request"})
+                return
+            text, previous, channel = pending
+            prompt = continuation_prompt(text, previous)
+        
+        if not text:
+            await reply({"status": "error", "error": "No text provided"})
+            return
+        
+        # Enviar confirmación de recepción
+        await reply({"status": "processing", "message": "Processing your request..."})
+        
+        # Obtener respuesta del agente. La prioridad la decide el canal: un turno de voz
+        # se adelanta a los de texto, pero recibe el presupuesto de salida de voz
+        priority = VOICE if channel == VOICE_CHANNEL else TEXT
+        # "profile": true genera un perfil de esta petición, nombrado por su request_id
+        response = await get_scheduled_agent_response(
+            prompt or text, client_id, priority, request_id, bool(message.get("profile")), channel
         )
-        stdout, stderr = await result.communicate()
+        if response.get("truncated"):
+            continuations.add(client_id, request_id, text, previous + response.get("response", ""), channel)
+        agent_capture.record(arrival, text, response, kind=message.get("mode") or "text", channel=channel,
+                             client=client_id, cont=bool(prompt) or None)
         
-        if result.returncode != 0:
-            logger.error(f"Agent execution error: {stderr.decode()}")
-            return {"status": "error", "error": f"Process exited with {result.returncode}"}
-            
-        # Parse the JSON output
-        try:
-            response_json = json.loads(stdout.decode())
-            return response_json
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}")
-            return {"status": "error", "error": "Could not parse agent response"}
-            
+        # Enviar respuesta al cliente
+        await reply(response)
     except Exception as e:
-        logger.error(f"Agent execution error: {e}")
-        return {"status": "error", "error": str(e)}
+        response = {"status": "error", "error": str(e)}
+        await reply(response)
+    finally:
+        if key is not None:
+            recent_requests.finish(key, response)
 
 # Endpoint WebSocket para la comunicación con el agente
 @app.websocket("/ws/agent")
 async def websocket_agent(websocket: WebSocket):
     await manager.connect(websocket)
+    tasks = set()
     try:
         while True:
-            # Recibir mensaje del cliente
-            data = await websocket.receive_text()
+            # Recibir mensaje del cliente (JSON o msgpack según el protocolo negociado)
+            frame = await manager.receive(websocket)
+            if wire_protocol.is_audio(frame):
+                await manager.send_json({"status": "error", "error": "Audio frames are not supported on this endpoint"}, websocket)
+                continue
             
             # Analizar el mensaje recibido
             try:
-                message = json.loads(data)
-                text = message.get("text", "")
-                
-                if not text:
-                    await manager.send_message(json.dumps({"status": "error", "error": "No text provided"}), websocket)
-                    continue
-                
-                # Enviar confirmación de recepción
-                await manager.send_message(json.dumps({"status": "processing", "message": "Processing your request..."}), websocket)
-                
-                # Obtener respuesta del agente
-                response = await get_agent_response(text)
-                
-                # Enviar respuesta al cliente
-                await manager.send_message(json.dumps(response), websocket)
-                
-            except json.JSONDecodeError:
-                await manager.send_message(json.dumps({"status": "error", "error": "Invalid JSON format"}), websocket)
-            except Exception as e:
-                await manager.send_message(json.dumps({"status": "error", "error": str(e)}), websocket)
+                message = wire_protocol.decode(frame, manager.protocol(websocket))
+                if not isinstance(message, dict):
+                    raise ValueError("Message must be an object")
+            except ValueError:
+                await manager.send_json({"status": "error", "error": "Invalid message format"}, websocket)
+                continue
+            
+            if message.get("type") == "pong":
+                continue
+            
+            # Seguir leyendo (pongs incluidos) mientras el agente trabaja
+            task = asyncio.create_task(handle_agent_message(websocket, message))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
     
     except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        manager.disconnect(websocket)
+
+# Modelos Whisper del servidor para /ws/voice (se cargan con el primer turno de voz)
+whisper_pool = WhisperPool()
+
+def new_voice_turn(websocket, request_id, options, client_id, channel=VOICE_CHANNEL):
+    async def run_agent(text, on_chunk):
+        return await scheduler.run(client_id, VOICE,
+                                   lambda: get_agent_response_stream(text, on_chunk, request_id, channel))
+
+    return VoiceTurn(
+        request_id,
+        send=lambda payload: manager.send_json(payload, websocket),
+        send_audio=lambda header, audio: manager.send_audio(header, audio, websocket),
+        transcribe=lambda audio, size: whisper_pool.transcribe(audio, size),
+        run_agent=run_agent,
+        synthesize=audio_io.synthesize_speech,
+        audio_format=options.get("format", "wav"),
+        sample_rate=int(options.get("sample_rate", 16000)),
+        lang=options.get("lang", "es"),
+        tts=options.get("tts", True),
+    )
+
+# Endpoint WebSocket para un turno de voz completo en una sola conexión: el cliente
+# envía el audio (frames binarios con "request_id"; el último con "final": true) o
+# un texto, y recibe la transcripción, los trozos de la respuesta y la voz por frases.
+# {"continue": <request_id>} sigue una respuesta cortada por el presupuesto de salida
+@app.websocket("/ws/voice")
+async def websocket_voice(websocket: WebSocket):
+    await manager.connect(websocket)
+    turns = {}
+    # Llegada de cada turno (el primer trozo de audio), para la captura de la carga
+    arrivals = {}
+    # Turnos rechazados por un límite: el resto de su audio se descarta sin más errores
+    rejected = set()
+    tasks = set()
+
+    def start(coroutine):
+        task = asyncio.create_task(coroutine)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def run_turn(turn, coroutine, channel, client_id, arrival, previous=""):
+        response = await coroutine
+        if response.get("truncated") and turn.transcript:
+            answer = previous + response.get("response", "")
+            if turn.tts:
+                # La frase a medias no se ha leído: la continuación empieza por ella
+                answer = complete_sentences(answer)
+            continuations.add(client_id, turn.request_id, turn.transcript, answer, channel)
+        voice_capture.record(arrival, turn.transcript or "", response, stages=turn.timings,
+                             kind="voice" if turn.audio_bytes else "text", channel=channel, client=client_id,
+                             audio_bytes=turn.audio_bytes or None, audio_seconds=turn.audio_seconds,
+                             cont=bool(previous) or None)
+
+    try:
+        while True:
+            frame = await manager.receive(websocket)
+            protocol = manager.protocol(websocket)
+            try:
+                if wire_protocol.is_audio(frame):
+                    options, audio = wire_protocol.decode_audio(frame, protocol)
+                else:
+                    options, audio = wire_protocol.decode(frame, protocol), None
+                if not isinstance(options, dict):
+                    raise ValueError("Message must be an object")
+            except ValueError:
+                await manager.send_json({"status": "error", "error": "Invalid message format"}, websocket)
+                continue
+
+            if options.get("type") == "pong":
+                continue
+
+            request_id = options.get("request_id") or uuid.uuid4().hex
+            client_id = client_identity(websocket.client.host, options.get("client_id"))
+            channel = channel_from_name(options.get("channel"), VOICE_CHANNEL)
+            if (audio is not None or options.get("continue") or options.get("text")) \
+                    and request_id not in turns and request_id not in rejected \
+                    and len(turns) + len(tasks) >= VOICE_MAX_OPEN_TURNS:
+                await manager.send_json({"status": "error", "error": f"Too many open turns (max {VOICE_MAX_OPEN_TURNS})",
+                                         "request_id": request_id}, websocket)
+                if audio is not None and not options.get("final", True) and len(rejected) < VOICE_MAX_OPEN_TURNS:
+                    rejected.add(request_id)
+                continue
+            if audio is not None:
+                if request_id in rejected:
+                    if options.get("final", True):
+                        rejected.discard(request_id)
+                    continue
+                turn = turns.get(request_id)
+                if turn is None:
+                    turn = turns[request_id] = new_voice_turn(websocket, request_id, options, client_id, channel)
+                    arrivals[request_id] = voice_capture.start()
+                    await manager.send_json({"status": "processing", "request_id": request_id}, websocket)
+                try:
+                    turn.add_audio(audio)
+                except VoiceLimitError as e:
+                    turns.pop(request_id).close()
+                    arrivals.pop(request_id)
+                    if not options.get("final", True):
+                        rejected.add(request_id)
+                    await manager.send_json({"status": "error", "error": str(e), "request_id": request_id},
+                                            websocket)
+                    continue
+                if options.get("final", True):
+                    start(run_turn(turns.pop(request_id), turn.run_audio(), channel, client_id,
+                                   arrivals.pop(request_id)))
+            elif options.get("continue"):
+                pending = continuations.pop(client_id, options["continue"])
+                if pending is None:
+                    await manager.send_json({"status": "error", "error": "Nothing to continue for that request",
+                                             "request_id": request_id}, websocket)
+                    continue
+                question, previous, channel = pending
+                turn = new_voice_turn(websocket, request_id, options, client_id, channel)
+                await manager.send_json({"status": "processing", "request_id": request_id}, websocket)
+                start(run_turn(turn, turn.run_text(question, continuation_prompt(question, previous)), channel,
+                               client_id, voice_capture.start(), previous))
+            elif options.get("text"):
+                turn = new_voice_turn(websocket, request_id, options, client_id, channel)
+                await manager.send_json({"status": "processing", "request_id": request_id}, websocket)
+                start(run_turn(turn, turn.run_text(options["text"]), channel, client_id, voice_capture.start()))
+            else:
+                await manager.send_json({"status": "error", "error": "No audio or text provided",
+                                         "request_id": request_id}, websocket)
+
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        for turn in turns.values():
+            turn.close()
         manager.disconnect(websocket)
 
 # Endpoint para verificar el estado del servidor
@@ -182,9 +462,216 @@ async def health_check():
 # Endpoint para probar la conexión con el agente
 @app.get("/test-agent")
 async def test_agent():
-    response = await get_agent_response("test connection")
+    response = await get_scheduled_agent_response("test connection", "test-agent", BACKGROUND)
     return response
 
+# Endpoints para consultar y recargar las definiciones de agents.toml.
+# El runner lee el archivo en cada ejecución, así que los cambios se aplican sin reiniciar.
+@app.get("/agents")
+async def list_agents():
+    try:
+        return {"agents": registry.definitions()}
+    except AgentConfigError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/agents/reload")
+async def reload_agents():
+    try:
+        invalidated = registry.reload(force=True)
+    except AgentConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if shared_state is not None:
+        await asyncio.to_thread(shared_state.publish, "agents.reload", {})
+    return {"status": "ok", "invalidated": invalidated}
+
+# Endpoints de administración para listar y descargar los perfiles recientes
+@app.get("/admin/profiles")
+async def get_profiles():
+    return {"profiles": list_profiles()}
+
+@app.get("/admin/profiles/{name}")
+async def download_profile(name: str):
+    path = os.path.join(PROFILE_DIR, os.path.basename(name))
+    if not name.endswith(PROFILE_SUFFIX) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=os.path.basename(name))
+
+def is_local_client(request: Request) -> bool:
+    try:
+        return request.client is not None and ipaddress.ip_address(request.client.host).is_loopback
+    except ValueError:
+        return False
+
+# Endpoint de administración para enviar un mensaje a todas las conexiones WebSocket,
+# también a las de los demás workers. Solo se acepta desde la propia máquina, y el
+# mensaje va envuelto en {"type": "broadcast"} para que no pase por la respuesta de un turno
+@app.post("/admin/broadcast")
+async def admin_broadcast(payload: Dict[str, Any], request: Request):
+    if not is_local_client(request):
+        raise HTTPException(status_code=403, detail="Broadcasts are only accepted from localhost")
+    await manager.broadcast_json({"type": "broadcast", "data": payload})
+    return {"status": "ok", "connections": len(manager.connections)}
+
+# Endpoint con la latencia de cola por clase de prioridad
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    return scheduler.stats()
+
+# Endpoint con los tokens y el tiempo de Ollama por agente, modelo u hora en la última ventana
+@app.get("/metrics/llm")
+async def llm_metrics(by: str = "agent", window: float = 3600.0):
+    if by not in ("agent", "model", "hour"):
+        raise HTTPException(status_code=400, detail="by must be agent, model or hour")
+    aggregates = await asyncio.to_thread(ledger_tail.aggregates, by, window)
+    return {"by": by, "window": min(window, ledger_tail.window), "aggregates": aggregates}
+
+# Endpoint con la tasa de escalado y el ahorro de latencia de la cascada de modelos
+@app.get("/metrics/cascade")
+async def cascade_metrics(window: float = 3600.0):
+    report = await asyncio.to_thread(ledger_tail.cascade, window)
+    return {"window": min(window, ledger_tail.window), "agents": report}
+
+# Endpoint con los cortes y el ahorro de tokens de los presupuestos de salida por agente y canal
+@app.get("/metrics/budget")
+async def budget_metrics(window: float = 3600.0):
+    report = await asyncio.to_thread(ledger_tail.budget, window)
+    return {"window": min(window, ledger_tail.window), "agents": report}
+
+# Embeddings con el servicio compartido del proceso: las peticiones concurrentes
+# se agrupan en lotes y los vectores se memorizan
+@app.post("/embeddings")
+async def create_embeddings(payload: Dict[str, Any]):
+    texts = payload.get("texts")
+    if not isinstance(texts, list) or not texts or not all(isinstance(text, str) for text in texts):
+        raise HTTPException(status_code=400, detail="texts must be a non-empty list of strings")
+    try:
+        vectors = await embeddings.aembed_many(texts)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Embedding error: {e}")
+    return {"model": embeddings.embedder.model, "dim": vectors.shape[1], "embeddings": vectors.tolist()}
+
+# Endpoint con el uso del LRU y el rendimiento por tamaño de lote del servicio de embeddings
+@app.get("/metrics/embeddings")
+async def embedding_metrics():
+    return embeddings.stats()
+
+# Respuesta del proxy que cierra el cuerpo pase lo que pase (también si el cliente se va
+# antes de leerlo), para devolver siempre el hueco al servidor Ollama
+class ProxiedStreamingResponse(StreamingResponse):
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+# Proxy de la API de Ollama que reparte las peticiones entre los servidores del pool.
+# Solo existe con un pool configurado y solo deja pasar las rutas de inferencia
+async def ollama_proxy(path: str, request: Request):
+    if OLLAMA_PROXY_PATHS.get("/" + path) != request.method:
+        raise HTTPException(status_code=404, detail="Not found")
+    body = await request.body()
+    try:
+        host, response, content = await ollama_pool.send(
+            ollama_http, request.method, "/" + path, body, dict(request.headers))
+    except NoHostAvailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Ollama error: {str(e) or type(e).__name__}")
+    headers = {name: value for name, value in response.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+    headers["X-Ollama-Host"] = host.url
+    return ProxiedStreamingResponse(content, status_code=response.status_code, headers=headers)
+
+if ollama_pool_configured:
+    app.add_api_route("/ollama/{path:path}", ollama_proxy, methods=["GET", "POST"])
+
+# Endpoint con el estado y las métricas de cada servidor Ollama del pool
+@app.get("/metrics/ollama")
+async def ollama_metrics():
+    return ollama_pool.stats()
+
+# Endpoint para crear un trabajo asíncrono
+@app.post("/jobs")
+async def create_job(payload: Dict[str, Any], request: Request):
+    text = payload.get("text", "")
+    if not text:
+        raise HTTPException(status_code=400, detail="No text provided")
+    params = {"client_id": client_identity(request.client.host if request.client else None, payload.get("client_id"))}
+    job = await job_manager.submit(text, params)
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+# Endpoint para consultar el estado de un trabajo
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# Endpoint WebSocket para seguir el progreso de un trabajo
+@app.websocket("/ws/jobs/{job_id}")
+async def websocket_job(websocket: WebSocket, job_id: str, after: int = 0):
+    await manager.connect(websocket)
+    # Suscribirse antes de leer el histórico para no perder eventos
+    queue = job_manager.subscribe(job_id)
+    # El progreso se transmite en una tarea aparte; aquí solo se leen los pongs del cliente
+    stream_task = asyncio.create_task(stream_job_events(websocket, job_id, after, queue))
+    try:
+        while True:
+            await manager.receive(websocket)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        stream_task.cancel()
+        job_manager.unsubscribe(job_id, queue)
+        manager.disconnect(websocket)
+
+async def stream_job_events(websocket, job_id, after, queue):
+    job = await job_manager.get(job_id)
+    if job is None:
+        await manager.send_json({"status": "error", "error": "Job not found"}, websocket)
+        await manager.close(websocket)
+        return
+
+    # Reenviar los eventos que el cliente todavía no ha visto
+    last_seq = after
+    for event in await job_manager.events(job_id, after):
+        await manager.send_json(event, websocket)
+        last_seq = event["seq"]
+        if event["status"] in FINISHED_STATES:
+            await manager.close(websocket)
+            return
+
+    # Transmitir los eventos nuevos hasta que el trabajo termine
+    while True:
+        try:
+            events = [await asyncio.wait_for(queue.get(), JOB_EVENT_POLL_SECONDS)]
+        except asyncio.TimeoutError:
+            # El trabajo puede estar ejecutándose en otro worker: leer sus eventos del almacén
+            events = await job_manager.events(job_id, last_seq)
+        for event in events:
+            if event["seq"] <= last_seq:
+                continue
+            await manager.send_json(event, websocket)
+            last_seq = event["seq"]
+            if event["status"] in FINISHED_STATES:
+                await manager.close(websocket)
+                return
+
+# Endpoint con el estado de las conexiones WebSocket
+@app.get("/connections/stats")
+async def connection_stats():
+    if shared_state is not None:
+        return await asyncio.to_thread(manager.stats)
+    return manager.stats()
+
+# Endpoint con los workers vivos (solo con estado compartido)
+@app.get("/workers")
+async def list_workers():
+    if shared_state is None:
+        me = worker_id()
+        return {"worker": me, "workers": [{"worker": me, "pid": os.getpid(), "connections": len(manager.connections)}]}
+    return {"worker": shared_state.worker, "workers": await asyncio.to_thread(shared_state.workers)}
+
 # HTML simple para pruebas de WebSocket
 @app.get("/", response_class=HTMLResponse)
 async def get():
@@ -202,8 +689,12 @@ async def get():
             </form>
             <ul id="messages"></ul>
             <script>
-                var ws = new WebSocket("ws://" + window.location.host + "/ws/agent");
+                var ws = new WebSocket("ws://" + window.location.host + "/ws/agent?heartbeat=1");
                 ws.onmessage = function(event) {
+                    if (JSON.parse(event.data).type === "ping") {
+                        ws.send(JSON.stringify({"type": "pong"}));
+                        return;
+                    }
                     var messages = document.getElementById('messages');
                     var message = document.createElement('li');
                     var content = document.createTextNode(event.data);
@@ -227,4 +718,9 @@ async def get():
 # Iniciar el servidor
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # permessage-deflate comprime los frames de los clientes que lo negocian, y el ping del
+    # protocolo WebSocket cierra las conexiones de los clientes caídos.
+    # Con varios workers uvicorn necesita la aplicación como "módulo:atributo"
+    uvicorn.run("app:app" if WORKERS > 1 else app, host="0.0.0.0", port=PORT, workers=WORKERS, ws="websockets",
+                ws_per_message_deflate=os.environ.get("BOB_WS_DEFLATE", "1") == "1",
+                ws_ping_interval=WS_HEARTBEAT_INTERVAL, ws_ping_timeout=WS_HEARTBEAT_TIMEOUT)
\ No newline at end of file
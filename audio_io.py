@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Audio en memoria para los clientes Streamlit, sin archivos temporales.
+Las grabaciones WAV se decodifican directamente a un array de NumPy a 16 kHz
+(lo que espera Whisper); otros formatos pasan por ffmpeg mediante pipes. La
+voz sintetizada con gTTS se escribe en un buffer de bytes para `st.audio`.
+"""
+
+import io
+import subprocess
+import wave
+
+import numpy as np
+
+from audio_preprocess import SAMPLE_RATE, resample, to_mono
+
+_WAV_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+def is_wav(data: bytes) -> bool:
+    return data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+
+
+def decode_audio(data: bytes) -> np.ndarray:
+    """Devuelve el audio como float32 mono a 16 kHz, en [-1, 1]."""
+    if is_wav(data):
+        try:
+            return decode_wav(data)
+        except (wave.Error, ValueError):
+            pass  # WAV no PCM (p. ej. float o comprimido): que lo decodifique ffmpeg
+    return decode_with_ffmpeg(data)
+
+
+def decode_wav(data: bytes) -> np.ndarray:
+    with wave.open(io.BytesIO(data)) as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+
+    if width == 3:
+        # 24 bits: ampliar cada muestra a 32 bits
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        samples = (raw[:, 0].astype(np.int32) << 8 | raw[:, 1].astype(np.int32) << 16
+                   | raw[:, 2].astype(np.int32) << 24)
+        audio = samples.astype(np.float32) / 2 ** 31
+    elif width in _WAV_DTYPES:
+        samples = np.frombuffer(frames, dtype=_WAV_DTYPES[width])
+        if width == 1:
+            audio = (samples.astype(np.float32) - 128) / 128
+        else:
+            audio = samples.astype(np.float32) / float(2 ** (8 * width - 1))
+    else:
+        raise ValueError(f"Unsupported sample width: {width}")
+
+    return resample(to_mono(audio.reshape(-1, channels)), rate, SAMPLE_RATE)
+
+
+def decode_with_ffmpeg(data: bytes) -> np.ndarray:
+    # Entrada y salida por pipes: el audio no pasa por el disco
+    result = subprocess.run(
+        ["ffmpeg", "-nostdin", "-threads", "0", "-i", "pipe:0",
+         "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "pipe:1"],
+        input=data, capture_output=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to decode audio: {result.stderr.decode(errors='replace')[-500:]}")
+    return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def synthesize_speech(text: str, lang: str = "es") -> bytes:
+    """MP3 con la voz de gTTS, en memoria."""
+    from gtts import gTTS
+
+    buffer = io.BytesIO()
+    gTTS(text=text, lang=lang, slow=False).write_to_fp(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Preprocesado vectorizado del audio antes de Whisper.
+
+Las grabaciones del navegador llegan con silencio al principio y al final y a
+veces en estéreo a 48 kHz. Aquí se pasan a mono a 16 kHz, se normaliza el
+volumen y se recorta el silencio con un VAD por energía. Los clips largos se
+pueden partir en las pausas para transcribir los trozos en un solo lote.
+"""
+
+import os
+from typing import List
+
+import numpy as np
+
+# Frecuencia de muestreo que espera Whisper
+SAMPLE_RATE = 16000
+# Coeficientes del filtro paso bajo previo al remuestreo
+RESAMPLE_TAPS = 63
+
+# VAD por energía: tramas de 30 ms; una trama es voz si supera el ruido de fondo en este margen
+VAD_FRAME_SECONDS = 0.03
+VAD_MARGIN_DB = float(os.environ.get("BOB_VAD_MARGIN_DB", 12))
+VAD_MIN_DB = -55.0
+# Si el VAD se queda con menos de esta fracción de las tramas audibles, no hay pausas que
+# den el ruido de fondo (habla continua): el percentil 10 es la propia voz
+VAD_MIN_KEEP_RATIO = 0.1
+# Silencio que se conserva alrededor de la voz al recortar
+VAD_PADDING_SECONDS = 0.2
+
+# Volumen objetivo (RMS de las tramas con voz) y ganancia máxima
+TARGET_DBFS = float(os.environ.get("BOB_AUDIO_TARGET_DBFS", -20))
+MAX_GAIN_DB = 30.0
+
+# Trozos de como mucho una ventana de Whisper, cortados en pausas de al menos 300 ms
+CHUNK_MAX_SECONDS = 30.0
+CHUNK_MIN_SECONDS = 5.0
+MIN_PAUSE_SECONDS = 0.3
+
+
+def to_mono(audio: np.ndarray) -> np.ndarray:
+    """`audio` con forma (muestras,) o (muestras, canales)."""
+    if audio.ndim == 2:
+        audio = audio.mean(axis=1)
+    return audio.astype(np.float32, copy=False)
+
+
+def resample(audio: np.ndarray, rate: int, target: int = SAMPLE_RATE) -> np.ndarray:
+    if rate == target or len(audio) == 0:
+        return audio.astype(np.float32, copy=False)
+    if target < rate:
+        # Filtro paso bajo (sinc con ventana de Hamming) para evitar aliasing al reducir
+        cutoff = target / rate / 2
+        n = np.arange(RESAMPLE_TAPS) - (RESAMPLE_TAPS - 1) / 2
+        taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(RESAMPLE_TAPS)
+        audio = np.convolve(audio, taps / taps.sum(), mode="same")
+    duration = len(audio) / rate
+    positions = np.arange(int(duration * target)) * (rate / target)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+
+def frame_energy_db(audio: np.ndarray, rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Energía RMS en dBFS de cada trama de VAD_FRAME_SECONDS."""
+    frame = int(rate * VAD_FRAME_SECONDS)
+    frames = len(audio) // frame
+    if frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    blocks = audio[:frames * frame].reshape(frames, frame)
+    rms = np.sqrt(np.mean(np.square(blocks, dtype=np.float32), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def speech_frames(energy_db: np.ndarray) -> np.ndarray:
+    """Máscara de tramas con voz: por encima del ruido de fondo (percentil 10) más un margen.
+
+    Si así apenas queda nada de un clip con voz clara (habla sin pausas ni silencio
+    alrededor), cuenta como voz todo lo que supera VAD_MIN_DB. Un clip en silencio o
+    solo con ruido de fondo, sin nada VAD_MARGIN_DB por encima de VAD_MIN_DB, queda vacío.
+    """
+    if len(energy_db) == 0:
+        return np.zeros(0, dtype=bool)
+    noise_floor = np.percentile(energy_db, 10)
+    speech = energy_db > max(noise_floor + VAD_MARGIN_DB, VAD_MIN_DB)
+    audible = energy_db > VAD_MIN_DB
+    if (energy_db.max() > VAD_MIN_DB + VAD_MARGIN_DB
+            and np.count_nonzero(speech) < VAD_MIN_KEEP_RATIO * np.count_nonzero(audible)):
+        return audible
+    return speech
+
+
+def normalize_loudness(audio: np.ndarray, speech: np.ndarray, rate: int = SAMPLE_RATE) -> np.ndarray:
+    frame = int(rate * VAD_FRAME_SECONDS)
+    if not speech.any():
+        return audio
+    blocks = audio[:len(speech) * frame].reshape(len(speech), frame)[speech]
+    rms = float(np.sqrt(np.mean(np.square(blocks, dtype=np.float32))))
+    gain = min(10 ** ((TARGET_DBFS - 20 * np.log10(max(rms, 1e-10))) / 20), 10 ** (MAX_GAIN_DB / 20))
+    # Sin recortar picos
+    peak = float(np.max(np.abs(audio)))
+    if peak > 0:
+        gain = min(gain, 0.99 / peak)
+    return (audio * gain).astype(np.float32)
+
+
+def trim_silence(audio: np.ndarray, speech: np.ndarray, rate: int = SAMPLE_RATE) -> np.ndarray:
+    if not speech.any():
+        return audio[:0]
+    frame = int(rate * VAD_FRAME_SECONDS)
+    indices = np.flatnonzero(speech)
+    padding = int(rate * VAD_PADDING_SECONDS)
+    start = max(indices[0] * frame - padding, 0)
+    end = min((indices[-1] + 1) * frame + padding, len(audio))
+    return audio[start:end]
+
+
+def preprocess(audio: np.ndarray, rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Mono, 16 kHz, volumen normalizado y sin silencio al principio ni al final."""
+    audio = resample(to_mono(audio), rate)
+    speech = speech_frames(frame_energy_db(audio))
+    return trim_silence(normalize_loudness(audio, speech), speech)
+
+
+def split_at_pauses(audio: np.ndarray, rate: int = SAMPLE_RATE,
+                    max_seconds: float = CHUNK_MAX_SECONDS) -> List[np.ndarray]:
+    """Parte el clip en trozos de como mucho `max_seconds`, cortando en mitad de las pausas."""
+    if len(audio) <= max_seconds * rate:
+        return [audio]
+    frame = int(rate * VAD_FRAME_SECONDS)
+    speech = speech_frames(frame_energy_db(audio, rate))
+
+    # Centro (en muestras) de cada racha de silencio suficientemente larga
+    edges = np.diff(np.concatenate(([0], (~speech).astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    long_pauses = (ends - starts) * VAD_FRAME_SECONDS >= MIN_PAUSE_SECONDS
+    cut_points = ((starts + ends) // 2 * frame)[long_pauses]
+
+    chunks = []
+    start = 0
+    max_samples = int(max_seconds * rate)
+    min_samples = int(CHUNK_MIN_SECONDS * rate)
+    while len(audio) - start > max_samples:
+        candidates = cut_points[(cut_points > start + min_samples) & (cut_points <= start + max_samples)]
+        # La última pausa que cabe; si no hay ninguna, corte duro
+        cut = int(candidates[-1]) if len(candidates) else start + max_samples
+        chunks.append(audio[start:cut])
+        start = cut
+    chunks.append(audio[start:])
+    return chunks
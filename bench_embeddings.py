@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark del servicio de embeddings: rendimiento con distintos tamaños máximos
+de lote para la misma carga concurrente, y el de una segunda pasada servida
+desde el LRU.
+
+Usa el modelo configurado (BOB_EMBED_BACKEND / BOB_EMBED_MODEL); con `--fake`
+arranca un servidor de fake_ollama.py y mide contra él.
+
+Uso:
+    python bench_embeddings.py [--batch-sizes 1 8 32] [--texts 512] [--concurrency 64]
+    python bench_embeddings.py --fake
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from embeddings import EmbeddingService, create_embedder
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_fake_ollama():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "fake_ollama.py"), "--ports", str(port),
+                                "--load-time", "0"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1.0)
+    return f"http://127.0.0.1:{port}", process
+
+
+def sample_texts(count):
+    subjects = ["la cocina", "el baño", "el salón", "la terraza", "el dormitorio", "el pasillo"]
+    tasks = ["pintar", "renovar", "iluminar", "amueblar", "reformar", "limpiar"]
+    return [f"Quiero {tasks[i % len(tasks)]} {subjects[(i // len(tasks)) % len(subjects)]} (consulta {i})"
+            for i in range(count)]
+
+
+def run(batch_size, texts, concurrency):
+    service = EmbeddingService(create_embedder(), batch_size=batch_size, cache_size=len(texts))
+    # Calentamiento (carga del modelo) fuera de la medida
+    service.embed("calentamiento")
+    try:
+        with ThreadPoolExecutor(concurrency) as pool:
+            started = time.perf_counter()
+            list(pool.map(service.embed, texts))
+            cold = time.perf_counter() - started
+            started = time.perf_counter()
+            list(pool.map(service.embed, texts))
+            warm = time.perf_counter() - started
+        return {
+            "batch_size": batch_size,
+            "texts_per_s": round(len(texts) / cold, 1),
+            "cached_texts_per_s": round(len(texts) / warm, 1),
+            "batches": service.stats()["batches"],
+        }
+    finally:
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del servicio de embeddings")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16, 32, 64])
+    parser.add_argument("--texts", type=int, default=512, help="textos distintos por ejecución")
+    parser.add_argument("--concurrency", type=int, default=64, help="peticiones simultáneas")
+    parser.add_argument("--fake", action="store_true", help="medir contra un servidor de fake_ollama.py")
+    parser.add_argument("--json", action="store_true", help="salida en JSON")
+    args = parser.parse_args()
+
+    fake = None
+    if args.fake:
+        os.environ["BOB_OLLAMA_HOST"], fake = start_fake_ollama()
+    texts = sample_texts(args.texts)
+    results = []
+    try:
+        for batch_size in args.batch_sizes:
+            results.append(run(batch_size, texts, args.concurrency))
+            if not args.json:
+                r = results[-1]
+                print(f"batch_size={r['batch_size']:<4} {r['texts_per_s']:>9.1f} textos/s  "
+                      f"(LRU: {r['cached_texts_per_s']:.1f} textos/s)", flush=True)
+                for size, s in r["batches"].items():
+                    print(f"    lotes de {size:<3} x{s['batches']:<5} {s['ms_per_batch']:>8.1f} ms/lote  "
+                          f"{s['texts_per_s'] or 0:>9.1f} textos/s")
+    finally:
+        if fake is not None:
+            fake.terminate()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Benchmark del preprocesado de audio antes de Whisper: tiempo de transcripción
+y precisión (WER) sin preprocesado, con preprocesado y con trozos en lote,
+sobre un conjunto de clips de referencia.
+
+Cada clip es un par `<nombre>.wav` + `<nombre>.txt` (la transcripción esperada)
+en fixtures/audio (o BOB_AUDIO_FIXTURES). `--generate` crea un conjunto con
+gTTS que imita las grabaciones del navegador: estéreo a 48 kHz, con silencio
+y ruido al principio y al final, y un clip de habla continua sin silencio
+alrededor (el caso en que el VAD no tiene ruido de fondo de referencia). Sin
+acceso a gTTS, `--synthetic` genera los mismos clips con una señal parecida a
+la voz (sílabas armónicas); sirven para medir el audio que se recorta y el
+tiempo, no la precisión.
+
+Uso:
+    python bench_preprocess.py --generate [--synthetic]
+    python bench_preprocess.py [--model base] [--repeat 3]
+"""
+
+import argparse
+import glob
+import os
+import re
+import time
+import wave
+
+import numpy as np
+
+import audio_io
+from audio_preprocess import SAMPLE_RATE, resample
+from whisper_pool import WhisperPool
+
+FIXTURES_DIR = os.environ.get("BOB_AUDIO_FIXTURES", os.path.join(os.getcwd(), "fixtures", "audio"))
+
+PHRASES = {
+    "saludo": "Hola, buenos días",
+    "confirmacion": "Sí, adelante",
+    "cocina": "Quiero renovar la cocina y cambiar los muebles por unos más modernos",
+    "stock": "Cuántas unidades de stock quedan de los muebles de cocina",
+    "bano": "Necesito instrucciones paso a paso para cambiar el grifo del baño",
+    "salon": ("Estoy pensando en pintar el salón de un color claro, cambiar el suelo de madera "
+              "y poner estanterías nuevas. Qué me recomiendas para que el espacio parezca más grande "
+              "y tenga más luz natural durante el día"),
+}
+
+# (nombre, limpiar, trozos)
+VARIANTS = [("raw", False, False), ("preprocessed", True, False), ("preprocessed+split", True, True)]
+
+
+def _write_fixture(directory, name, audio, rate, text):
+    stereo = np.repeat(np.clip(audio, -1, 1)[:, None], 2, axis=1)
+    with wave.open(os.path.join(directory, f"{name}.wav"), "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes((stereo * 32767).astype(np.int16).tobytes())
+    with open(os.path.join(directory, f"{name}.txt"), "w") as f:
+        f.write(text + "\n")
+    print(f"  {name}.wav ({len(audio) / rate:.1f}s)")
+
+
+def synthetic_speech(text, rate, rng):
+    """Señal parecida a la voz: una sílaba armónica por vocal, con pausas cortas entre palabras."""
+    pieces = []
+    for word in text.split():
+        for _ in range(max(1, len(re.findall(r"[aeiouáéíóú]", word.lower())))):
+            samples = int(rate * rng.uniform(0.12, 0.22))
+            t = np.arange(samples) / rate
+            f0 = rng.uniform(110, 220)
+            tone = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 6))
+            pieces.append(0.5 * tone * np.sin(np.pi * np.arange(samples) / samples) ** 0.5)
+        pieces.append(np.zeros(int(rate * rng.uniform(0.02, 0.06))))
+    return np.concatenate(pieces)
+
+
+def generate_fixtures(directory, synthetic=False):
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(0)
+    rate = 48000
+    # Silencio con algo de ruido, a un volumen bajo como el de un micro de portátil
+    noise = lambda samples: 0.002 * rng.standard_normal(samples)
+    pieces = []
+    for name, text in PHRASES.items():
+        if synthetic:
+            speech = 0.3 * synthetic_speech(text, rate, rng)
+        else:
+            mp3 = audio_io.synthesize_speech(text, "es")
+            speech = 0.3 * resample(audio_io.decode_with_ffmpeg(mp3), SAMPLE_RATE, rate)
+        pieces.append(speech)
+        lead, tail = int(rng.uniform(1.0, 2.5) * rate), int(rng.uniform(1.5, 3.0) * rate)
+        _write_fixture(directory, name, np.concatenate([noise(lead), speech + noise(len(speech)), noise(tail)]),
+                       rate, text)
+
+    # Un clip largo (más de una ventana de Whisper) con pausas entre frases, para probar los trozos
+    pause = int(0.8 * rate)
+    long_audio = np.concatenate([np.concatenate([p + noise(len(p)), noise(pause)]) for p in pieces * 2])
+    _write_fixture(directory, "descripcion_larga", np.concatenate([noise(rate), long_audio]), rate,
+                   " ".join(list(PHRASES.values()) * 2))
+
+    # Habla continua, sin silencio alrededor ni pausas largas: el VAD no debe descartarla
+    _write_fixture(directory, "continua", np.concatenate(pieces[2:5]), rate,
+                   " ".join(list(PHRASES.values())[2:5]))
+
+
+def normalize_words(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def word_error_rate(reference, hypothesis):
+    ref, hyp = normalize_words(reference), normalize_words(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    # Distancia de edición entre listas de palabras
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def load_fixtures(directory):
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.wav"))):
+        reference_path = os.path.splitext(path)[0] + ".txt"
+        if not os.path.exists(reference_path):
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(reference_path) as f:
+            fixtures.append((os.path.basename(path), data, f.read().strip()))
+    return fixtures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del preprocesado de audio")
+    parser.add_argument("--generate", action="store_true", help="generar los clips de referencia con gTTS")
+    parser.add_argument("--synthetic", action="store_true", help="con --generate, clips sintéticos sin gTTS")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--model", default="base", help="tamaño del modelo Whisper")
+    parser.add_argument("--repeat", type=int, default=1, help="repeticiones de cada clip")
+    args = parser.parse_args()
+
+    if args.generate:
+        print(f"Generando clips en {args.fixtures}")
+        generate_fixtures(args.fixtures, args.synthetic)
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f"No hay clips en {args.fixtures} (use --generate)")
+
+    pool = WhisperPool()
+    pool.get(args.model)
+    decoded = [(name, audio_io.decode_audio(data), reference) for name, data, reference in fixtures]
+    # Calentamiento para no medir la primera inferencia
+    pool.transcribe(decoded[0][1], args.model, clean=False)
+
+    print(f"\nModelo {args.model}, {len(fixtures)} clips, {args.repeat} repeticiones\n")
+    print(f"{'variant':<20}{'audio_s':>10}{'speech_s':>10}{'time_s':>10}{'rtf':>8}{'wer':>8}")
+    totals = {}
+    for variant, clean, split in VARIANTS:
+        audio_seconds = speech_seconds = elapsed = errors = 0.0
+        for name, audio, reference in decoded:
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                result = pool.transcribe(audio, args.model, clean=clean, split=split)
+                elapsed += time.perf_counter() - started
+            audio_seconds += result["original_duration"] * args.repeat
+            speech_seconds += result["duration"] * args.repeat
+            errors += word_error_rate(reference, result["text"])
+        wer = errors / len(decoded)
+        totals[variant] = elapsed
+        print(f"{variant:<20}{audio_seconds:>10.1f}{speech_seconds:>10.1f}{elapsed:>10.2f}"
+              f"{elapsed / audio_seconds:>8.3f}{wer:>8.3f}")
+
+    baseline = totals["raw"]
+    for variant, elapsed in totals.items():
+        if variant != "raw" and elapsed:
+            print(f"{variant}: {baseline / elapsed:.2f}x más rápido que raw")
+
+
+if __name__ == "__main__":
+    main()
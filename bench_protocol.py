@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark del protocolo WebSocket: compara JSON y msgpack en bytes por frame
+(con y sin permessage-deflate) y en tiempo de CPU por frame (codificar + decodificar).
+
+Uso: python bench_protocol.py [iteraciones]
+"""
+
+import base64
+import json
+import os
+import sys
+import time
+import zlib
+
+import wire_protocol
+
+ANSWER = ("Para renovar la cocina primero hay que medir el espacio disponible, "
+          "después elegir los muebles y finalmente planificar la instalación. ") * 20
+
+
+def sample_frames():
+    """Frames representativos del tráfico de /ws/agent."""
+    audio = os.urandom(32 * 1024)
+    return {
+        "processing": ({"status": "processing", "message": "Processing your request...", "request_id": "a1b2c3"}, None),
+        "chunk": ({"type": "chunk", "request_id": "a1b2c3", "seq": 42, "text": "después elegir los muebles "}, None),
+        "timings": ({"type": "timings", "request_id": "a1b2c3",
+                     "stages": {"queue_ms": 12.5, "agent_ms": 5321.7, "tts_ms": 811.2, "total_ms": 6145.4}}, None),
+        "response": ({"status": "success", "request_id": "a1b2c3", "response": ANSWER}, None),
+        "audio_32k": ({"type": "audio", "request_id": "a1b2c3", "seq": 1, "format": "mp3"}, audio),
+    }
+
+
+def deflate_size(frame):
+    # permessage-deflate: DEFLATE crudo sin los 4 bytes finales del flush (RFC 7692)
+    data = frame.encode() if isinstance(frame, str) else frame
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    return len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def encode_frame(header, audio, protocol, raw_audio):
+    if audio is None:
+        return wire_protocol.encode(header, protocol)
+    if raw_audio:
+        return wire_protocol.encode_audio(header, audio, protocol)
+    # Sin frames binarios el audio tiene que viajar en base64 dentro del mensaje
+    return wire_protocol.encode({**header, "data": base64.b64encode(audio).decode()}, protocol)
+
+
+def decode_frame(frame, protocol, raw_audio):
+    if raw_audio and wire_protocol.is_audio(frame):
+        return wire_protocol.decode_audio(frame, protocol)
+    return wire_protocol.decode(frame, protocol)
+
+
+def bench(iterations):
+    variants = [("json", wire_protocol.JSON, False), ("json+binary-audio", wire_protocol.JSON, True)]
+    if wire_protocol.MSGPACK in wire_protocol.available_protocols():
+        variants.append(("msgpack+binary-audio", wire_protocol.MSGPACK, True))
+    else:
+        print("msgpack no está instalado: solo se mide JSON\n")
+
+    print(f"{'frame':<12} {'variant':<22} {'bytes':>8} {'deflate':>8} {'us/frame':>10}")
+    for name, (header, audio) in sample_frames().items():
+        for label, protocol, raw_audio in variants:
+            if audio is None and raw_audio and protocol == wire_protocol.JSON:
+                # Sin audio es idéntico a "json"
+                continue
+            frame = encode_frame(header, audio, protocol, raw_audio)
+            size = len(frame.encode() if isinstance(frame, str) else frame)
+            start = time.process_time()
+            for _ in range(iterations):
+                decode_frame(encode_frame(header, audio, protocol, raw_audio), protocol, raw_audio)
+            cpu_us = (time.process_time() - start) / iterations * 1e6
+            print(f"{name:<12} {label:<22} {size:>8} {deflate_size(frame):>8} {cpu_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Benchmark del arranque del agent runner: tiempo de importación y de construcción
+de los agentes, cada medida en un proceso nuevo.
+
+- eager: construye todos los agentes de agents.toml (lo que hacía agents.py antes)
+- lazy import: solo importa agents.py
+- lazy <clave>: importa agents.py y construye un único agente (y su equipo)
+
+Uso: python bench_startup.py [repeticiones] [clave ...]
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+
+SNIPPET = """
+import json, time
+t0 = time.perf_counter()
+import agents
+from agent_registry import registry
+t1 = time.perf_counter()
+keys = {keys!r}
+if keys == "*":
+    keys = registry.names()
+for key in keys:
+    registry.get(key)
+t2 = time.perf_counter()
+print(json.dumps({{"import": t1 - t0, "construct": t2 - t1}}))
+"""
+
+
+def measure(keys, repeat):
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", SNIPPET.format(keys=keys)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return (statistics.median(s["import"] for s in samples),
+            statistics.median(s["construct"] for s in samples))
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    single = sys.argv[2:] or ["constructor_de_recetas", "bob_team"]
+
+    scenarios = [("eager (before)", "*"), ("lazy import", [])]
+    scenarios += [(f"lazy {key}", [key]) for key in single]
+
+    print(f"{'scenario':<32} {'import ms':>10} {'construct ms':>13} {'total ms':>10}")
+    for label, keys in scenarios:
+        import_s, construct_s = measure(keys, repeat)
+        print(f"{label:<32} {import_s * 1000:>10.1f} {construct_s * 1000:>13.1f} {(import_s + construct_s) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Benchmark del servidor con varios workers: arranca app.py con BOB_WORKERS = 1..N
+y mide el rendimiento del front-end asíncrono con carga HTTP concurrente.
+
+Escenarios:
+    health     GET /health (coste mínimo por petición)
+    ollama     POST /ollama/api/generate con streaming a través del proxy, contra
+               servidores de fake_ollama.py (un proceso por servidor)
+    broadcast  POST /admin/broadcast con conexiones WebSocket abiertas en todos
+               los workers (incluye la entrega por el bus del estado compartido)
+
+Cada ejecución usa un directorio temporal propio para jobs.db y shared_state.db.
+La carga la generan varios procesos cliente para que no sean ellos el cuello de
+botella; con pocos núcleos el resultado no puede escalar.
+
+Uso:
+    python bench_workers.py [--workers 1 2 4] [--scenario health] [--duration 10]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ("health", "ollama", "broadcast")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_workers(base_url, workers, timeout=30.0):
+    """Espera a que el servidor responda y a que estén registrados todos los workers."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = httpx.get(f"{base_url}/workers", timeout=1.0)
+            if response.status_code == 200 and len(response.json()["workers"]) >= workers:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"El servidor no arrancó {workers} workers en {timeout:.0f}s")
+
+
+def start_fake_ollama(count, tokens):
+    ports = [free_port() for _ in range(count)]
+    processes = [
+        subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "fake_ollama.py"), "--ports", str(port),
+                          "--load-time", "0", "--token-time", "0", "--tokens", str(tokens)],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for port in ports
+    ]
+    return ports, processes
+
+
+def start_server(workers, port, workdir, env_extra):
+    env = {**os.environ, **env_extra, "BOB_WORKERS": str(workers), "BOB_PORT": str(port),
+           "PYTHONPATH": REPO_DIR + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    with open(os.path.join(workdir, "server.log"), "wb") as log:
+        return subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "app.py")], cwd=workdir, env=env,
+                                stdout=log, stderr=subprocess.STDOUT)
+
+
+async def _client_load(base_url, scenario, concurrency, duration):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    body = json.dumps({"model": "llama3.2:3b", "prompt": "hola", "stream": True})
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        async def request():
+            if scenario == "health":
+                response = await client.get("/health")
+            elif scenario == "ollama":
+                response = await client.post("/ollama/api/generate", content=body)
+            else:
+                response = await client.post("/admin/broadcast", json={"type": "bench", "ts": time.time()})
+            response.raise_for_status()
+
+        async def loop():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    await request()
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return latencies, errors
+
+
+def client_process(args):
+    return asyncio.run(_client_load(*args))
+
+
+def open_websockets(base_url, count):
+    """Conexiones WebSocket que reciben los broadcasts; el servidor las reparte entre los workers."""
+    import websocket
+
+    ws_url = base_url.replace("http://", "ws://") + "/ws/agent"
+    return [websocket.create_connection(ws_url, timeout=5) for _ in range(count)]
+
+
+def run(workers, args, env_extra):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory(prefix="bob-bench-") as workdir:
+        server = start_server(workers, port, workdir, env_extra)
+        sockets = []
+        try:
+            wait_for_workers(base_url, workers)
+            if args.scenario == "broadcast":
+                sockets = open_websockets(base_url, args.websockets)
+            # Calentamiento
+            client_process((base_url, args.scenario, 4, 1.0))
+
+            per_client = max(1, args.concurrency // args.clients)
+            jobs = [(base_url, args.scenario, per_client, args.duration)] * args.clients
+            with multiprocessing.Pool(args.clients) as pool:
+                results = pool.map(client_process, jobs)
+        finally:
+            for ws in sockets:
+                ws.close()
+            server.terminate()
+            server.wait(timeout=30)
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / args.duration,
+        "p50_ms": 1000 * statistics.median(latencies) if latencies else 0.0,
+        "p95_ms": 1000 * latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de escalado con varios workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--scenario", choices=SCENARIOS, default="health")
+    parser.add_argument("--duration", type=float, default=10.0, help="segundos de carga por ejecución")
+    parser.add_argument("--concurrency", type=int, default=64, help="peticiones simultáneas en total")
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help="procesos que generan la carga")
+    parser.add_argument("--fake-hosts", type=int, default=2, help="servidores fake_ollama (escenario ollama)")
+    parser.add_argument("--tokens", type=int, default=20, help="tokens por respuesta (escenario ollama)")
+    parser.add_argument("--websockets", type=int, default=32, help="conexiones abiertas (escenario broadcast)")
+    parser.add_argument("--json", action="store_true", help="salida en JSON")
+    args = parser.parse_args()
+
+    env_extra = {}
+    fake_processes = []
+    config_dir = tempfile.TemporaryDirectory(prefix="bob-bench-hosts-")
+    if args.scenario == "ollama":
+        ports, fake_processes = start_fake_ollama(args.fake_hosts, args.tokens)
+        config_path = os.path.join(config_dir.name, "ollama_hosts.toml")
+        with open(config_path, "w") as f:
+            f.write(f"[defaults]\nmax_concurrency = {args.concurrency}\n")
+            for port in ports:
+                f.write(f'\n[[hosts]]\nurl = "http://127.0.0.1:{port}"\nmodels = ["*"]\n')
+        env_extra["BOB_OLLAMA_HOSTS_CONFIG"] = config_path
+        time.sleep(1.0)
+
+    results = []
+    try:
+        for workers in args.workers:
+            results.append(run(workers, args, env_extra))
+            if not args.json:
+                r = results[-1]
+                print(f"workers={r['workers']:<3} rps={r['rps']:>9.1f}  p50={r['p50_ms']:>7.2f}ms  "
+                      f"p95={r['p95_ms']:>7.2f}ms  errors={r['errors']}", flush=True)
+    finally:
+        for process in fake_processes:
+            process.terminate()
+        config_dir.cleanup()
+
+    baseline = results[0]["rps"] if results and results[0]["rps"] else None
+    for r in results:
+        r["speedup"] = r["rps"] / baseline if baseline else None
+    if args.json:
+        print(json.dumps({"scenario": args.scenario, "cpus": os.cpu_count(), "results": results}, indent=2))
+    else:
+        print(f"\nEscenario {args.scenario}, {os.cpu_count()} CPUs, {args.clients} procesos cliente")
+        for r in results:
+            print(f"  {r['workers']} workers: {r['speedup']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
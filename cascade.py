@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Cascada de modelos: cada agente con `draft_model` en agents.toml responde
+primero con ese modelo pequeño y solo se usa el modelo configurado cuando un
+verificador barato rechaza el borrador.
+
+Verificadores:
+- "sql": extrae la consulta y la compila con EXPLAIN sobre un SQLite en memoria.
+  Sin `sql_schema` solo cuenta la sintaxis; con él, también que las tablas y
+  columnas existan.
+- "text": heurísticas de longitud y formato (vacío, truncado, repeticiones,
+  llamadas a herramientas escritas como texto).
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from typing import Optional
+
+# Activa la cascada para los agentes que tengan draft_model
+CASCADE_ENABLED = os.environ.get("BOB_CASCADE", "0").lower() not in ("0", "false", "no", "")
+# Longitud máxima de un borrador de texto aceptable (caracteres)
+CASCADE_MAX_CHARS = int(os.environ.get("BOB_CASCADE_MAX_CHARS", 4000))
+
+SQL = "sql"
+TEXT = "text"
+VERIFIERS = (SQL, TEXT)
+
+# Resultado de cada llamada en el ledger
+ACCEPTED = "accepted"
+REJECTED = "rejected"
+ESCALATED = "escalated"
+# El borrador lanzó una excepción (p. ej. el modelo no está) y se escaló sin verificarlo
+FAILED = "failed"
+
+_SQL_FENCE = re.compile(r"```(?:sql)?\s*(.*?)```", re.IGNORECASE | re.DOTALL)
+_SQL_START = re.compile(r"\b(SELECT|WITH|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+_TOOL_CALL_TEXT = re.compile(r'^\s*\{\s*"(name|function|tool)"\s*:', re.IGNORECASE)
+
+# Errores de resolución de nombres: sin esquema no cuentan, la base está vacía
+_NAME_ERRORS = ("no such table", "no such column", "no such function", "no such module", "no such collation")
+
+# Una conexión en memoria por esquema (None = base vacía), compartida entre hilos
+_schema_connections = {}
+_schema_lock = threading.Lock()
+
+
+def extract_sql(text: str) -> Optional[str]:
+    match = _SQL_FENCE.search(text)
+    if match:
+        text = match.group(1)
+    start = _SQL_START.search(text)
+    if not start:
+        return None
+    # Hasta el primer ';' o el final
+    return text[start.start():].split(";")[0].strip()
+
+
+def _schema_connection(schema_path: Optional[str]) -> sqlite3.Connection:
+    conn = _schema_connections.get(schema_path)
+    if conn is None:
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        if schema_path:
+            with open(schema_path) as f:
+                conn.executescript(f.read())
+        _schema_connections[schema_path] = conn
+    return conn
+
+
+def verify_sql(text: str, schema_path: Optional[str] = None) -> Optional[str]:
+    sql = extract_sql(text)
+    if not sql:
+        return "no SQL statement found"
+    try:
+        # EXPLAIN compila la consulta sin ejecutarla
+        with _schema_lock:
+            _schema_connection(schema_path).execute("EXPLAIN " + sql)
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        if schema_path:
+            return f"schema check failed: {e}"
+        if not str(e).startswith(_NAME_ERRORS):
+            return f"invalid SQL: {e}"
+    return None
+
+
+def verify_text(text: str, done_reason: Optional[str] = None) -> Optional[str]:
+    stripped = text.strip()
+    if len(stripped) < 2:
+        return "empty answer"
+    if done_reason == "length":
+        return "answer truncated"
+    if len(stripped) > CASCADE_MAX_CHARS:
+        return "answer too long"
+    if _TOOL_CALL_TEXT.match(stripped):
+        return "tool call written as text"
+    # Los modelos pequeños a veces entran en bucle repitiendo la misma línea
+    lines = [line.strip() for line in stripped.splitlines() if line.strip()]
+    if lines and max(lines.count(line) for line in set(lines)) >= 3:
+        return "repeated lines"
+    return None
+
+
+def verify(verifier: str, text: str, done_reason: Optional[str] = None,
+           schema_path: Optional[str] = None) -> Optional[str]:
+    """Devuelve el motivo del rechazo del borrador, o None si se acepta."""
+    if verifier == SQL:
+        return verify_sql(text, schema_path) or (
+            "answer truncated" if done_reason == "length" else None)
+    return verify_text(text, done_reason)
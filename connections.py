@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Gestor de conexiones WebSocket no bloqueante.
+Cada conexión tiene una cola de salida acotada que vacía su propia tarea escritora,
+de modo que un cliente lento o caído no frena al resto.
+
+Los clientes caídos los detecta el ping/pong del propio protocolo WebSocket (uvicorn
+con ws_ping_interval). El heartbeat de la aplicación ({"type": "ping"} en JSON o
+msgpack) solo se envía a los clientes que lo piden con ?heartbeat=1 en la URL, que
+lo usan para detectar a su vez que el servidor ha caído.
+"""
+
+import asyncio
+import base64
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Hashable, List, Optional, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+import wire_protocol
+
+logger = logging.getLogger(__name__)
+
+# Políticas ante un consumidor lento (cola de salida llena)
+DROP = "drop"              # descartar el mensaje nuevo
+COALESCE = "coalesce"      # sustituir mensajes con la misma clave y, si no cabe, descartar el mensaje con clave
+                           # más antiguo (sin ninguno que descartar, cerrar la conexión)
+DISCONNECT = "disconnect"  # cerrar la conexión
+
+# Configuración (se puede sobreescribir con variables de entorno)
+WS_QUEUE_SIZE = int(os.environ.get("BOB_WS_QUEUE_SIZE", 100))
+WS_SLOW_CONSUMER_POLICY = os.environ.get("BOB_WS_SLOW_CONSUMER_POLICY", COALESCE)
+WS_HEARTBEAT_INTERVAL = float(os.environ.get("BOB_WS_HEARTBEAT_INTERVAL", 20))
+WS_HEARTBEAT_TIMEOUT = float(os.environ.get("BOB_WS_HEARTBEAT_TIMEOUT", 60))
+# Peticiones recientes que se recuerdan por request_id para no repetir un reenvío
+WS_RECENT_REQUESTS = int(os.environ.get("BOB_WS_RECENT_REQUESTS", 1024))
+
+# Canal del bus de estado compartido por el que llegan los broadcasts de otros workers
+BROADCAST_CHANNEL = "ws.broadcast"
+
+# Código de cierre "Try Again Later" para los consumidores lentos
+SLOW_CONSUMER_CLOSE_CODE = 1013
+GOING_AWAY_CLOSE_CODE = 1001
+
+Message = Union[str, bytes]
+
+
+class _Close:
+    """Marcador en la cola de salida: cerrar la conexión después de enviar lo anterior."""
+
+    __slots__ = ("code",)
+
+    def __init__(self, code: int):
+        self.code = code
+
+
+class _Connection:
+    __slots__ = ("id", "websocket", "protocol", "heartbeat", "queue", "keys", "ready", "writer", "last_seen",
+                 "dropped", "closed")
+
+    def __init__(self, websocket: WebSocket, protocol: str, heartbeat: bool = False):
+        self.id = uuid.uuid4().hex
+        self.websocket = websocket
+        self.protocol = protocol
+        # El cliente contesta al ping de la aplicación con {"type": "pong"}
+        self.heartbeat = heartbeat
+        # Cada entrada es [clave, mensaje] para poder sustituir el mensaje en su sitio
+        self.queue: Deque[List[Any]] = deque()
+        self.keys: Dict[str, List[Any]] = {}
+        self.ready = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        self.last_seen = time.monotonic()
+        self.dropped = 0
+        self.closed = False
+
+
+class RecentRequests:
+    """Peticiones recientes por (cliente, request_id), para que los reenvíos sean idempotentes.
+
+    Un cliente que reconecta reenvía las peticiones sin respuesta. Si la original sigue
+    en curso, el reenvío espera a su resultado; si ya terminó, recibe la misma respuesta.
+    Solo se recuerdan las últimas `max_entries`, y por proceso: con varios workers, un
+    reenvío que llega a otro worker se ejecuta otra vez.
+    """
+
+    def __init__(self, max_entries: int = WS_RECENT_REQUESTS):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, asyncio.Future]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[asyncio.Future]:
+        return self._entries.get(key)
+
+    def start(self, key: Hashable):
+        self._entries[key] = asyncio.get_running_loop().create_future()
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            _, future = self._entries.popitem(last=False)
+            if not future.done():
+                future.set_result(None)
+
+    def finish(self, key: Hashable, response: Optional[Dict[str, Any]]):
+        """Guarda la respuesta enviada; None (petición cancelada) la olvida para que se repita."""
+        future = self._entries.get(key)
+        if future is None:
+            return
+        if response is None:
+            del self._entries[key]
+        if not future.done():
+            future.set_result(response)
+
+
+class ConnectionManager:
+    def __init__(self, queue_size: int = WS_QUEUE_SIZE, policy: str = WS_SLOW_CONSUMER_POLICY,
+                 heartbeat_interval: float = WS_HEARTBEAT_INTERVAL,
+                 heartbeat_timeout: float = WS_HEARTBEAT_TIMEOUT, shared=None):
+        if policy not in (DROP, COALESCE, DISCONNECT):
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.connections: Dict[WebSocket, _Connection] = {}
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # Estado compartido entre workers (SharedState) o None con un solo proceso
+        self.shared = shared
+        if shared is not None:
+            shared.subscribe(BROADCAST_CHANNEL, self._on_shared_broadcast)
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.connections)
+
+    async def connect(self, websocket: WebSocket):
+        # Negociar el protocolo: subprotocolo WebSocket o parámetro ?protocol= de la URL
+        subprotocol, protocol = wire_protocol.negotiate(
+            websocket.scope.get("subprotocols", []), websocket.query_params.get("protocol")
+        )
+        await websocket.accept(subprotocol=subprotocol)
+        connection = _Connection(websocket, protocol, websocket.query_params.get("heartbeat") == "1")
+        connection.writer = asyncio.create_task(self._writer(connection))
+        self.connections[websocket] = connection
+        logger.info(f"Nueva conexión WebSocket ({protocol}). Total: {len(self.connections)}")
+        if self.shared is not None:
+            client = f"{websocket.client.host}:{websocket.client.port}" if websocket.client else None
+            await asyncio.to_thread(self.shared.add_connection, connection.id, websocket.scope.get("path", ""),
+                                    protocol, client)
+
+    def disconnect(self, websocket: WebSocket):
+        # Idempotente: desconectar dos veces el mismo socket no es un error
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.closed = True
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+        logger.info(f"Conexión WebSocket cerrada. Restantes: {len(self.connections)}")
+        if self.shared is not None:
+            asyncio.get_running_loop().run_in_executor(None, self.shared.remove_connection, connection.id)
+
+    def protocol(self, websocket: WebSocket) -> str:
+        connection = self.connections.get(websocket)
+        return connection.protocol if connection is not None else wire_protocol.JSON
+
+    async def receive(self, websocket: WebSocket) -> Message:
+        """Recibe un frame de texto o binario y marca la conexión como viva."""
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        self.touch(websocket)
+        return message["text"] if message.get("text") is not None else message["bytes"]
+
+    def touch(self, websocket: WebSocket):
+        """Marca la conexión como viva (se llama con cada mensaje recibido del cliente)."""
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.last_seen = time.monotonic()
+
+    async def send_message(self, message: Message, websocket: WebSocket, key: Optional[str] = None):
+        """Encola un mensaje para el socket sin esperar a que se envíe.
+
+        `key` identifica mensajes que se pueden fusionar (p. ej. el progreso de un trabajo):
+        con la política "coalesce" solo se conserva el último mensaje de cada clave.
+        """
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            self._enqueue(connection, message, key)
+
+    async def send_json(self, payload: Dict[str, Any], websocket: WebSocket, key: Optional[str] = None):
+        """Codifica el mensaje con el protocolo negociado por la conexión y lo encola."""
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            self._enqueue(connection, wire_protocol.encode(payload, connection.protocol), key)
+
+    async def send_audio(self, header: Dict[str, Any], audio: bytes, websocket: WebSocket):
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            self._enqueue(connection, wire_protocol.encode_audio(header, audio, connection.protocol), None)
+
+    async def broadcast(self, message: Message, key: Optional[str] = None):
+        # Encolar en todas las conexiones; cada escritor envía de forma concurrente
+        for connection in list(self.connections.values()):
+            self._enqueue(connection, message, key)
+        if self.shared is not None:
+            if isinstance(message, bytes):
+                shared_message = {"bytes": base64.b64encode(message).decode(), "key": key}
+            else:
+                shared_message = {"text": message, "key": key}
+            await asyncio.to_thread(self.shared.publish, BROADCAST_CHANNEL, shared_message)
+
+    async def broadcast_json(self, payload: Dict[str, Any], key: Optional[str] = None):
+        self._broadcast_json_local(payload, key)
+        if self.shared is not None:
+            await asyncio.to_thread(self.shared.publish, BROADCAST_CHANNEL, {"json": payload, "key": key})
+
+    def _broadcast_json_local(self, payload: Dict[str, Any], key: Optional[str]):
+        # Codificar una sola vez por protocolo
+        frames: Dict[str, Message] = {}
+        for connection in list(self.connections.values()):
+            frame = frames.get(connection.protocol)
+            if frame is None:
+                frame = frames[connection.protocol] = wire_protocol.encode(payload, connection.protocol)
+            self._enqueue(connection, frame, key)
+
+    def _on_shared_broadcast(self, message: Dict[str, Any]):
+        # Broadcast de otro worker: solo se entrega a las conexiones de este proceso
+        key = message.get("key")
+        if "json" in message:
+            self._broadcast_json_local(message["json"], key)
+            return
+        frame = base64.b64decode(message["bytes"]) if "bytes" in message else message["text"]
+        for connection in list(self.connections.values()):
+            self._enqueue(connection, frame, key)
+
+    async def close(self, websocket: WebSocket, code: int = 1000):
+        """Cierra la conexión después de enviar los mensajes pendientes."""
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.queue.append([None, _Close(code)])
+            connection.ready.set()
+
+    def _enqueue(self, connection: _Connection, message: Message, key: Optional[str]):
+        if connection.closed:
+            return
+        if self.policy == COALESCE and key is not None and key in connection.keys:
+            connection.keys[key][1] = message
+            return
+
+        if len(connection.queue) >= self.queue_size:
+            if self.policy == DROP:
+                connection.dropped += 1
+                return
+            if self.policy == COALESCE:
+                # Solo se pueden descartar los mensajes con clave (progreso que otro sustituye);
+                # las respuestas y los eventos de voz sin clave no se pierden nunca
+                if connection.keys:
+                    old_key = next(iter(connection.keys))
+                    connection.queue.remove(connection.keys.pop(old_key))
+                    connection.dropped += 1
+                elif key is not None:
+                    connection.dropped += 1
+                    return
+                else:
+                    self._disconnect_slow(connection)
+                    return
+            else:
+                self._disconnect_slow(connection)
+                return
+
+        entry = [key, message]
+        connection.queue.append(entry)
+        if key is not None:
+            connection.keys[key] = entry
+        connection.ready.set()
+
+    def _disconnect_slow(self, connection: _Connection):
+        logger.warning("Consumidor lento: cerrando la conexión WebSocket")
+        self.disconnect(connection.websocket)
+        asyncio.create_task(self._safe_close(connection.websocket, SLOW_CONSUMER_CLOSE_CODE))
+
+    async def _writer(self, connection: _Connection):
+        websocket = connection.websocket
+        try:
+            while True:
+                await connection.ready.wait()
+                connection.ready.clear()
+                while connection.queue:
+                    key, message = connection.queue.popleft()
+                    if key is not None:
+                        connection.keys.pop(key, None)
+                    if isinstance(message, _Close):
+                        self.disconnect(websocket)
+                        await self._safe_close(websocket, message.code)
+                        return
+                    if isinstance(message, bytes):
+                        await websocket.send_bytes(message)
+                    else:
+                        await websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"Error enviando por WebSocket, se cierra la conexión: {e}")
+            self.disconnect(websocket)
+
+    @staticmethod
+    async def _safe_close(websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def start(self):
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        for websocket in list(self.connections):
+            self.disconnect(websocket)
+            await self._safe_close(websocket, GOING_AWAY_CLOSE_CODE)
+
+    async def _heartbeat_loop(self):
+        # Una sola tarea para todas las conexiones que pidieron el heartbeat: envía pings y
+        # elimina las que no responden. Las demás solo tienen el ping del protocolo
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            ping = {"type": "ping", "ts": time.time()}
+            frames = {protocol: wire_protocol.encode(ping, protocol) for protocol in wire_protocol.available_protocols()}
+            for websocket, connection in list(self.connections.items()):
+                if not connection.heartbeat:
+                    continue
+                if now - connection.last_seen > self.heartbeat_timeout:
+                    logger.info("Conexión WebSocket sin respuesta al heartbeat, se elimina")
+                    self.disconnect(websocket)
+                    asyncio.create_task(self._safe_close(websocket, GOING_AWAY_CLOSE_CODE))
+                else:
+                    self._enqueue(connection, frames[connection.protocol], key="ping")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "connections": len(self.connections),
+            "queued": sum(len(c.queue) for c in self.connections.values()),
+            "dropped": sum(c.dropped for c in self.connections.values()),
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+        }
+        if self.shared is not None:
+            # Con varios workers, además las conexiones abiertas en cada uno
+            by_worker = self.shared.connection_counts()
+            stats.update({"worker": self.shared.worker, "total_connections": sum(by_worker.values()),
+                          "by_worker": by_worker})
+        return stats
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Historial de conversaciones persistente en un SQLite local.
+Los turnos se añaden sin modificarse nunca (solo inserciones), indexados por
+sesión, y se leen por páginas para que el coste no crezca con el historial.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+CONVERSATION_DB_PATH = os.environ.get("BOB_CONVERSATION_DB", os.path.join(os.getcwd(), "conversations.db"))
+
+
+class ConversationStore:
+    def __init__(self, path: str = CONVERSATION_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                user TEXT NOT NULL,
+                assistant TEXT NOT NULL,
+                agent TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_turns_session ON turns (session_id, id);
+        """)
+        self.full_text = self._create_fts()
+        self._conn.commit()
+
+    def _create_fts(self) -> bool:
+        # Búsqueda de texto completo con FTS5 si el SQLite la incluye; si no, LIKE
+        try:
+            self._conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(
+                    user, assistant, content='turns', content_rowid='id'
+                );
+                CREATE TRIGGER IF NOT EXISTS turns_fts_insert AFTER INSERT ON turns BEGIN
+                    INSERT INTO turns_fts (rowid, user, assistant) VALUES (new.id, new.user, new.assistant);
+                END;
+            """)
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def append(self, session_id: str, user: str, assistant: str, agent: Optional[str] = None) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO turns (session_id, created_at, user, assistant, agent) VALUES (?, ?, ?, ?, ?)",
+                (session_id, time.time(), user, assistant, agent),
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def count(self, session_id: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM turns WHERE session_id = ?", (session_id,)).fetchone()[0]
+
+    def last(self, session_id: str, limit: int, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Los `limit` turnos más recientes (anteriores a `before_id`), en orden cronológico."""
+        with self._lock:
+            if before_id is None:
+                rows = self._conn.execute(
+                    "SELECT * FROM turns WHERE session_id = ? ORDER BY id DESC LIMIT ?", (session_id, limit)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT * FROM turns WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                    (session_id, before_id, limit),
+                ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def search(self, query: str, session_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Busca en los turnos anteriores, de la sesión indicada o de todas. Los más recientes primero."""
+        query = query.strip()
+        if not query:
+            return []
+        terms = query.split()
+        if self.full_text:
+            # Cada palabra como término literal (sin operadores FTS) con búsqueda por prefijo
+            match = " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+            sql = "SELECT turns.* FROM turns_fts JOIN turns ON turns.id = turns_fts.rowid WHERE turns_fts MATCH ?"
+            params: List[Any] = [match]
+        else:
+            sql = "SELECT turns.* FROM turns WHERE 1 = 1"
+            params = []
+            for term in terms:
+                pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                sql += " AND (turns.user LIKE ? ESCAPE '\\' OR turns.assistant LIKE ? ESCAPE '\\')"
+                params += [pattern, pattern]
+        if session_id is not None:
+            sql += " AND turns.session_id = ?"
+            params.append(session_id)
+        sql += " ORDER BY turns.id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,86 @@
+"""
+Transcripción de la conversación para los clientes Streamlit.
+Los turnos se guardan en ConversationStore y solo se pintan los últimos N;
+los anteriores se cargan bajo demanda y se pueden buscar.
+"""
+
+import html
+import os
+import uuid
+
+import streamlit as st
+
+from conversation_store import ConversationStore
+
+# Turnos que se muestran por página
+TRANSCRIPT_PAGE_SIZE = int(os.environ.get("BOB_TRANSCRIPT_PAGE_SIZE", 20))
+
+
+@st.cache_resource(show_spinner=False)
+def get_conversation_store():
+    return ConversationStore()
+
+
+def current_session_id():
+    # La sesión va en la URL (?session=...) para recuperar el historial al volver a abrir la pestaña
+    session_id = st.query_params.get("session")
+    if not session_id:
+        session_id = uuid.uuid4().hex
+        st.query_params["session"] = session_id
+    return session_id
+
+
+def new_session():
+    """Empieza una conversación nueva; la anterior sigue guardada y se puede buscar."""
+    st.query_params["session"] = uuid.uuid4().hex
+    st.session_state.transcript_pages = 1
+
+
+def add_turn(user, assistant, agent=None):
+    get_conversation_store().append(current_session_id(), user, assistant, agent)
+
+
+def _render_turn(turn):
+    st.markdown(f"**You:** {turn['user']}")
+    # Mostrar qué agente del equipo respondió, si se conoce
+    speaker = f"Assistant ({html.escape(turn['agent'])})" if turn.get("agent") else "Assistant"
+    st.markdown(f'<div class="response-box"><strong>{speaker}:</strong> {html.escape(turn["assistant"])}</div>',
+                unsafe_allow_html=True)
+
+
+def render_transcript():
+    """Pinta los últimos turnos de la sesión. Devuelve False si la sesión no tiene turnos."""
+    if "transcript_pages" not in st.session_state:
+        st.session_state.transcript_pages = 1
+    limit = st.session_state.transcript_pages * TRANSCRIPT_PAGE_SIZE
+
+    # Pedir un turno de más para saber si hay turnos anteriores sin cargar
+    turns = get_conversation_store().last(current_session_id(), limit + 1)
+    if not turns:
+        st.info("Your conversation will appear here")
+        return False
+
+    if len(turns) > limit:
+        turns = turns[1:]
+        if st.button("Load older turns"):
+            st.session_state.transcript_pages += 1
+            st.rerun(scope="fragment")
+
+    for i, turn in enumerate(turns):
+        _render_turn(turn)
+        if i < len(turns) - 1:
+            st.divider()
+    return True
+
+
+def render_search():
+    with st.expander("Search past turns"):
+        query = st.text_input("Search", key="transcript_search")
+        all_sessions = st.checkbox("Search all sessions", key="transcript_search_all")
+        if query:
+            session_id = None if all_sessions else current_session_id()
+            results = get_conversation_store().search(query, session_id)
+            if not results:
+                st.caption("No matching turns")
+            for turn in results:
+                _render_turn(turn)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Servicio de embeddings compartido por el proceso.
+
+Las peticiones concurrentes (de hilos o del event loop) se agrupan en
+micro-lotes: un hilo de fondo espera a lo sumo BOB_EMBED_BATCH_WAIT_MS desde la
+primera petición y hace una sola llamada al modelo con hasta
+BOB_EMBED_BATCH_SIZE textos. Los vectores se memorizan en un LRU por hash del
+texto y, si se indica BOB_EMBED_STORE, también en un SQLite en disco.
+
+Los vectores son arrays float32 de NumPy de solo lectura. Cada uno tiene su
+propia memoria (una copia de su fila del lote, o una vista sobre su BLOB del
+almacén), así que el LRU ocupa como mucho BOB_EMBED_CACHE_SIZE vectores.
+
+Modelos:
+- "ollama" (por defecto): la API /api/embed de Ollama (o del proxy /ollama del servidor).
+- "local": un modelo de sentence-transformers en la CPU.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+OLLAMA = "ollama"
+LOCAL = "local"
+BACKENDS = (OLLAMA, LOCAL)
+
+# Configuración (se puede sobreescribir con variables de entorno)
+EMBED_BACKEND = os.environ.get("BOB_EMBED_BACKEND", OLLAMA)
+EMBED_MODEL = os.environ.get(
+    "BOB_EMBED_MODEL", "nomic-embed-text" if EMBED_BACKEND == OLLAMA else "sentence-transformers/all-MiniLM-L6-v2"
+)
+EMBED_BATCH_SIZE = int(os.environ.get("BOB_EMBED_BATCH_SIZE", 32))
+# Cuánto espera un lote a que lleguen más peticiones antes de llamar al modelo
+EMBED_BATCH_WAIT = float(os.environ.get("BOB_EMBED_BATCH_WAIT_MS", 5)) / 1000
+EMBED_CACHE_SIZE = int(os.environ.get("BOB_EMBED_CACHE_SIZE", 4096))
+# Almacén en disco de los vectores (vacío = solo en memoria)
+EMBED_STORE_PATH = os.environ.get("BOB_EMBED_STORE", "")
+# Vectores de norma 1: la similitud coseno es el producto escalar
+EMBED_NORMALIZE = os.environ.get("BOB_EMBED_NORMALIZE", "1").lower() not in ("0", "false", "no", "")
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class OllamaEmbedder:
+    """Embeddings con la API /api/embed de Ollama (varios textos por llamada)."""
+
+    def __init__(self, model: str = EMBED_MODEL, host: Optional[str] = None, timeout: float = 60.0):
+        import httpx
+
+        self.model = model
+        # El servidor apunta BOB_OLLAMA_HOST a su proxy /ollama cuando hay un pool de servidores
+        self.host = (host or os.environ.get("BOB_OLLAMA_HOST") or "http://localhost:11434").rstrip("/")
+        self._client = httpx.Client(timeout=httpx.Timeout(timeout, connect=3.05))
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        response = self._client.post(f"{self.host}/api/embed", json={"model": self.model, "input": texts})
+        response.raise_for_status()
+        return np.asarray(response.json()["embeddings"], dtype=np.float32)
+
+    def close(self):
+        self._client.close()
+
+
+class LocalEmbedder:
+    """Embeddings con un modelo de sentence-transformers en la CPU (se carga con el primer lote)."""
+
+    def __init__(self, model: str = EMBED_MODEL):
+        self.model = model
+        self._model = None
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model, device="cpu")
+        vectors = self._model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def close(self):
+        pass
+
+
+def create_embedder(backend: str = EMBED_BACKEND, model: str = EMBED_MODEL):
+    if backend == OLLAMA:
+        return OllamaEmbedder(model)
+    if backend == LOCAL:
+        return LocalEmbedder(model)
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+class VectorStore:
+    """Vectores en un SQLite local por (modelo, hash del texto)."""
+
+    def __init__(self, path: str, model: str):
+        self.model = model
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                key BLOB NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, key)
+            )
+        """)
+        self._conn.commit()
+
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, np.ndarray]:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({placeholders})",
+                (self.model, *keys),
+            ).fetchall()
+        # np.frombuffer sobre el BLOB: una vista de solo lectura, sin copia
+        return {key: np.frombuffer(vector, dtype=np.float32) for key, vector in rows}
+
+    def put_many(self, items: Sequence[Tuple[bytes, np.ndarray]]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, key, vector) VALUES (?, ?, ?)",
+                [(self.model, key, memoryview(vector)) for key, vector in items],
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _BatchStats:
+    __slots__ = ("batches", "texts", "seconds")
+
+    def __init__(self):
+        self.batches = 0
+        self.texts = 0
+        self.seconds = 0.0
+
+
+class EmbeddingService:
+    """Micro-lotes, LRU y almacén en disco delante de un modelo de embeddings.
+
+    `embed(text)` y `embed_many(texts)` bloquean hasta tener los vectores;
+    `aembed` y `aembed_many` son sus versiones para el event loop. El hilo que
+    forma los lotes arranca con la primera petición.
+    """
+
+    def __init__(self, embedder=None, batch_size: int = EMBED_BATCH_SIZE, batch_wait: float = EMBED_BATCH_WAIT,
+                 cache_size: int = EMBED_CACHE_SIZE, store_path: str = EMBED_STORE_PATH,
+                 normalize: bool = EMBED_NORMALIZE):
+        self._embedder = embedder
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.cache_size = cache_size
+        self.store_path = store_path
+        self.normalize = normalize
+        self._store: Optional[VectorStore] = None
+        self._cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Peticiones en cola o en un lote en curso, para que un mismo texto no se calcule dos veces
+        self._inflight: Dict[bytes, Future] = {}
+        self._queue: "queue.Queue[Optional[Tuple[bytes, str, Future]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats: Dict[int, _BatchStats] = {}
+        self._hits = 0
+        self._store_hits = 0
+        self._misses = 0
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = create_embedder()
+        return self._embedder
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    if self.store_path:
+                        self._store = VectorStore(self.store_path, self.embedder.model)
+                    self._thread = threading.Thread(target=self._run, name="embeddings", daemon=True)
+                    self._thread.start()
+
+    # API
+
+    def submit(self, text: str) -> Future:
+        """Future con el vector de `text`; ya resuelto si estaba en el LRU."""
+        key = text_key(text)
+        with self._cache_lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self._hits += 1
+                future = Future()
+                future.set_result(vector)
+                return future
+            future = self._inflight.get(key)
+            if future is not None:
+                self._hits += 1
+                return future
+            future = self._inflight[key] = Future()
+        self._ensure_started()
+        self._queue.put((key, text, future))
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    def embed_many(self, texts: Sequence[str]) -> np.ndarray:
+        """Matriz (len(texts), dim) con los vectores en el orden de `texts`."""
+        futures = [self.submit(text) for text in texts]
+        vectors = [future.result() for future in futures]
+        if not vectors:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack(vectors)
+
+    async def aembed(self, text: str) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(text))
+
+    async def aembed_many(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = await asyncio.gather(*(asyncio.wrap_future(self.submit(text)) for text in texts))
+        if not vectors:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack(vectors)
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+        if self._embedder is not None:
+            self._embedder.close()
+
+    def stats(self) -> Dict[str, object]:
+        with self._cache_lock:
+            cache = {"size": len(self._cache), "hits": self._hits, "store_hits": self._store_hits,
+                     "misses": self._misses}
+            batches = {
+                size: {
+                    "batches": s.batches,
+                    "texts": s.texts,
+                    "ms_per_batch": round(1000 * s.seconds / s.batches, 1),
+                    "texts_per_s": round(s.texts / s.seconds, 1) if s.seconds else None,
+                }
+                for size, s in sorted(self._stats.items())
+            }
+        model = self._embedder.model if self._embedder is not None else EMBED_MODEL
+        return {"model": model, "batch_size": self.batch_size, "cache": cache, "batches": batches}
+
+    # Lotes
+
+    def _next_batch(self) -> Optional[List[Tuple[bytes, str, Future]]]:
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._embed_batch(batch)
+            except Exception as e:
+                logger.error(f"Embedding batch error: {e}")
+                with self._cache_lock:
+                    for key, _, future in batch:
+                        self._inflight.pop(key, None)
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _embed_batch(self, batch: List[Tuple[bytes, str, Future]]):
+        found = self._store.get_many([key for key, _, _ in batch]) if self._store is not None else {}
+        missing = [(key, text) for key, text, _ in batch if key not in found]
+        vectors = dict(found)
+        if missing:
+            started = time.perf_counter()
+            matrix = self.embedder.embed([text for _, text in missing])
+            elapsed = time.perf_counter() - started
+            if self.normalize:
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                np.divide(matrix, norms, out=matrix, where=norms > 0)
+            # Cada fila se copia: una vista mantendría viva toda la matriz del lote mientras
+            # uno solo de sus vectores siga en el LRU. Se comparten entre los que los piden:
+            # de solo lectura
+            for i, (key, _) in enumerate(missing):
+                vector = matrix[i].copy()
+                vector.setflags(write=False)
+                vectors[key] = vector
+            if self._store is not None:
+                self._store.put_many([(key, vectors[key]) for key, _ in missing])
+        else:
+            elapsed = 0.0
+
+        with self._cache_lock:
+            if missing:
+                stats = self._stats.setdefault(len(missing), _BatchStats())
+                stats.batches += 1
+                stats.texts += len(missing)
+                stats.seconds += elapsed
+            self._store_hits += len(found)
+            self._misses += len(missing)
+            for key, _, _ in batch:
+                self._cache[key] = vectors[key]
+                self._cache.move_to_end(key)
+                self._inflight.pop(key, None)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        for key, _, future in batch:
+            future.set_result(vectors[key])
+
+
+# Servicio compartido por el proceso (el hilo de lotes arranca con la primera petición)
+embeddings = EmbeddingService()
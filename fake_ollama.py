@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Servidores Ollama falsos para probar el pool sin GPU.
+
+Implementan /api/generate, /api/chat (con y sin streaming), /api/embed,
+/api/ps, /api/tags y /api/version con una latencia y una tasa de errores
+configurables. Cada
+servidor simula la carga del modelo: la primera petición de un modelo tarda
+`--load-time` segundos más.
+
+    python fake_ollama.py --ports 11501 11502 11503 --fail-rate 0.1
+    BOB_OLLAMA_HOSTS_CONFIG=ollama_hosts.example.toml python app.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOllama/0.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/ps":
+            self._send_json(200, {"models": [{"name": model} for model in sorted(self.server.loaded)]})
+        elif self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": model} for model in self.server.models]})
+        elif self.path == "/api/version":
+            self._send_json(200, {"version": "0.0.0-fake"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path not in ("/api/generate", "/api/chat", "/api/embed"):
+            self._send_json(404, {"error": "not found"})
+            return
+        if random.random() < self.server.fail_rate:
+            self._send_json(500, {"error": "fake failure"})
+            return
+        model = request.get("model", "")
+        if self.server.models and model not in self.server.models:
+            self._send_json(404, {"error": f"model '{model}' not found"})
+            return
+
+        with self.server.lock:
+            self.server.requests += 1
+            load = model not in self.server.loaded
+            self.server.loaded.add(model)
+        started = time.perf_counter()
+        if load:
+            time.sleep(self.server.load_time)
+        if self.path == "/api/embed":
+            self._embed(request, model)
+            return
+        tokens = [f"{self.server.name} " for _ in range(self.server.tokens)]
+        prompt_tokens = len(json.dumps(request.get("messages") or request.get("prompt", "")).split())
+
+        def chunk(text, done):
+            if self.path == "/api/chat":
+                payload = {"model": model, "message": {"role": "assistant", "content": text}, "done": done}
+            else:
+                payload = {"model": model, "response": text, "done": done}
+            if done:
+                elapsed = int((time.perf_counter() - started) * 1e9)
+                payload.update({
+                    "done_reason": "stop",
+                    "total_duration": elapsed,
+                    "load_duration": int(self.server.load_time * 1e9) if load else 0,
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": 1_000_000,
+                    "eval_count": len(tokens),
+                    "eval_duration": int(self.server.token_time * len(tokens) * 1e9),
+                })
+            return payload
+
+        if request.get("stream", True):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for token in tokens:
+                time.sleep(self.server.token_time)
+                self.wfile.write((json.dumps(chunk(token, False)) + "\n").encode())
+                self.wfile.flush()
+            self.wfile.write((json.dumps(chunk("", True)) + "\n").encode())
+        else:
+            time.sleep(self.server.token_time * len(tokens))
+            self._send_json(200, chunk("".join(tokens), True))
+
+
+    def _embed(self, request, model):
+        inputs = request.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        # Una llamada cuesta lo que un token más una décima parte por texto: agrupar compensa
+        time.sleep(self.server.token_time * (1 + len(inputs) / 10))
+        # Vectores deterministas por texto
+        embeddings = []
+        for text in inputs:
+            rng = random.Random(text)
+            embeddings.append([rng.uniform(-1, 1) for _ in range(self.server.embed_dim)])
+        self._send_json(200, {"model": model, "embeddings": embeddings})
+
+
+def start_server(port, models=(), fail_rate=0.0, load_time=1.0, token_time=0.02, tokens=10, embed_dim=384):
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOllamaHandler)
+    server.name = f"fake-{port}"
+    server.models = list(models)
+    server.loaded = set()
+    server.fail_rate = fail_rate
+    server.load_time = load_time
+    server.token_time = token_time
+    server.tokens = tokens
+    server.embed_dim = embed_dim
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidores Ollama falsos")
+    parser.add_argument("--ports", type=int, nargs="+", default=[11501, 11502])
+    parser.add_argument("--models", nargs="*", default=[], help="modelos que sirven (por defecto, cualquiera)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fracción de peticiones que devuelven 500")
+    parser.add_argument("--load-time", type=float, default=1.0, help="segundos que tarda en cargar un modelo")
+    parser.add_argument("--token-time", type=float, default=0.02, help="segundos por token generado")
+    parser.add_argument("--tokens", type=int, default=10, help="tokens por respuesta")
+    parser.add_argument("--embed-dim", type=int, default=384, help="dimensión de los embeddings")
+    args = parser.parse_args()
+
+    servers = [start_server(port, args.models, args.fail_rate, args.load_time, args.token_time, args.tokens,
+                            args.embed_dim)
+               for port in args.ports]
+    print(f"Servidores Ollama falsos en los puertos {', '.join(map(str, args.ports))} (Ctrl+C para salir)")
+    try:
+        while True:
+            time.sleep(5)
+            print("  ".join(f"{server.name}: {server.requests} peticiones" for server in servers))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Peticiones con cobertura (hedging) y circuit breaker para la respuesta de los agentes.
+Si el agente tarda más que un umbral, se lanza en paralelo la generación directa
+con Ollama y se devuelve la primera que termine, cancelando la otra. Mientras el
+camino de los agentes esté fallando, el circuit breaker manda el tráfico
+directamente a Ollama.
+"""
+
+import json
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Estados del circuit breaker
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Origen de la respuesta
+AGENT = "agent"
+FALLBACK = "fallback"
+
+
+class RequestCancelled(Exception):
+    """La petición se canceló porque la otra terminó antes."""
+
+
+class CircuitBreaker:
+    """Abre el circuito tras `failure_threshold` fallos seguidos y lo vuelve a probar tras `reset_timeout`."""
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True si se puede usar el camino protegido. En HALF_OPEN solo pasa una petición de prueba."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning("Circuit breaker abierto: se usa directamente el fallback")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def record_abandoned(self):
+        # La petición de prueba perdió contra el fallback: no cuenta como fallo, pero hay que
+        # volver a permitir una prueba en lugar de quedarse en HALF_OPEN para siempre
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+                self.opened_at = time.monotonic() - self.reset_timeout
+
+
+class OllamaClient:
+    """Cliente de la API de generación de Ollama con una sesión HTTP keep-alive compartida."""
+
+    def __init__(self, pool_size: int = 4, connect_timeout: float = 3.05, read_timeout: float = 120.0):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.timeout = (connect_timeout, read_timeout)
+
+    def generate(self, text: str, model: str, api_url: str, cancel: Optional[threading.Event] = None) -> str:
+        # En streaming se puede abandonar la generación en cuanto se cancela
+        with self.session.post(api_url, json={"model": model, "prompt": text, "stream": True},
+                               stream=True, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"Ollama error: {response.status_code} - {response.text}")
+            parts = []
+            for line in response.iter_lines():
+                if cancel is not None and cancel.is_set():
+                    raise RequestCancelled()
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise RuntimeError(f"Ollama error: {chunk['error']}")
+                parts.append(chunk.get("response", ""))
+                if chunk.get("done"):
+                    break
+            return "".join(parts)
+
+
+class AgentProcess:
+    """Ejecución del agent runner en un subproceso que se puede cancelar."""
+
+    def __init__(self, command: List[str], timeout: Optional[float] = None):
+        self.command = command
+        self.timeout = timeout
+        self._proc: Optional[subprocess.Popen] = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def run(self) -> str:
+        with self._lock:
+            if self._cancelled:
+                raise RequestCancelled()
+            self._proc = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        try:
+            stdout, stderr = self._proc.communicate(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.communicate()
+            raise RuntimeError(f"Agent timed out after {self.timeout} seconds")
+        if self._cancelled:
+            raise RequestCancelled()
+        if self._proc.returncode != 0:
+            raise RuntimeError(f"Agent process exited with {self._proc.returncode}: {stderr.strip()}")
+        try:
+            response_json = json.loads(stdout)
+        except json.JSONDecodeError:
+            raise RuntimeError("Could not parse agent response")
+        if response_json.get("status") != "success":
+            raise RuntimeError(f"Agent error: {response_json.get('error', 'Unknown error')}")
+        return response_json["response"]
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            if self._proc is not None and self._proc.poll() is None:
+                self._proc.kill()
+
+
+class OllamaGeneration:
+    """Generación directa con Ollama que se puede cancelar."""
+
+    def __init__(self, client: OllamaClient, text: str, model: str, api_url: str):
+        self.client = client
+        self.text = text
+        self.model = model
+        self.api_url = api_url
+        self._cancel = threading.Event()
+
+    def run(self) -> str:
+        return self.client.generate(self.text, self.model, self.api_url, self._cancel)
+
+    def cancel(self):
+        self._cancel.set()
+
+
+class HedgedCaller:
+    """Combina el camino de los agentes (primario) y Ollama (fallback)."""
+
+    def __init__(self, breaker: CircuitBreaker, max_workers: int = 8):
+        self.breaker = breaker
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def call(self, primary: AgentProcess, fallback: OllamaGeneration,
+             hedge_after: Optional[float]) -> Tuple[Optional[str], Optional[str], List[str]]:
+        """Devuelve (respuesta, origen, avisos).
+
+        Con `hedge_after=None` no hay cobertura: el fallback solo se usa si el agente falla.
+        """
+        notes: List[str] = []
+        if not self.breaker.allow():
+            notes.append("Agent path is failing (circuit open); using direct Ollama call")
+            return self._run_alone(fallback, FALLBACK, notes)
+
+        primary_future = self.executor.submit(primary.run)
+        done, _ = wait([primary_future], timeout=hedge_after)
+        if not done:
+            # El agente es lento: lanzar también el fallback y quedarse con el primero que termine
+            notes.append(f"Agent slower than {hedge_after:.1f}s; hedging with direct Ollama call")
+            fallback_future = self.executor.submit(fallback.run)
+            pending = {primary_future, fallback_future}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    is_primary = future is primary_future
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if is_primary:
+                            self.breaker.record_failure()
+                        notes.append(f"{'Agent' if is_primary else 'Ollama'} error: {e}")
+                        continue
+                    if is_primary:
+                        self.breaker.record_success()
+                        fallback.cancel()
+                        return result, AGENT, notes
+                    primary.cancel()
+                    self.breaker.record_abandoned()
+                    return result, FALLBACK, notes
+            return None, None, notes
+
+        try:
+            result = primary_future.result()
+        except Exception as e:
+            self.breaker.record_failure()
+            notes.append(f"{e}. Falling back to direct Ollama call")
+            return self._run_alone(fallback, FALLBACK, notes)
+        self.breaker.record_success()
+        return result, AGENT, notes
+
+    @staticmethod
+    def _run_alone(call, source, notes):
+        try:
+            return call.run(), source, notes
+        except Exception as e:
+            notes.append(f"Ollama error: {e}")
+            return None, None, notes
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Subsistema de trabajos asíncronos (jobs) para el Simple Speech Assistant.
+Los trabajos se guardan en un SQLite local para que los resultados sobrevivan
+a reconexiones del cliente y a reinicios del servidor. Cada trabajo pendiente
+pertenece al worker que lo ejecuta mientras este renueve su lease; si el worker
+muere, otro lo reanuda cuando el lease vence.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from shared_state import worker_id
+
+logger = logging.getLogger(__name__)
+
+# Configuración (se puede sobreescribir con variables de entorno)
+JOB_DB_PATH = os.environ.get("BOB_JOB_DB", os.path.join(os.getcwd(), "jobs.db"))
+JOB_RETENTION_SECONDS = float(os.environ.get("BOB_JOB_RETENTION_SECONDS", 24 * 3600))
+JOB_GC_INTERVAL_SECONDS = float(os.environ.get("BOB_JOB_GC_INTERVAL_SECONDS", 300))
+# Un trabajo cuyo worker no renueva el lease en este tiempo lo reanuda otro worker
+JOB_LEASE_SECONDS = float(os.environ.get("BOB_JOB_LEASE_SECONDS", 30))
+# Cada cuánto se leen del almacén los eventos de un trabajo que se ejecuta en otro worker
+JOB_EVENT_POLL_SECONDS = float(os.environ.get("BOB_JOB_EVENT_POLL_SECONDS", 1.0))
+
+# Estados posibles de un trabajo
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+FINISHED_STATES = (COMPLETED, FAILED)
+
+
+class JobStore:
+    """Almacén persistente de trabajos y de sus eventos de progreso."""
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                text TEXT NOT NULL,
+                params TEXT NOT NULL DEFAULT '{}',
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+            CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON jobs (finished_at);
+            CREATE TABLE IF NOT EXISTS job_events (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            );
+        """)
+        # Bases creadas antes de que hubiera leases
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+        self._conn.commit()
+
+    def create(self, text: str, params: Optional[Dict[str, Any]] = None, owner: Optional[str] = None,
+               lease: float = JOB_LEASE_SECONDS) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, text, params, created_at, updated_at, owner, lease_until) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, text, json.dumps(params or {}), now, now, owner, now + lease if owner else None),
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def set_status(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+                   error: Optional[str] = None):
+        now = time.time()
+        finished_at = now if status in FINISHED_STATES else None
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, now, finished_at, job_id),
+            )
+            self._conn.commit()
+
+    def add_event(self, job_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Añade un evento de progreso y devuelve el evento con su número de secuencia."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            seq = row[0]
+            self._conn.execute(
+                "INSERT INTO job_events (job_id, seq, ts, payload) VALUES (?, ?, ?, ?)",
+                (job_id, seq, now, json.dumps(payload)),
+            )
+            self._conn.commit()
+        return {"job_id": job_id, "seq": seq, "ts": now, **payload}
+
+    def events(self, job_id: str, after: int = 0) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, ts, payload FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after),
+            ).fetchall()
+        return [{"job_id": job_id, "seq": r["seq"], "ts": r["ts"], **json.loads(r["payload"])} for r in rows]
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [self._row_to_job(r) for r in rows]
+
+    def claim_orphans(self, owner: str, lease: float = JOB_LEASE_SECONDS) -> List[Dict[str, Any]]:
+        """Se queda con los trabajos pendientes sin lease vigente y los devuelve."""
+        now = time.time()
+        claimed = []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND (lease_until IS NULL OR lease_until < ?) "
+                "ORDER BY created_at", (QUEUED, RUNNING, now)
+            ).fetchall()
+            for row in rows:
+                # Condición repetida en el UPDATE: si otro worker lo reclamó antes, no se toca
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET owner = ?, lease_until = ? "
+                    "WHERE id = ? AND status IN (?, ?) AND (lease_until IS NULL OR lease_until < ?)",
+                    (owner, now + lease, row["id"], QUEUED, RUNNING, now),
+                )
+                self._conn.commit()
+                if cursor.rowcount:
+                    claimed.append(row["id"])
+        return [job for job in map(self.get, claimed) if job is not None]
+
+    def renew(self, owner: str, job_ids: List[str], lease: float = JOB_LEASE_SECONDS):
+        if not job_ids:
+            return
+        placeholders = ",".join("?" * len(job_ids))
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET lease_until = ? WHERE owner = ? AND id IN ({placeholders})",
+                (time.time() + lease, owner, *job_ids),
+            )
+            self._conn.commit()
+
+    def release(self, owner: str):
+        """Libera los trabajos pendientes de `owner` para que otro worker (o el siguiente arranque) los reanude."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = NULL WHERE owner = ? AND status IN (?, ?)", (owner, QUEUED, RUNNING)
+            )
+            self._conn.commit()
+
+    def gc(self, retention_seconds: float = JOB_RETENTION_SECONDS) -> int:
+        """Elimina los trabajos terminados más antiguos que la retención. Devuelve cuántos borró."""
+        cutoff = time.time() - retention_seconds
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute(
+                "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,)
+            )]
+            if ids:
+                placeholders = ",".join("?" * len(ids))
+                self._conn.execute(f"DELETE FROM job_events WHERE job_id IN ({placeholders})", ids)
+                self._conn.execute(f"DELETE FROM jobs WHERE id IN ({placeholders})", ids)
+                self._conn.commit()
+        return len(ids)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "text": row["text"],
+            "params": json.loads(row["params"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "finished_at": row["finished_at"],
+            "owner": row["owner"],
+        }
+
+
+class JobManager:
+    """Ejecuta los trabajos en segundo plano, independientemente de las conexiones de los clientes.
+
+    `runner(text, params, on_chunk)` ejecuta el trabajo y llama a `on_chunk` con cada trozo
+    de la respuesta según se genera; cada trozo se publica como un evento de progreso.
+    """
+
+    def __init__(self, store: JobStore,
+                 runner: Callable[[str, Dict[str, Any], Callable[[str], Awaitable[None]]], Awaitable[Dict[str, Any]]],
+                 owner: Optional[str] = None):
+        self.store = store
+        self.runner = runner
+        # Identificador de este worker en los leases de los trabajos
+        self.owner = owner or worker_id()
+        self._tasks: Set[asyncio.Task] = set()
+        self._running: Set[str] = set()
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._gc_task: Optional[asyncio.Task] = None
+        self._lease_task: Optional[asyncio.Task] = None
+
+    async def _call(self, func, *args, **kwargs):
+        # SQLite es bloqueante: lo ejecutamos fuera del event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: func(*args, **kwargs))
+
+    async def submit(self, text: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        job = await self._call(self.store.create, text, params, self.owner)
+        await self._publish(job["job_id"], {"status": QUEUED})
+        self._spawn(job["job_id"], text, job["params"])
+        return job
+
+    def _spawn(self, job_id: str, text: str, params: Dict[str, Any]):
+        task = asyncio.create_task(self._execute(job_id, text, params))
+        self._tasks.add(task)
+        self._running.add(job_id)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda _: self._running.discard(job_id))
+
+    async def _execute(self, job_id: str, text: str, params: Dict[str, Any]):
+        await self._call(self.store.set_status, job_id, RUNNING)
+        # Un evento "running" sin "type" marca el comienzo (o la reanudación) de la ejecución:
+        # los trozos publicados antes pertenecen a una ejecución anterior
+        await self._publish(job_id, {"status": RUNNING})
+
+        async def on_chunk(chunk: str):
+            await self._publish(job_id, {"status": RUNNING, "type": "chunk", "text": chunk})
+
+        try:
+            result = await self.runner(text, params, on_chunk)
+        except Exception as e:
+            logger.error(f"Job {job_id} error: {e}")
+            result = {"status": "error", "error": str(e)}
+
+        if result.get("status") == "success":
+            await self._call(self.store.set_status, job_id, COMPLETED, result=result)
+            await self._publish(job_id, {"status": COMPLETED, "result": result})
+        else:
+            error = result.get("error", "Unknown error")
+            await self._call(self.store.set_status, job_id, FAILED, result=result, error=error)
+            await self._publish(job_id, {"status": FAILED, "error": error})
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._call(self.store.get, job_id)
+
+    async def events(self, job_id: str, after: int = 0) -> List[Dict[str, Any]]:
+        return await self._call(self.store.events, job_id, after)
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    async def _publish(self, job_id: str, payload: Dict[str, Any]):
+        event = await self._call(self.store.add_event, job_id, payload)
+        for queue in list(self._subscribers.get(job_id, ())):
+            queue.put_nowait(event)
+
+    async def start(self):
+        """Reanuda los trabajos pendientes sin dueño vivo y arranca el recolector y los leases."""
+        await self._resume_orphans()
+        self._gc_task = asyncio.create_task(self._gc_loop())
+        self._lease_task = asyncio.create_task(self._lease_loop())
+
+    async def stop(self):
+        if self._gc_task is not None:
+            self._gc_task.cancel()
+        if self._lease_task is not None:
+            self._lease_task.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        # Parada ordenada: los trabajos interrumpidos se reanudan sin esperar a que venza el lease
+        await self._call(self.store.release, self.owner)
+
+    async def _resume_orphans(self):
+        for job in await self._call(self.store.claim_orphans, self.owner):
+            if job["job_id"] in self._running:
+                continue
+            logger.info(f"Reanudando job {job['job_id']} ({job['status']})")
+            await self._publish(job["job_id"], {"status": QUEUED, "resumed": True})
+            self._spawn(job["job_id"], job["text"], job["params"])
+
+    async def _lease_loop(self):
+        # Renovar los leases propios y reanudar los trabajos de workers que han muerto
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                await self._call(self.store.renew, self.owner, list(self._running))
+                await self._resume_orphans()
+            except Exception as e:
+                logger.error(f"Job lease error: {e}")
+
+    async def _gc_loop(self):
+        while True:
+            try:
+                deleted = await self._call(self.store.gc, JOB_RETENTION_SECONDS)
+                if deleted:
+                    logger.info(f"GC de jobs: {deleted} trabajos eliminados")
+            except Exception as e:
+                logger.error(f"Job GC error: {e}")
+            await asyncio.sleep(JOB_GC_INTERVAL_SECONDS)
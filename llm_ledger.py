@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+Ledger de llamadas a los modelos de Ollama, para planificar capacidad.
+
+Cada llamada que hacen los agentes se añade como una línea JSON compacta a un
+archivo local (solo se añade, nunca se reescribe) con el agente, el modelo, los
+tokens y las duraciones que devuelve Ollama. Al llegar a BOB_LLM_LEDGER_ROTATE_MB
+el archivo se rota (llm_ledger.jsonl.1, .2...). El servidor expone agregados
+móviles y este script genera informes:
+
+    python llm_ledger.py report --by agent
+    python llm_ledger.py report --by model --since 24
+    python llm_ledger.py report --by hour
+    python llm_ledger.py cascade
+    python llm_ledger.py budget
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, replace
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # fuera de POSIX se rota sin bloqueo entre procesos
+    fcntl = None
+
+from cascade import ACCEPTED, CASCADE_ENABLED, ESCALATED, FAILED, REJECTED, TEXT, verify
+
+logger = logging.getLogger(__name__)
+
+LEDGER_PATH = os.environ.get("BOB_LLM_LEDGER", os.path.join(os.getcwd(), "llm_ledger.jsonl"))
+LEDGER_ROTATE_BYTES = int(float(os.environ.get("BOB_LLM_LEDGER_ROTATE_MB", 64)) * 1024 * 1024)
+# Archivos rotados que se conservan (los más antiguos se borran)
+LEDGER_KEEP_FILES = int(os.environ.get("BOB_LLM_LEDGER_KEEP_FILES", 3))
+# Tamaño de los bloques con los que LedgerTail busca el principio de su ventana desde el final
+TAIL_BLOCK_BYTES = 1024 * 1024
+
+# Claves cortas de cada registro
+# t: timestamp, r: request_id, a: agente, m: modelo,
+# pt: tokens del prompt, et: tokens generados,
+# pd / ed / td: duración de prompt-eval, eval y total en ms
+# k: resultado en la cascada de modelos (accepted / rejected / failed / escalated), si la hay
+# c: canal (voice / text), b: max_tokens del presupuesto de salida, si lo hay,
+# x: 1 si la generación se cortó al agotar el presupuesto
+_request_id: Optional[str] = None
+_last_truncated = False
+
+
+def set_request_id(request_id: Optional[str]):
+    """Asocia las siguientes llamadas de este proceso a una petición (un turno)."""
+    global _request_id
+    _request_id = request_id
+
+
+def last_call_truncated() -> bool:
+    """Si la última llamada registrada por este proceso se cortó por el presupuesto de salida."""
+    return _last_truncated
+
+
+def _stat(response: Any, key: str) -> Any:
+    # Las respuestas de la librería ollama son modelos pydantic o diccionarios según la versión
+    value = getattr(response, key, None)
+    if value is None and isinstance(response, dict):
+        value = response.get(key)
+    return value
+
+
+def _ns_to_ms(value: Optional[int]) -> Optional[float]:
+    return round(value / 1e6, 1) if value else None
+
+
+def record_response(agent: Optional[str], model: str, response: Any, outcome: Optional[str] = None,
+                    channel: Optional[str] = None, budget: Optional[int] = None, path: str = LEDGER_PATH):
+    """Añade al ledger las estadísticas de una respuesta (o del último chunk) de Ollama."""
+    global _last_truncated
+    record = {
+        "t": round(time.time(), 3),
+        "r": _request_id,
+        "a": agent,
+        "m": model,
+        "pt": _stat(response, "prompt_eval_count") or 0,
+        "et": _stat(response, "eval_count") or 0,
+        "pd": _ns_to_ms(_stat(response, "prompt_eval_duration")),
+        "ed": _ns_to_ms(_stat(response, "eval_duration")),
+        "td": _ns_to_ms(_stat(response, "total_duration")),
+    }
+    if outcome:
+        record["k"] = outcome
+    if channel:
+        record["c"] = channel
+    # Ollama termina con done_reason "length" cuando llega a num_predict
+    _last_truncated = bool(budget) and _stat(response, "done_reason") == "length"
+    if budget:
+        record["b"] = budget
+        if _last_truncated:
+            record["x"] = 1
+    line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+    # Una sola escritura con O_APPEND: los procesos concurrentes no mezclan líneas
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        size = os.fstat(fd).st_size
+    finally:
+        os.close(fd)
+    if size >= LEDGER_ROTATE_BYTES:
+        rotate(path, LEDGER_ROTATE_BYTES)
+
+
+def rotated_paths(path: str = LEDGER_PATH) -> List[str]:
+    """Los archivos rotados que existen, del más antiguo al más reciente."""
+    return [f"{path}.{n}" for n in range(LEDGER_KEEP_FILES, 0, -1) if os.path.exists(f"{path}.{n}")]
+
+
+def rotate(path: str = LEDGER_PATH, max_bytes: int = LEDGER_ROTATE_BYTES):
+    """Rota el ledger si ocupa `max_bytes` o más: path -> path.1 -> path.2..."""
+    # Cada runner escribe desde su propio proceso: el lock evita que dos roten a la vez
+    with open(f"{path}.lock", "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        # Otro proceso puede haberlo rotado mientras se esperaba el lock
+        if not os.path.exists(path) or os.path.getsize(path) < max_bytes:
+            return
+        for n in range(LEDGER_KEEP_FILES, 0, -1):
+            source = path if n == 1 else f"{path}.{n - 1}"
+            if os.path.exists(source):
+                os.replace(source, f"{path}.{n}")
+
+
+_model_class = None
+
+
+def ledger_model(agent: str, **kwargs):
+    """Crea un modelo Ollama de agno que registra cada llamada en el ledger."""
+    global _model_class
+    if _model_class is None:
+        _model_class = _build_model_class()
+    return _model_class(ledger_agent=agent, **kwargs)
+
+
+def _build_model_class():
+    # agno solo se importa cuando se construye el primer agente
+    from agno.models.ollama import Ollama
+
+    @dataclass
+    class LedgerOllama(Ollama):
+        ledger_agent: Optional[str] = None
+        ledger_channel: Optional[str] = None
+        # Cascada: modelo borrador y verificador que decide si hace falta el modelo configurado
+        draft_id: Optional[str] = None
+        verifier: str = TEXT
+        sql_schema: Optional[str] = None
+
+        def _budget(self) -> Optional[int]:
+            return (self.options or {}).get("num_predict")
+
+        def _record(self, model_id, response, outcome=None):
+            record_response(self.ledger_agent, model_id, response, outcome, self.ledger_channel, self._budget())
+
+        def _cascade(self) -> bool:
+            return CASCADE_ENABLED and bool(self.draft_id)
+
+        def _draft_model(self):
+            return replace(self, id=self.draft_id, draft_id=None)
+
+        def _review(self, draft, response) -> bool:
+            message = _stat(response, "message")
+            if _stat(message, "tool_calls"):
+                # Las llamadas a herramientas las valida el propio agente
+                reason = None
+            else:
+                done_reason = _stat(response, "done_reason")
+                if done_reason == "length" and self.verifier == TEXT and self._budget():
+                    # Cortado por el presupuesto de salida: el modelo configurado también se cortaría
+                    done_reason = None
+                reason = verify(self.verifier, _stat(message, "content") or "", done_reason, self.sql_schema)
+            self._record(draft.id, response, REJECTED if reason else ACCEPTED)
+            if reason:
+                logger.info(f"Borrador de {self.ledger_agent} ({draft.id}) rechazado: {reason}")
+            return reason is None
+
+        def _draft_failed(self, draft, error: Exception, started: float):
+            # Sin respuesta de Ollama: se registra al menos el tiempo perdido en el borrador
+            elapsed_ns = int((time.perf_counter() - started) * 1e9)
+            self._record(draft.id, {"total_duration": elapsed_ns}, FAILED)
+            logger.info(f"Borrador de {self.ledger_agent} ({draft.id}) falló: {error}")
+
+        def invoke(self, *args, **kwargs):
+            if not self._cascade():
+                response = super().invoke(*args, **kwargs)
+                self._record(self.id, response)
+                return response
+            draft = self._draft_model()
+            started = time.perf_counter()
+            try:
+                response = Ollama.invoke(draft, *args, **kwargs)
+                if self._review(draft, response):
+                    return response
+            except Exception as e:
+                self._draft_failed(draft, e, started)
+            response = super().invoke(*args, **kwargs)
+            self._record(self.id, response, ESCALATED)
+            return response
+
+        async def ainvoke(self, *args, **kwargs):
+            if not self._cascade():
+                response = await super().ainvoke(*args, **kwargs)
+                self._record(self.id, response)
+                return response
+            draft = self._draft_model()
+            started = time.perf_counter()
+            try:
+                response = await Ollama.ainvoke(draft, *args, **kwargs)
+                if self._review(draft, response):
+                    return response
+            except Exception as e:
+                self._draft_failed(draft, e, started)
+            response = await super().ainvoke(*args, **kwargs)
+            self._record(self.id, response, ESCALATED)
+            return response
+
+        def invoke_stream(self, *args, **kwargs):
+            # En streaming no hay cascada: el borrador no se puede verificar antes de enviarlo.
+            # Ollama envía las estadísticas en el último chunk (done=True)
+            for chunk in super().invoke_stream(*args, **kwargs):
+                if _stat(chunk, "done"):
+                    self._record(self.id, chunk)
+                yield chunk
+
+        async def ainvoke_stream(self, *args, **kwargs):
+            async for chunk in super().ainvoke_stream(*args, **kwargs):
+                if _stat(chunk, "done"):
+                    self._record(self.id, chunk)
+                yield chunk
+
+    return LedgerOllama
+
+
+def read_records(path: str = LEDGER_PATH, since: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """Los registros del ledger, incluidos los de los archivos rotados, en orden."""
+    for current in rotated_paths(path) + [path]:
+        if not os.path.exists(current):
+            continue
+        with open(current, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # línea incompleta
+                if since is None or record["t"] >= since:
+                    yield record
+
+
+def _group_key(record: Dict[str, Any], by: str) -> str:
+    if by == "hour":
+        return time.strftime("%Y-%m-%d %H:00", time.localtime(record["t"]))
+    if by == "model":
+        return record["m"] or "-"
+    return record["a"] or "-"
+
+
+def aggregate(records: Iterable[Dict[str, Any]], by: str = "agent") -> Dict[str, Dict[str, Any]]:
+    groups: Dict[str, Dict[str, Any]] = defaultdict(lambda: {
+        "calls": 0, "prompt_tokens": 0, "eval_tokens": 0, "prompt_eval_ms": 0.0, "eval_ms": 0.0,
+        "total_ms": 0.0, "requests": set(),
+    })
+    for record in records:
+        group = groups[_group_key(record, by)]
+        group["calls"] += 1
+        group["prompt_tokens"] += record["pt"]
+        group["eval_tokens"] += record["et"]
+        group["prompt_eval_ms"] += record["pd"] or 0.0
+        group["eval_ms"] += record["ed"] or 0.0
+        group["total_ms"] += record["td"] or 0.0
+        if record.get("r"):
+            group["requests"].add(record["r"])
+
+    result = {}
+    for key, group in sorted(groups.items()):
+        requests = len(group.pop("requests"))
+        group["prompt_tokens_per_s"] = round(group["prompt_tokens"] / (group["prompt_eval_ms"] / 1000), 1) if group["prompt_eval_ms"] else None
+        group["eval_tokens_per_s"] = round(group["eval_tokens"] / (group["eval_ms"] / 1000), 1) if group["eval_ms"] else None
+        group["ollama_ms_per_request"] = round(group["total_ms"] / requests, 1) if requests else None
+        group["prompt_eval_ms"] = round(group["prompt_eval_ms"], 1)
+        group["eval_ms"] = round(group["eval_ms"], 1)
+        group["total_ms"] = round(group["total_ms"], 1)
+        result[key] = group
+    return result
+
+
+def _mean(values: List[float]) -> Optional[float]:
+    return round(sum(values) / len(values), 1) if values else None
+
+
+def cascade_report(records: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Tasa de escalado y ahorro de latencia de la cascada, por agente.
+
+    El ahorro compara el coste sin cascada (todas las llamadas con el modelo configurado)
+    con el real: todos los borradores más las llamadas escaladas. Se escalan los borradores
+    rechazados y los que fallaron.
+    """
+    groups: Dict[str, Dict[str, List[float]]] = defaultdict(
+        lambda: {ACCEPTED: [], REJECTED: [], FAILED: [], ESCALATED: []})
+    for record in records:
+        if record.get("k"):
+            groups[record["a"] or "-"][record["k"]].append(record["td"] or 0.0)
+
+    result = {}
+    for agent, outcomes in sorted(groups.items()):
+        escalated = len(outcomes[REJECTED]) + len(outcomes[FAILED])
+        drafts = len(outcomes[ACCEPTED]) + escalated
+        draft_ms = _mean(outcomes[ACCEPTED] + outcomes[REJECTED] + outcomes[FAILED])
+        full_ms = _mean(outcomes[ESCALATED])
+        saved_ms = None
+        if drafts and draft_ms is not None and full_ms is not None:
+            saved_ms = round(len(outcomes[ACCEPTED]) * full_ms - drafts * draft_ms, 1)
+        result[agent] = {
+            "drafts": drafts,
+            "escalated": escalated,
+            "failed": len(outcomes[FAILED]),
+            "escalation_rate": round(escalated / drafts, 3) if drafts else None,
+            "draft_ms": draft_ms,
+            "full_ms": full_ms,
+            "saved_ms": saved_ms,
+            "saved_ratio": round(saved_ms / (drafts * full_ms), 3) if saved_ms is not None and full_ms else None,
+        }
+    return result
+
+
+def budget_report(records: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Cortes y ahorro de tokens de los presupuestos de salida, por agente y canal.
+
+    El ahorro compara los tokens generados con presupuesto con la media de las
+    llamadas del mismo agente sin presupuesto; sin esa referencia no se estima.
+    """
+    groups: Dict[str, Dict[str, Any]] = defaultdict(lambda: {
+        "calls": 0, "budgeted": 0, "truncated": 0, "max_tokens": None, "eval_tokens": [],
+    })
+    # Referencia por agente: tokens y ms de eval de las llamadas sin presupuesto
+    baselines: Dict[str, List[float]] = defaultdict(lambda: [0, 0, 0.0])
+    for record in records:
+        agent = record["a"] or "-"
+        group = groups[f"{agent}/{record.get('c') or '-'}"]
+        group["calls"] += 1
+        if record.get("b"):
+            group["budgeted"] += 1
+            group["truncated"] += record.get("x", 0)
+            group["max_tokens"] = record["b"]
+            group["eval_tokens"].append(record["et"])
+        else:
+            baseline = baselines[agent]
+            baseline[0] += 1
+            baseline[1] += record["et"]
+            baseline[2] += record["ed"] or 0.0
+
+    result = {}
+    for key, group in sorted(groups.items()):
+        calls, tokens, eval_ms = baselines.get(key.rsplit("/", 1)[0], (0, 0, 0.0))
+        baseline_tokens = round(tokens / calls, 1) if calls else None
+        eval_tokens = _mean(group.pop("eval_tokens"))
+        saved_tokens = saved_ms = None
+        if group["budgeted"] and baseline_tokens is not None:
+            saved_tokens = round(group["budgeted"] * (baseline_tokens - eval_tokens))
+            if tokens:
+                saved_ms = round(saved_tokens * eval_ms / tokens, 1)
+        result[key] = {
+            **group,
+            "truncation_rate": round(group["truncated"] / group["budgeted"], 3) if group["budgeted"] else None,
+            "eval_tokens": eval_tokens,
+            "baseline_tokens": baseline_tokens,
+            "saved_tokens": saved_tokens,
+            "saved_eval_ms": saved_ms,
+        }
+    return result
+
+
+class LedgerTail:
+    """Lee incrementalmente el ledger y mantiene los registros de la última ventana en memoria.
+
+    La primera lectura empieza cerca del final, en el primer registro de la ventana, así
+    que ni la memoria ni el arranque dependen de la historia del archivo.
+    """
+
+    def __init__(self, path: str = LEDGER_PATH, window: float = 3600.0):
+        self.path = path
+        self.window = window
+        self._offset: Optional[int] = None
+        self._inode: Optional[int] = None
+        self._records: Deque[Dict[str, Any]] = deque()
+        self._lock = threading.Lock()
+
+    def _window_start(self, path: str, size: int) -> int:
+        """Offset de una línea anterior a la ventana (o 0), buscando desde el final por bloques."""
+        cutoff = time.time() - self.window
+        with open(path, "rb") as f:
+            position = size
+            while position > 0:
+                position = max(0, position - TAIL_BLOCK_BYTES)
+                f.seek(position)
+                block = f.read(TAIL_BLOCK_BYTES)
+                # La primera línea completa del bloque (la anterior puede estar cortada)
+                start = 0 if position == 0 else block.find(b"\n") + 1
+                end = block.find(b"\n", start)
+                if (position > 0 and start == 0) or end < 0:
+                    continue
+                try:
+                    if json.loads(block[start:end])["t"] < cutoff:
+                        return position + start
+                except (ValueError, KeyError):
+                    continue
+        return 0
+
+    def _read(self, path: str, offset: int) -> int:
+        """Añade los registros completos de `path` desde `offset`; devuelve el nuevo offset."""
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        # Solo procesar líneas completas; el resto se leerá la próxima vez
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                self._records.append(json.loads(line))
+            except ValueError:
+                continue
+        return offset + end
+
+    def _poll(self):
+        if not os.path.exists(self.path):
+            return
+        stat = os.stat(self.path)
+        if self._offset is None:
+            # Primera lectura: solo la ventana, que puede empezar en el último archivo rotado
+            start = self._window_start(self.path, stat.st_size)
+            previous = f"{self.path}.1"
+            if start == 0 and os.path.exists(previous):
+                self._read(previous, self._window_start(previous, os.path.getsize(previous)))
+            self._inode, self._offset = stat.st_ino, start
+        elif stat.st_ino != self._inode:
+            # Se rotó: terminar el archivo anterior (ahora .1) y empezar el nuevo desde el principio
+            previous = f"{self.path}.1"
+            if os.path.exists(previous) and os.stat(previous).st_ino == self._inode:
+                self._read(previous, self._offset)
+            self._inode, self._offset = stat.st_ino, 0
+        elif stat.st_size < self._offset:
+            # El archivo se truncó: empezar de nuevo
+            self._offset = 0
+            self._records.clear()
+        if stat.st_size > self._offset:
+            self._offset = self._read(self.path, self._offset)
+
+    def records(self, window: Optional[float] = None) -> List[Dict[str, Any]]:
+        window = min(window or self.window, self.window)
+        with self._lock:
+            self._poll()
+            cutoff = time.time() - self.window
+            while self._records and self._records[0]["t"] < cutoff:
+                self._records.popleft()
+            since = time.time() - window
+            return [r for r in self._records if r["t"] >= since]
+
+    def aggregates(self, by: str = "agent", window: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        return aggregate(self.records(window), by)
+
+    def cascade(self, window: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        return cascade_report(self.records(window))
+
+    def budget(self, window: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        return budget_report(self.records(window))
+
+
+REPORT_COLUMNS = ["calls", "prompt_tokens", "eval_tokens", "prompt_eval_ms", "eval_ms",
+                  "prompt_tokens_per_s", "eval_tokens_per_s", "ollama_ms_per_request"]
+
+
+def print_report(report: Dict[str, Dict[str, Any]], by: str, columns: List[str] = REPORT_COLUMNS):
+    width = max([len(by)] + [len(key) for key in report]) + 2
+    print(f"{by:<{width}}" + "".join(f"{column:>22}" for column in columns))
+    for key, group in report.items():
+        print(f"{key:<{width}}" + "".join(f"{'-' if group[c] is None else group[c]:>22}" for c in columns))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Informes del ledger de llamadas a LLM")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report = subparsers.add_parser("report", help="agregar el ledger")
+    report.add_argument("--by", choices=["agent", "model", "hour"], default="agent")
+    report.add_argument("--since", type=float, help="solo las últimas N horas")
+    report.add_argument("--path", default=LEDGER_PATH)
+    report.add_argument("--json", action="store_true", help="salida en JSON")
+    cascade = subparsers.add_parser("cascade", help="tasa de escalado y ahorro de la cascada de modelos")
+    cascade.add_argument("--since", type=float, help="solo las últimas N horas")
+    cascade.add_argument("--path", default=LEDGER_PATH)
+    cascade.add_argument("--json", action="store_true", help="salida en JSON")
+    budget = subparsers.add_parser("budget", help="cortes y ahorro de tokens de los presupuestos de salida")
+    budget.add_argument("--since", type=float, help="solo las últimas N horas")
+    budget.add_argument("--path", default=LEDGER_PATH)
+    budget.add_argument("--json", action="store_true", help="salida en JSON")
+    args = parser.parse_args(argv)
+
+    since = time.time() - args.since * 3600 if args.since else None
+    if args.command == "cascade":
+        result = cascade_report(read_records(args.path, since))
+        columns = ["drafts", "escalated", "failed", "escalation_rate", "draft_ms", "full_ms", "saved_ms", "saved_ratio"]
+    elif args.command == "budget":
+        result = budget_report(read_records(args.path, since))
+        columns = ["calls", "budgeted", "truncated", "truncation_rate", "max_tokens", "eval_tokens",
+                   "baseline_tokens", "saved_tokens", "saved_eval_ms"]
+    else:
+        result = aggregate(read_records(args.path, since), args.by)
+        columns = REPORT_COLUMNS
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        by = {"cascade": "agent", "budget": "agent/channel"}.get(args.command, getattr(args, "by", "agent"))
+        print_report(result, by, columns)
+
+
+if __name__ == "__main__":
+    main()
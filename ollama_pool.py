@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Pool de servidores Ollama con reparto de carga según el modelo.
+
+El servidor FastAPI hace de proxy (/ollama/...) delante de varios servidores
+Ollama definidos en ollama_hosts.toml. Cada petición va al servidor con menos
+peticiones en curso entre los que sirven ese modelo, prefiriendo los que ya lo
+tienen cargado en memoria. Los servidores que fallan seguidos se expulsan del
+pool durante un tiempo (chequeo pasivo, a partir de las propias peticiones).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_HOSTS_CONFIG_PATH = os.environ.get(
+    "BOB_OLLAMA_HOSTS_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ollama_hosts.toml")
+)
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+# Fallos seguidos antes de expulsar un servidor y duración de la primera expulsión
+OLLAMA_EJECT_AFTER = int(os.environ.get("BOB_OLLAMA_EJECT_AFTER", 3))
+OLLAMA_EJECT_SECONDS = float(os.environ.get("BOB_OLLAMA_EJECT_SECONDS", 10))
+OLLAMA_EJECT_MAX_SECONDS = float(os.environ.get("BOB_OLLAMA_EJECT_MAX_SECONDS", 300))
+# Cada cuánto se pregunta a los servidores qué modelos tienen cargados (/api/ps)
+OLLAMA_PS_INTERVAL = float(os.environ.get("BOB_OLLAMA_PS_INTERVAL", 15))
+# Segundos sin recibir nada de un servidor antes de darlo por colgado y liberar su hueco
+# (holgado: sin streaming, Ollama no responde nada hasta terminar de generar)
+OLLAMA_READ_TIMEOUT = float(os.environ.get("BOB_OLLAMA_READ_TIMEOUT", 300))
+OLLAMA_CONNECT_TIMEOUT = 3.05
+
+ANY_MODEL = "*"
+
+# Rutas que acepta el proxy /ollama: solo inferencia y el estado de los modelos cargados.
+# Las de gestión (pull, create, delete...) no se exponen
+OLLAMA_PROXY_PATHS = {"/api/chat": "POST", "/api/generate": "POST", "/api/embed": "POST", "/api/ps": "GET"}
+
+# Cabeceras que no se reenvían en ninguna dirección
+HOP_BY_HOP_HEADERS = {"host", "connection", "keep-alive", "transfer-encoding", "content-length", "upgrade"}
+
+
+class OllamaHost:
+    def __init__(self, url: str, models: List[str], max_concurrency: int = 2):
+        self.url = url.rstrip("/")
+        self.models = set(models)
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # Peticiones asignadas a este servidor (en curso o esperando el semáforo)
+        self.outstanding = 0
+        self.loaded: set = set()
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        # Métricas
+        self.requests = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def serves(self, model: Optional[str]) -> bool:
+        return model is None or ANY_MODEL in self.models or model in self.models
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def record_success(self, model: Optional[str], latency: float):
+        self.requests += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.consecutive_failures = 0
+        self.ejections = 0
+        if model:
+            # Tras responder, Ollama mantiene el modelo cargado (keep_alive)
+            self.loaded.add(model)
+
+    def record_failure(self) -> Optional[float]:
+        """Cuenta el fallo y devuelve los segundos de expulsión si el servidor queda expulsado."""
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= OLLAMA_EJECT_AFTER:
+            # Backoff exponencial entre expulsiones; tras la expulsión el servidor vuelve
+            # a recibir tráfico y un solo fallo más lo expulsa de nuevo
+            duration = min(OLLAMA_EJECT_SECONDS * 2 ** self.ejections, OLLAMA_EJECT_MAX_SECONDS)
+            self.ejected_until = time.monotonic() + duration
+            self.ejections += 1
+            self.consecutive_failures = OLLAMA_EJECT_AFTER - 1
+            logger.warning(f"Servidor Ollama {self.url} expulsado del pool durante {duration:.0f}s")
+            return duration
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        successes = self.requests - self.failures
+        return {
+            "url": self.url,
+            "models": sorted(self.models),
+            "loaded": sorted(self.loaded),
+            "max_concurrency": self.max_concurrency,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "mean_latency": self.total_latency / successes if successes else None,
+            "max_latency": self.max_latency,
+            "ejected_for": max(0.0, self.ejected_until - time.monotonic()),
+        }
+
+
+def load_hosts(path: str) -> List[OllamaHost]:
+    if not os.path.exists(path):
+        return [OllamaHost(DEFAULT_OLLAMA_URL, [ANY_MODEL])]
+    with open(path, "rb") as f:
+        config = tomllib.load(f)
+    defaults = config.get("defaults", {})
+    hosts = []
+    for host in config.get("hosts", []):
+        hosts.append(OllamaHost(
+            host["url"],
+            host.get("models", defaults.get("models", [ANY_MODEL])),
+            host.get("max_concurrency", defaults.get("max_concurrency", 2)),
+        ))
+    if not hosts:
+        raise ValueError(f"No Ollama hosts defined in {path}")
+    return hosts
+
+
+def model_from_body(body: bytes) -> Optional[str]:
+    # /api/chat, /api/generate, /api/embed... llevan el modelo en el cuerpo JSON
+    if not body:
+        return None
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None
+    model = payload.get("model") if isinstance(payload, dict) else None
+    return model if isinstance(model, str) else None
+
+
+def proxy_timeout() -> httpx.Timeout:
+    """Timeouts del cliente HTTP del proxy: un servidor colgado no retiene su hueco para siempre."""
+    return httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT)
+
+
+class NoHostAvailable(Exception):
+    """Ningún servidor del pool sirve el modelo pedido."""
+
+
+class ProxiedBody:
+    """Cuerpo de una respuesta de Ollama que libera el hueco del servidor al terminar.
+
+    `aclose` es idempotente y libera el hueco aunque el cuerpo no se haya empezado a
+    leer (p. ej. el cliente se fue antes), algo que un generador no garantiza.
+    """
+
+    def __init__(self, pool: "OllamaPool", host: OllamaHost, response: httpx.Response, model: Optional[str],
+                 started: float):
+        self.pool = pool
+        self.host = host
+        self.response = response
+        self.model = model
+        self.started = started
+        self.completed = False
+        self.failed = response.status_code >= 500
+        self._closed = False
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self.response.aiter_raw():
+                yield chunk
+            self.completed = True
+        except Exception:
+            self.failed = True
+            raise
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self.response.aclose()
+        finally:
+            self.pool._finish(self.host)
+            # Si el cliente abandona la respuesta a medias no cuenta ni como éxito ni como fallo
+            if self.failed:
+                self.pool._record_failure(self.host)
+            elif self.completed:
+                self.host.record_success(self.model if self.response.status_code < 400 else None,
+                                         time.monotonic() - self.started)
+
+
+class OllamaPool:
+    def __init__(self, hosts: List[OllamaHost]):
+        self.hosts = hosts
+        self._ps_task: Optional[asyncio.Task] = None
+        # Se llama con (servidor, segundos) en cada expulsión, p. ej. para avisar a los demás workers
+        self.on_eject: Optional[Callable[[OllamaHost, float], Any]] = None
+
+    def acquire_host(self, model: Optional[str], exclude: Optional[set] = None) -> OllamaHost:
+        """Elige servidor y le asigna la petición; hay que llamar a `release` al terminar."""
+        candidates = [host for host in self.hosts if host.serves(model) and host not in (exclude or ())]
+        if not candidates:
+            raise NoHostAvailable(f"No Ollama host serves model {model}")
+        now = time.monotonic()
+        healthy = [host for host in candidates if host.available(now)]
+        if not healthy:
+            # Todos expulsados: mejor probar el que antes vuelve que fallar sin intentarlo
+            healthy = [min(candidates, key=lambda host: host.ejected_until)]
+        host = min(healthy, key=lambda host: (
+            host.outstanding >= host.max_concurrency,  # primero los que tienen hueco
+            model is not None and model not in host.loaded,  # luego los que ya tienen el modelo cargado
+            host.outstanding / host.max_concurrency,  # y entre ellos, el menos ocupado
+        ))
+        host.outstanding += 1
+        return host
+
+    @staticmethod
+    def release(host: OllamaHost):
+        host.outstanding -= 1
+
+    def eject(self, url: str, duration: float):
+        """Expulsa el servidor `url` durante `duration` segundos (expulsión decidida en otro worker)."""
+        for host in self.hosts:
+            if host.url == url.rstrip("/"):
+                host.ejected_until = max(host.ejected_until, time.monotonic() + duration)
+
+    def _record_failure(self, host: OllamaHost):
+        duration = host.record_failure()
+        if duration is not None and self.on_eject is not None:
+            self.on_eject(host, duration)
+
+    async def send(self, client: httpx.AsyncClient, method: str, path: str, body: bytes,
+                   headers: Dict[str, str]) -> Tuple[OllamaHost, httpx.Response, ProxiedBody]:
+        """Reenvía la petición y devuelve el servidor, la respuesta y su cuerpo.
+
+        Si no se puede conectar con el servidor elegido se prueba con otro; una vez enviada
+        la petición ya no se reintenta para no repetir una generación. Hay que cerrar el
+        cuerpo (`aclose`) aunque no se lea, para devolver el hueco al servidor.
+        """
+        model = model_from_body(body)
+        headers = {name: value for name, value in headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+        tried: set = set()
+        while True:
+            host = self.acquire_host(model, tried)
+            try:
+                await host.semaphore.acquire()
+            except BaseException:
+                self.release(host)
+                raise
+            started = time.monotonic()
+            try:
+                request = client.build_request(method, host.url + path, content=body, headers=headers)
+                response = await client.send(request, stream=True)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                self._finish(host)
+                self._record_failure(host)
+                tried.add(host)
+                logger.warning(f"No se pudo conectar con {host.url}: {e}")
+                if len(tried) >= len([h for h in self.hosts if h.serves(model)]):
+                    raise
+                continue
+            except Exception:
+                self._finish(host)
+                self._record_failure(host)
+                raise
+            except BaseException:
+                # Petición cancelada (el cliente se fue): no es un fallo del servidor
+                self._finish(host)
+                raise
+            return host, response, ProxiedBody(self, host, response, model, started)
+
+    def _finish(self, host: OllamaHost):
+        host.semaphore.release()
+        self.release(host)
+
+    async def start(self, client: httpx.AsyncClient):
+        if self._ps_task is None and len(self.hosts) > 1:
+            self._ps_task = asyncio.create_task(self._refresh_loaded_loop(client))
+
+    async def stop(self):
+        if self._ps_task is not None:
+            self._ps_task.cancel()
+            self._ps_task = None
+
+    async def _refresh_loaded_loop(self, client: httpx.AsyncClient):
+        # Ollama descarga los modelos inactivos; /api/ps dice cuáles siguen en memoria.
+        # No cuenta para la salud del servidor, eso solo lo deciden las peticiones reales.
+        while True:
+            for host in self.hosts:
+                if not host.available(time.monotonic()):
+                    continue
+                try:
+                    response = await client.get(f"{host.url}/api/ps", timeout=2.0)
+                    response.raise_for_status()
+                    host.loaded = {model["name"] for model in response.json().get("models", [])}
+                except Exception:
+                    pass
+            await asyncio.sleep(OLLAMA_PS_INTERVAL)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hosts": [host.stats() for host in self.hosts]}
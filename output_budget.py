@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Presupuestos de salida de los agentes por canal (voz o texto).
+
+Cada presupuesto limita la generación con `max_tokens` (num_predict de
+Ollama), `stop` (secuencias que la cortan) y `concise` (una instrucción de
+respuesta breve que se añade al agente). Se definen en agents.toml: los de
+`[budgets.<canal>]` valen para todos los agentes y los de
+`[agents.<clave>.budget]` (y `[agents.<clave>.budget.<canal>]`) los
+sobreescriben para un agente.
+
+Una respuesta cortada por el presupuesto se puede continuar: el servidor
+guarda la pregunta y lo generado, y una petición "continue" vuelve a llamar al
+agente con ambos para que siga donde lo dejó.
+"""
+
+import os
+import re
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+TEXT_CHANNEL = "text"
+VOICE_CHANNEL = "voice"
+CHANNELS = (TEXT_CHANNEL, VOICE_CHANNEL)
+
+BUDGET_FIELDS = ("max_tokens", "stop", "concise")
+
+# Desactiva todos los presupuestos sin tocar agents.toml
+BUDGETS_ENABLED = os.environ.get("BOB_OUTPUT_BUDGETS", "1").lower() not in ("0", "false", "no", "")
+# Respuestas cortadas que se recuerdan por proceso para poder continuarlas
+CONTINUE_MAX_PENDING = int(os.environ.get("BOB_CONTINUE_MAX_PENDING", 256))
+
+CONCISE_INSTRUCTION = (
+    "Responde de forma breve y directa, en pocas frases y sin listas largas ni formato. "
+    "Si la respuesta necesita más detalle, resume lo esencial y ofrece ampliarlo."
+)
+
+_SENTENCE_END = re.compile(r".*[.!?…]", re.DOTALL)
+
+
+def check(budget: Dict[str, Any]) -> Optional[str]:
+    """Devuelve el problema de un presupuesto de agents.toml, o None si es válido."""
+    if not isinstance(budget, dict):
+        return "budget must be a table"
+    for field in budget:
+        if field not in BUDGET_FIELDS and field not in CHANNELS:
+            return f"unknown budget field '{field}'"
+    max_tokens = budget.get("max_tokens", 0)
+    if not isinstance(max_tokens, int) or isinstance(max_tokens, bool) or max_tokens < 0:
+        return "max_tokens must be a non-negative integer"
+    stop = budget.get("stop", [])
+    if isinstance(stop, str):
+        stop = [stop]
+    if not isinstance(stop, list) or not all(isinstance(s, str) and s for s in stop):
+        return "stop must be a string or a list of strings"
+    if not isinstance(budget.get("concise", False), (bool, str)):
+        return "concise must be true, false or an instruction"
+    return None
+
+
+def resolve(defaults: Dict[str, Any], budget: Dict[str, Any], channel: str) -> Dict[str, Any]:
+    """Presupuesto efectivo de un agente en `channel`.
+
+    De menos a más prioridad: `[budgets.<canal>]`, `[agents.<clave>.budget]` y
+    `[agents.<clave>.budget.<canal>]`. `max_tokens = 0` y `concise = false` anulan
+    un valor heredado.
+    """
+    resolved: Dict[str, Any] = {}
+    for layer in (defaults.get(channel, {}), budget, budget.get(channel, {})):
+        resolved.update({field: value for field, value in layer.items() if field in BUDGET_FIELDS})
+    if isinstance(resolved.get("stop"), str):
+        resolved["stop"] = [resolved["stop"]]
+    return {field: value for field, value in resolved.items() if value}
+
+
+def model_options(budget: Dict[str, Any]) -> Dict[str, Any]:
+    """Opciones de Ollama que aplican el presupuesto durante la generación."""
+    if not BUDGETS_ENABLED:
+        return {}
+    options = {}
+    if budget.get("max_tokens"):
+        options["num_predict"] = budget["max_tokens"]
+    if budget.get("stop"):
+        options["stop"] = list(budget["stop"])
+    return options
+
+
+def instruction(budget: Dict[str, Any]) -> Optional[str]:
+    """Instrucción de modo conciso del presupuesto, si la tiene."""
+    concise = budget.get("concise") if BUDGETS_ENABLED else None
+    if not concise:
+        return None
+    return concise if isinstance(concise, str) else CONCISE_INSTRUCTION
+
+
+def complete_sentences(text: str) -> str:
+    """El texto hasta la última frase terminada (para no leer en voz alta una frase a medias)."""
+    match = _SENTENCE_END.match(text)
+    return match.group(0) if match else ""
+
+
+def continuation_prompt(question: str, answer: str) -> str:
+    return (
+        f"{question}\n\n"
+        f"Tu respuesta anterior se cortó por longitud. Esto es lo que ya respondiste:\n\n{answer}\n\n"
+        "Continúa la respuesta exactamente donde se quedó, sin repetir nada de lo anterior."
+    )
+
+
+class Continuations:
+    """Respuestas cortadas por el presupuesto que se pueden continuar, por cliente y request_id.
+
+    Solo el cliente que hizo la petición puede continuarla. Solo se guardan las últimas
+    CONTINUE_MAX_PENDING; una continuación que vuelve a cortarse se guarda con la
+    respuesta acumulada.
+    """
+
+    def __init__(self, max_pending: int = CONTINUE_MAX_PENDING):
+        self.max_pending = max_pending
+        self._pending: "OrderedDict[Tuple[str, str], Tuple[str, str, str]]" = OrderedDict()
+
+    def add(self, client_id: str, request_id: str, question: str, answer: str, channel: str):
+        key = (client_id, request_id)
+        self._pending[key] = (question, answer, channel)
+        self._pending.move_to_end(key)
+        while len(self._pending) > self.max_pending:
+            self._pending.popitem(last=False)
+
+    def pop(self, client_id: str, request_id: str) -> Optional[Tuple[str, str, str]]:
+        """(pregunta, respuesta hasta ahora, canal) de la respuesta cortada, o None."""
+        return self._pending.pop((client_id, request_id), None)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+def channel_from_name(name: Optional[str], default: str = TEXT_CHANNEL) -> str:
+    return name if name in CHANNELS else default
+
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Profiler por muestreo de bajo coste para perfilar una petición concreta.
+Un hilo toma cada pocos milisegundos la pila de los demás hilos y, al terminar,
+el resultado se guarda en formato speedscope (https://www.speedscope.app), que
+se puede abrir como flamegraph.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+PROFILE_DIR = os.environ.get("BOB_PROFILE_DIR", os.path.join(os.getcwd(), "profiles"))
+PROFILE_INTERVAL = float(os.environ.get("BOB_PROFILE_INTERVAL", 0.005))
+# Número de perfiles que se conservan; los más antiguos se borran
+PROFILE_KEEP = int(os.environ.get("BOB_PROFILE_KEEP", 50))
+
+PROFILE_SUFFIX = ".speedscope.json"
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+Frame = Tuple[str, str, int]
+
+
+def profile_filename(request_id: str) -> str:
+    # Solo caracteres seguros para un nombre de archivo
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", request_id)[:128] + PROFILE_SUFFIX
+
+
+class SamplingProfiler:
+    """Uso: `with SamplingProfiler("id") as profiler: ...` y después `profiler.save()`."""
+
+    def __init__(self, name: str, interval: float = PROFILE_INTERVAL):
+        self.name = name
+        self.interval = interval
+        self._frames: List[Frame] = []
+        self._frame_index: Dict[Frame, int] = {}
+        # Por hilo: lista de (pila de índices de frames, peso en segundos)
+        self._samples: Dict[int, List[Tuple[List[int], float]]] = {}
+        self._thread_names: Dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at = 0.0
+        self.duration = 0.0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def _run(self):
+        own_id = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = now - last, now
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self._thread_names[thread_id] = names.get(thread_id, str(thread_id))
+                self._samples.setdefault(thread_id, []).append((self._stack(frame), weight))
+
+    def _stack(self, frame) -> List[int]:
+        # speedscope espera la pila de la raíz a la hoja
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, frame.f_lineno)
+            index = self._frame_index.get(key)
+            if index is None:
+                index = self._frame_index[key] = len(self._frames)
+                self._frames.append(key)
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def to_speedscope(self) -> Dict:
+        profiles = []
+        for thread_id, samples in self._samples.items():
+            profiles.append({
+                "type": "sampled",
+                "name": f"{self.name} [{self._thread_names[thread_id]}]",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weight for _, weight in samples),
+                "samples": [stack for stack, _ in samples],
+                "weights": [weight for _, weight in samples],
+            })
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": self.name,
+            "exporter": "bob_the_builder profiler",
+            "shared": {"frames": [{"name": name, "file": file, "line": line} for name, file, line in self._frames]},
+            "profiles": profiles,
+        }
+
+    def save(self, directory: str = PROFILE_DIR) -> str:
+        """Guarda el perfil como <id>.speedscope.json y devuelve la ruta."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, profile_filename(self.name))
+        with open(path, "w") as f:
+            json.dump(self.to_speedscope(), f)
+        prune_profiles(directory)
+        return path
+
+
+def list_profiles(directory: str = PROFILE_DIR, limit: int = PROFILE_KEEP) -> List[Dict]:
+    """Los perfiles más recientes primero."""
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(PROFILE_SUFFIX):
+            stat = entry.stat()
+            profiles.append({"name": entry.name, "size": stat.st_size, "created_at": stat.st_mtime})
+    profiles.sort(key=lambda p: p["created_at"], reverse=True)
+    return profiles[:limit]
+
+
+def prune_profiles(directory: str = PROFILE_DIR, keep: int = PROFILE_KEEP):
+    for profile in list_profiles(directory, limit=sys.maxsize)[keep:]:
+        try:
+            os.remove(os.path.join(directory, profile["name"]))
+        except OSError:
+            pass
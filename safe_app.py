@@ -1,21 +1,30 @@
 import streamlit as st
-import tempfile
 import os
-import requests
 import json
 import subprocess
 import sys
 import time
 import hashlib
-import torch
-from gtts import gTTS
-from gtts.lang import tts_langs
 import base64
 
 # Import the audio recorder component
 from audio_recorder_streamlit import audio_recorder
 
-torch.classes.__path__ = [] # add this line to manually set it to empty. 
+import audio_io
+import conversation_view
+import hedging
+import streamlit_perf
+from whisper_pool import AUTO, MODEL_SIZES, WHISPER_LATENCY_TARGET, WhisperPool
+from workload_capture import capture_for
+
+# Spoken answers kept in memory per session
+TTS_CACHE_SIZE = int(os.environ.get("BOB_TTS_CACHE_SIZE", 32))
+
+# Optional capture of every turn to replay the real workload (BOB_CAPTURE=1)
+capture = capture_for("safe_app")
+
+# Start of this rerun, for the timing panel
+rerun_started = time.perf_counter()
 
 # Set page configuration
 st.set_page_config(
@@ -46,8 +55,6 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize session state
-if 'conversation' not in st.session_state:
-    st.session_state.conversation = []
 if 'whisper_model' not in st.session_state:
     st.session_state.whisper_model = None
 if 'tts_cache' not in st.session_state:
@@ -57,69 +64,40 @@ if 'tts_enabled' not in st.session_state:
 if 'tts_last_request' not in st.session_state:
     st.session_state.tts_last_request = 0
 
-# Create the agent_runner.py file if it doesn't exist
+# Check that agent_runner.py exists (once per process, not on every rerun). No default
+# runner is generated: responses are parsed from the repository runner's structured JSON
+@st.cache_resource(show_spinner=False)
 def ensure_agent_runner_exists():
     agent_runner_path = os.path.join(os.getcwd(), "agent_runner.py")
     if not os.path.exists(agent_runner_path):
-        with open(agent_runner_path, "w") as f:
-            f.write("""#!/usr/bin/env python3
-\"\"\"
-Script auxiliar para ejecutar los agentes sin interferencia con Streamlit.
-Este script se ejecuta como un proceso separado.
-\"\"\"
-
-import sys
-import json
-
-def run_agent(input_text):
-    \"\"\"Ejecuta el equipo de agentes con el texto proporcionado y devuelve la respuesta.\"\"\"
-    try:
-        from agents import bob_team
-        
-        # Capturar la salida del equipo de agentes
-        import io
-        from contextlib import redirect_stdout
-        
-        f = io.StringIO()
-        with redirect_stdout(f):
-            bob_team.print_response(input_text, stream=False)
-        
-        response = f.getvalue()
-        
-        # Devolver un resultado exitoso
-        return {
-            "status": "success",
-            "response": response
-        }
-    except Exception as e:
-        # Devolver error si algo salió mal
-        return {
-            "status": "error",
-            "error": str(e)
-        }
-
-if __name__ == "__main__":
-    # Si no hay argumentos, mostrar ayuda
-    if len(sys.argv) < 2:
-        print("Uso: python agent_runner.py 'texto de entrada'")
-        sys.exit(1)
-    
-    # El primer argumento es el texto a procesar
-    input_text = sys.argv[1]
-    
-    # Ejecutar el agente y obtener la respuesta
-    result = run_agent(input_text)
-    
-    # Imprimir el resultado como JSON para que el llamador pueda analizarlo
-    print(json.dumps(result))
-""")
-        # Hacerlo ejecutable
-        os.chmod(agent_runner_path, 0o755)
+        raise FileNotFoundError(
+            f"agent_runner.py not found in {os.getcwd()}; start the app from the repository directory"
+        )
     return agent_runner_path
 
 # Asegurarse de que el runner existe al inicio
 agent_runner_path = ensure_agent_runner_exists()
 
+# Cached heavy resources: torch/whisper and gTTS are only imported when used
+@st.cache_resource(show_spinner=False)
+def get_whisper_pool():
+    # Resident Whisper models, shared by every session
+    return WhisperPool()
+
+@st.cache_data(show_spinner=False)
+def get_tts_langs():
+    from gtts.lang import tts_langs
+    return tts_langs()
+
+# Shared across sessions: keep-alive HTTP pool for Ollama and the agent-path circuit breaker
+@st.cache_resource(show_spinner=False)
+def get_ollama_client():
+    return hedging.OllamaClient()
+
+@st.cache_resource(show_spinner=False)
+def get_hedged_caller():
+    return hedging.HedgedCaller(hedging.CircuitBreaker())
+
 # Title
 st.title("🎤 Simple Speech Assistant")
 
@@ -132,7 +110,7 @@ with st.sidebar:
     st.session_state.tts_enabled = st.checkbox("Enable Text-to-Speech", value=st.session_state.tts_enabled)
     
     # Language selection for TTS
-    available_langs = tts_langs()
+    available_langs = get_tts_langs()
     tts_lang = st.selectbox(
         "TTS Language",
         options=list(available_langs.keys()),
@@ -146,16 +124,24 @@ with st.sidebar:
     st.subheader("Speech Recognition")
     whisper_model = st.selectbox(
         "Whisper Model",
-        ["tiny", "base", "small", "medium"],
-        index=1  # Default to "base"
+        [AUTO] + MODEL_SIZES,
+        index=2  # Default to "base"
     )
+    # In auto mode the size is picked per clip from its duration
+    if whisper_model == AUTO:
+        st.selectbox("Largest model", MODEL_SIZES, index=2, key="whisper_max_size")
+        st.number_input("Latency target (seconds)", min_value=0.5, value=WHISPER_LATENCY_TARGET,
+                        step=0.5, key="whisper_latency_target")
+        st.checkbox("Re-transcribe low-confidence clips with a larger model", key="whisper_retry")
+    st.checkbox("Trim silence and normalize volume", value=True, key="whisper_clean")
+    st.checkbox("Split long clips at pauses (batched decoding)", key="whisper_split")
     
     # Load Whisper button
     if st.button("Load Whisper Model"):
         with st.spinner("Loading Whisper model..."):
             try:
-                import whisper
-                st.session_state.whisper_model = whisper.load_model(whisper_model)
+                get_whisper_pool().get(MODEL_SIZES[0] if whisper_model == AUTO else whisper_model)
+                st.session_state.whisper_model = whisper_model
                 st.success("Whisper model loaded!")
             except Exception as e:
                 st.error(f"Error loading model: {e}")
@@ -187,18 +173,59 @@ with st.sidebar:
     ollama_model = st.text_input("Ollama Model (Fallback)", value="llama3.2:3b")
     ollama_url = st.text_input("Ollama API URL (Fallback)", value="http://localhost:11434/api/generate")
     
+    # Hedging: start the fallback once the agent exceeds this latency and keep the first answer
+    hedging_enabled = st.checkbox("Hedge slow agent calls", value=True)
+    hedge_after = st.number_input("Hedge after (seconds)", min_value=0.5, value=20.0, step=0.5,
+                                  disabled=not hedging_enabled)
+    breaker = get_hedged_caller().breaker
+    if breaker.state != hedging.CLOSED:
+        st.warning(f"Agent circuit breaker is {breaker.state.replace('_', '-')}: using direct Ollama calls")
+    
     st.divider()
     
     st.info("Audio is captured via the browser using audio-recorder-streamlit.")
+    
+    st.divider()
+    
+    # Rerun wall time of this session
+    streamlit_perf.render_timing_panel()
 
 # Function to transcribe audio using Whisper
-def transcribe_audio(audio_file):
+def transcribe_audio(audio_bytes):
     if st.session_state.whisper_model is None:
         st.error("Please load the Whisper model first")
         return None
+    # A voice turn arrives with the recording, not with the agent call
+    arrival = capture.start()
     try:
-        result = st.session_state.whisper_model.transcribe(audio_file)
-        return result["text"].strip()
+        # Decode in memory straight to a NumPy array, without touching the disk
+        audio = audio_io.decode_audio(audio_bytes)
+        if st.session_state.whisper_model == AUTO:
+            result = get_whisper_pool().transcribe(
+                audio,
+                AUTO,
+                st.session_state.get("whisper_latency_target", WHISPER_LATENCY_TARGET),
+                st.session_state.get("whisper_max_size", MODEL_SIZES[2]),
+                st.session_state.get("whisper_retry", False),
+                clean=st.session_state.get("whisper_clean", True),
+                split=st.session_state.get("whisper_split", False),
+            )
+        else:
+            result = get_whisper_pool().transcribe(audio, st.session_state.whisper_model,
+                                                   clean=st.session_state.get("whisper_clean", True),
+                                                   split=st.session_state.get("whisper_split", False))
+        retried = f", retried after {result['retried_from']}" if result["retried_from"] else ""
+        st.caption(f"Whisper {result['size']}: {result['duration']:.1f}s of speech "
+                   f"(from {result['original_duration']:.1f}s) in {result['latency']:.1f}s{retried}")
+        if not result["text"]:
+            st.warning("No speech detected in the recording")
+        else:
+            st.session_state.captured_audio = (arrival, {
+                "audio_seconds": round(result["original_duration"], 2),
+                "audio_bytes": len(audio_bytes),
+                "transcribe_ms": round(1000 * result["latency"], 1),
+            })
+        return result["text"]
     except Exception as e:
         st.error(f"Transcription error: {e}")
         return None
@@ -206,55 +233,39 @@ def transcribe_audio(audio_file):
 # Function to get response from Ollama (fallback)
 def get_ollama_response(text, model, api_url):
     try:
-        response = requests.post(
-            api_url,
-            headers={"Content-Type": "application/json"},
-            data=json.dumps({
-                "model": model,
-                "prompt": text,
-                "stream": False
-            })
-        )
-        if response.status_code == 200:
-            return response.json()["response"]
-        else:
-            st.error(f"Ollama error: {response.status_code} - {response.text}")
-            return None
+        return get_ollama_client().generate(text, model, api_url)
     except Exception as e:
         st.error(f"API error: {e}")
         return None
 
-# Function to get response from the agent team via the separate runner script
+# Function to get response from the agent team via the separate runner script,
+# hedged with a direct Ollama call when the agent is slow or failing
 def get_agent_response(text):
-    try:
-        # Escape single quotes in the input text
-        escaped_text = text.replace("'", "\\'")
-        
-        # Run the agent_runner.py script as a separate process
-        result = subprocess.run(
-            [sys.executable, agent_runner_path, escaped_text],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        
-        # Parse the JSON output
-        try:
-            response_json = json.loads(result.stdout)
-            if response_json["status"] == "success":
-                return response_json["response"]
-            else:
-                st.warning(f"Agent error: {response_json.get('error', 'Unknown error')}")
-                st.info("Falling back to direct Ollama call")
-                return get_ollama_response(text, ollama_model, ollama_url)
-        except json.JSONDecodeError:
-            st.warning("Could not parse agent response. Falling back to direct Ollama call.")
-            return get_ollama_response(text, ollama_model, ollama_url)
-            
-    except Exception as e:
-        st.error(f"Agent execution error: {e}")
-        st.info("Falling back to direct Ollama call")
-        return get_ollama_response(text, ollama_model, ollama_url)
+    # A transcription left in the session means this is a voice turn
+    arrival, audio = st.session_state.pop("captured_audio", (None, {}))
+    kind = "voice" if arrival else "text"
+    arrival = arrival or capture.start()
+    # "--" so that a prompt starting with "-" is not parsed as an option
+    primary = hedging.AgentProcess([sys.executable, agent_runner_path, "--", text])
+    fallback = hedging.OllamaGeneration(get_ollama_client(), text, ollama_model, ollama_url)
+    response, source, notes = get_hedged_caller().call(primary, fallback, hedge_after if hedging_enabled else None)
+    
+    for note in notes:
+        st.info(note)
+    if response is None:
+        st.error("Neither the agents nor the direct Ollama call produced a response")
+    elif source == hedging.FALLBACK:
+        st.caption("Answered by the direct Ollama fallback")
+    transcribe_ms = audio.pop("transcribe_ms", None)
+    capture.record(arrival, text, response, stages={"transcribe_ms": transcribe_ms} if transcribe_ms else None,
+                   kind=kind, answered_by=source, **audio)
+    return response
+
+# Keep synthesized audio in the session cache, evicting the oldest entry when full
+def cache_speech(text_hash, speech_audio):
+    st.session_state.tts_cache[text_hash] = speech_audio
+    while len(st.session_state.tts_cache) > TTS_CACHE_SIZE:
+        st.session_state.tts_cache.pop(next(iter(st.session_state.tts_cache)))
 
 # Function to convert text to speech with caching and rate limiting
 def text_to_speech(text, lang="es"):
@@ -278,30 +289,26 @@ def text_to_speech(text, lang="es"):
         # Update last request time
         st.session_state.tts_last_request = time.time()
         
-        # Generate the audio file
-        audio_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-        tts = gTTS(text=text, lang=lang, slow=False)
-        tts.save(audio_file.name)
+        # Generate the MP3 in memory
+        speech_audio = audio_io.synthesize_speech(text, lang)
         
         # Store in cache
-        st.session_state.tts_cache[text_hash] = audio_file.name
+        cache_speech(text_hash, speech_audio)
         
-        return audio_file.name
+        return speech_audio
     except Exception as e:
         # If we encounter a rate limit, wait and try again once
         if "429" in str(e):
             st.warning("Rate limit encountered, waiting 5 seconds before retrying...")
             time.sleep(5)
             try:
-                audio_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-                tts = gTTS(text=text, lang=lang, slow=False)
-                tts.save(audio_file.name)
+                speech_audio = audio_io.synthesize_speech(text, lang)
                 
                 # Store in cache
                 text_hash = hashlib.md5((text + lang).encode()).hexdigest()
-                st.session_state.tts_cache[text_hash] = audio_file.name
+                cache_speech(text_hash, speech_audio)
                 
-                return audio_file.name
+                return speech_audio
             except Exception as retry_e:
                 st.error(f"Text-to-speech retry error: {retry_e}")
                 # Fall back to a note about TTS being unavailable
@@ -310,140 +317,107 @@ def text_to_speech(text, lang="es"):
             st.error(f"Text-to-speech error: {e}")
             return None
 
-# Fallback function to generate silent audio
-def create_silent_audio():
-    # Generate a short silent MP3 file
-    silent_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-    silent_file_path = silent_file.name
-    silent_file.close()
+# Main area as a fragment: typing a message, recording audio or clearing the
+# conversation only reruns this part, not the sidebar
+@st.fragment
+def conversation_area(tts_lang):
+    area_started = time.perf_counter()
     
-    # Use subprocess to create a silent MP3
-    try:
-        import subprocess
-        # Try using ffmpeg if available
-        subprocess.run([
-            "ffmpeg", "-f", "lavfi", "-i", "anullsrc=r=24000:cl=mono", 
-            "-t", "0.1", "-q:a", "9", "-acodec", "libmp3lame", silent_file_path
-        ], check=True, capture_output=True)
-        return silent_file_path
-    except:
-        # If ffmpeg fails, return None
-        return None
+    # Layout: two columns – one for voice input and one for conversation transcript
+    col1, col2 = st.columns([1, 1])
 
-# Layout: two columns – one for voice input and one for conversation transcript
-col1, col2 = st.columns([1, 1])
-
-with col1:
-    st.header("Voice Input")
+    with col1:
+        st.header("Voice Input")
     
-    # Warn user if Whisper model is not loaded
-    if st.session_state.whisper_model is None:
-        st.warning("Please load the Whisper model from the sidebar first")
+        # Warn user if Whisper model is not loaded
+        if st.session_state.whisper_model is None:
+            st.warning("Please load the Whisper model from the sidebar first")
     
-    st.markdown("**Record your message:**")
-    audio_bytes = audio_recorder()
+        st.markdown("**Record your message:**")
+        audio_bytes = audio_recorder()
     
-    if audio_bytes is not None:
-        st.audio(audio_bytes, format="audio/wav")
-        if st.button("Process Recorded Audio"):
-            # Save the recorded audio bytes to a temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_audio_file:
-                temp_audio_file.write(audio_bytes)
-                temp_filename = temp_audio_file.name
-            
-            with st.spinner("Transcribing..."):
-                transcription = transcribe_audio(temp_filename)
+        if audio_bytes is not None:
+            st.audio(audio_bytes, format="audio/wav")
+            if st.button("Process Recorded Audio"):
+                with st.spinner("Transcribing..."):
+                    transcription = transcribe_audio(audio_bytes)
             
-            if transcription:
-                st.success("Transcription complete!")
+                if transcription:
+                    st.success("Transcription complete!")
                 
-                with st.spinner("Getting response from Agents..."):
-                    response = get_agent_response(transcription)
+                    with st.spinner("Getting response from Agents..."):
+                        response = get_agent_response(transcription)
                 
-                if response:
-                    st.session_state.conversation.append({
-                        "user": transcription,
-                        "assistant": response
-                    })
+                    if response:
+                        conversation_view.add_turn(transcription, response)
                     
-                    if st.session_state.tts_enabled:
-                        with st.spinner("Generating speech..."):
-                            speech_file = text_to_speech(response, lang=tts_lang)
-                            if speech_file:
-                                st.audio(speech_file)
-                            else:
-                                st.warning("Text-to-speech unavailable. Continuing without audio.")
+                        if st.session_state.tts_enabled:
+                            with st.spinner("Generating speech..."):
+                                speech_audio = text_to_speech(response, lang=tts_lang)
+                                if speech_audio:
+                                    st.audio(speech_audio, format="audio/mpeg")
+                                else:
+                                    st.warning("Text-to-speech unavailable. Continuing without audio.")
     
-    # File upload option
-    st.subheader("Or upload audio")
-    uploaded_file = st.file_uploader("Upload audio file", type=["wav", "mp3"])
+        # File upload option
+        st.subheader("Or upload audio")
+        uploaded_file = st.file_uploader("Upload audio file", type=["wav", "mp3"])
     
-    if uploaded_file and st.button("Process Uploaded File"):
-        if st.session_state.whisper_model is None:
-            st.error("Please load the Whisper model first")
-        else:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as temp_file:
-                temp_file.write(uploaded_file.getvalue())
-                temp_file_name = temp_file.name
-            
-            with st.spinner("Transcribing..."):
-                transcription = transcribe_audio(temp_file_name)
+        if uploaded_file and st.button("Process Uploaded File"):
+            if st.session_state.whisper_model is None:
+                st.error("Please load the Whisper model first")
+            else:
+                with st.spinner("Transcribing..."):
+                    transcription = transcribe_audio(uploaded_file.getvalue())
             
-            if transcription:
-                st.success("Transcription complete!")
+                if transcription:
+                    st.success("Transcription complete!")
                 
-                with st.spinner("Getting response from Agents..."):
-                    response = get_agent_response(transcription)
+                    with st.spinner("Getting response from Agents..."):
+                        response = get_agent_response(transcription)
                 
-                if response:
-                    st.session_state.conversation.append({
-                        "user": transcription,
-                        "assistant": response
-                    })
+                    if response:
+                        conversation_view.add_turn(transcription, response)
                     
-                    if st.session_state.tts_enabled:
-                        with st.spinner("Generating speech..."):
-                            speech_file = text_to_speech(response, lang=tts_lang)
-                            if speech_file:
-                                st.audio(speech_file)
-                            else:
-                                st.warning("Text-to-speech unavailable. Continuing without audio.")
+                        if st.session_state.tts_enabled:
+                            with st.spinner("Generating speech..."):
+                                speech_audio = text_to_speech(response, lang=tts_lang)
+                                if speech_audio:
+                                    st.audio(speech_audio, format="audio/mpeg")
+                                else:
+                                    st.warning("Text-to-speech unavailable. Continuing without audio.")
     
-    # Fallback text input
-    st.subheader("Or type your message")
-    text_input = st.text_input("Type and press Enter")
+        # Fallback text input
+        st.subheader("Or type your message")
+        text_input = st.text_input("Type and press Enter")
     
-    if text_input:
-        with st.spinner("Getting response from Agents..."):
-            response = get_agent_response(text_input)
+        if text_input:
+            with st.spinner("Getting response from Agents..."):
+                response = get_agent_response(text_input)
         
-        if response:
-            st.session_state.conversation.append({
-                "user": text_input,
-                "assistant": response
-            })
+            if response:
+                conversation_view.add_turn(text_input, response)
             
-            if st.session_state.tts_enabled:
-                with st.spinner("Generating speech..."):
-                    speech_file = text_to_speech(response, lang=tts_lang)
-                    if speech_file:
-                        st.audio(speech_file)
-                    else:
-                        st.warning("Text-to-speech unavailable. Continuing without audio.")
+                if st.session_state.tts_enabled:
+                    with st.spinner("Generating speech..."):
+                        speech_audio = text_to_speech(response, lang=tts_lang)
+                        if speech_audio:
+                            st.audio(speech_audio, format="audio/mpeg")
+                        else:
+                            st.warning("Text-to-speech unavailable. Continuing without audio.")
 
-with col2:
-    st.header("Conversation Transcript")
+    with col2:
+        st.header("Conversation Transcript")
+    
+        # Only the latest turns are rendered; older ones load on demand
+        has_turns = conversation_view.render_transcript()
+        conversation_view.render_search()
     
-    if not st.session_state.conversation:
-        st.info("Your conversation will appear here")
-    else:
-        for i, exchange in enumerate(st.session_state.conversation):
-            st.markdown(f"**You:** {exchange['user']}")
-            st.markdown(f'<div class="response-box"><strong>Assistant:</strong> {exchange["assistant"]}</div>',
-                        unsafe_allow_html=True)
-            if i < len(st.session_state.conversation) - 1:
-                st.divider()
+        if has_turns and st.button("Clear Conversation"):
+            conversation_view.new_session()
+            st.rerun(scope="fragment")
     
-    if st.session_state.conversation and st.button("Clear Conversation"):
-        st.session_state.conversation = []
-        st.rerun()  # For older versions, use st.experimental_rerun()
\ No newline at end of file
+    streamlit_perf.record(streamlit_perf.MAIN_AREA, area_started)
+
+conversation_area(tts_lang)
+streamlit_perf.record(streamlit_perf.FULL_RERUN, rerun_started)
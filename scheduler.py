@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Planificador con clases de prioridad y reparto justo para la ejecución de agentes.
+Los turnos de voz tienen prioridad sobre los de texto y estos sobre el trabajo en
+segundo plano. Dentro de cada clase se aplica un encolado justo ponderado (WFQ)
+entre clientes, limitado por un token bucket por cliente.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Clases de prioridad (menor valor = mayor prioridad)
+VOICE = 0
+TEXT = 1
+BACKGROUND = 2
+CLASS_NAMES = {VOICE: "voice", TEXT: "text", BACKGROUND: "background"}
+
+# Configuración (se puede sobreescribir con variables de entorno)
+SCHED_CONCURRENCY = int(os.environ.get("BOB_SCHED_CONCURRENCY", 2))
+SCHED_RATE = float(os.environ.get("BOB_SCHED_RATE", 1.0))
+SCHED_BURST = float(os.environ.get("BOB_SCHED_BURST", 5.0))
+# Pesos por cliente con el formato "cliente:peso,cliente:peso"
+SCHED_CLIENT_WEIGHTS = os.environ.get("BOB_SCHED_CLIENT_WEIGHTS", "")
+# Direcciones que pueden nombrar a sus clientes con "client_id" (p. ej. el servidor de
+# Streamlit, que conecta a todos sus usuarios desde la misma dirección)
+SCHED_TRUSTED_HOSTS = os.environ.get("BOB_SCHED_TRUSTED_HOSTS", "127.0.0.1,::1,localhost")
+# Con varios workers, cada cuánto se sincronizan los token buckets con el estado compartido
+SCHED_SYNC_INTERVAL = float(os.environ.get("BOB_SCHED_SYNC_INTERVAL", 0.25))
+
+# Número de muestras de latencia que se guardan por clase
+LATENCY_WINDOW = 1000
+# Número de clientes a partir del cual se purgan los inactivos
+PRUNE_THRESHOLD = 1024
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        if ":" in item:
+            client_id, weight = item.rsplit(":", 1)
+            weights[client_id.strip()] = float(weight)
+    return weights
+
+
+def check_weights(weights: Dict[str, float]):
+    # El peso divide el coste de cada petición: con 0 o negativo el reparto no tiene sentido
+    for client_id, weight in weights.items():
+        if not weight > 0:
+            raise ValueError(f"Scheduler weight for {client_id!r} must be greater than 0, got {weight}")
+
+
+def client_identity(host: Optional[str], client_id: Optional[str] = None,
+                    trusted_hosts: Optional[List[str]] = None) -> str:
+    """Clave del cliente para el reparto justo.
+
+    Es la dirección de la conexión (sin el puerto, que cambia al reconectar). Solo las
+    direcciones de confianza pueden elegir un "client_id", que se guarda bajo su dirección;
+    los demás no pueden conseguir un token bucket nuevo cambiando de identificador.
+    """
+    host = host or "unknown"
+    if trusted_hosts is None:
+        trusted_hosts = [h.strip() for h in SCHED_TRUSTED_HOSTS.split(",") if h.strip()]
+    if client_id and host in trusted_hosts:
+        return f"{host}/{client_id}"
+    return host
+
+
+class TokenBucket:
+    """Token bucket clásico: `rate` tokens por segundo con una ráfaga máxima de `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        """Segundos que faltan para disponer de un token (0 si ya hay uno)."""
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (1.0 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1.0
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket compartido entre workers a través del estado compartido.
+
+    El scheduler decide con la copia local, sin consultar SQLite en el event loop. Cada
+    `SCHED_SYNC_INTERVAL` segundos, FairScheduler envía en un hilo los tokens consumidos
+    (`taken`) y trae el nivel común. Entre dos sincronizaciones, los workers juntos pueden
+    gastar algo más que la ráfaga.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float):
+        super().__init__(rate, burst)
+        self.name = name
+        self.taken = 0
+
+    def take(self, now: float):
+        super().take(now)
+        self.taken += 1
+
+    def synced(self, tokens: float, now: float):
+        # Lo consumido mientras se sincronizaba todavía no está en el nivel común
+        self.tokens = min(self.burst, tokens - self.taken)
+        self.updated_at = now
+
+
+class _Request:
+    __slots__ = ("client_id", "priority", "finish_tag", "start_tag", "enqueued_at", "granted")
+
+    def __init__(self, client_id: str, priority: int, start_tag: float, finish_tag: float,
+                 granted: asyncio.Future):
+        self.client_id = client_id
+        self.priority = priority
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.enqueued_at = time.monotonic()
+        self.granted = granted
+
+
+class _PriorityClass:
+    """Cola WFQ de una clase de prioridad: una cola FIFO por cliente."""
+
+    def __init__(self):
+        self.queues: Dict[str, Deque[_Request]] = {}
+        self.last_finish: Dict[str, float] = {}
+        self.virtual_time = 0.0
+        self.waits: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.dispatched = 0
+
+    def __len__(self):
+        return sum(len(q) for q in self.queues.values())
+
+
+class FairScheduler:
+    """Limita la concurrencia de ejecución de agentes y decide el orden de servicio."""
+
+    def __init__(self, concurrency: int = SCHED_CONCURRENCY, rate: float = SCHED_RATE,
+                 burst: float = SCHED_BURST, client_weights: Optional[Dict[str, float]] = None,
+                 shared=None):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.client_weights = client_weights if client_weights is not None else parse_weights(SCHED_CLIENT_WEIGHTS)
+        check_weights(self.client_weights)
+        self._classes = {priority: _PriorityClass() for priority in CLASS_NAMES}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._running = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Con varios workers (SharedState), los token buckets se comparten entre todos
+        self.shared = shared
+        self._sync_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Arranca la sincronización periódica de los token buckets compartidos."""
+        if self.shared is not None:
+            self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+            # Los tokens gastados desde la última sincronización cuentan para los demás workers
+            await self._sync()
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(SCHED_SYNC_INTERVAL)
+            try:
+                await self._sync()
+            except Exception as e:
+                logger.error(f"Scheduler bucket sync error: {e}")
+
+    async def _sync(self):
+        buckets = [bucket for bucket in self._buckets.values() if isinstance(bucket, SharedTokenBucket)]
+        if not buckets:
+            return
+        taken = {}
+        for bucket in buckets:
+            taken[bucket.name] = bucket.taken
+            bucket.taken = 0
+        try:
+            levels = await asyncio.to_thread(self.shared.bucket_sync, taken, self.rate, self.burst)
+        except BaseException:
+            for bucket in buckets:
+                bucket.taken += taken[bucket.name]
+            raise
+        now = time.monotonic()
+        for bucket in buckets:
+            bucket.synced(levels[bucket.name], now)
+        # Otro worker puede haber gastado tokens, o el nivel común puede dejar pasar a alguien
+        self._dispatch()
+
+    async def run(self, client_id: str, priority: int, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Espera turno según la política de planificación y ejecuta `func`."""
+        request = self._enqueue(client_id, priority)
+        self._dispatch()
+        try:
+            await request.granted
+        except asyncio.CancelledError:
+            if request.granted.done() and not request.granted.cancelled():
+                self._release()
+            else:
+                self._remove(request)
+            raise
+        try:
+            return await func()
+        finally:
+            self._release()
+
+    def _enqueue(self, client_id: str, priority: int) -> _Request:
+        pclass = self._classes[priority]
+        # Los pesos se pueden dar por clave completa ("127.0.0.1/kiosko") o por client_id ("kiosko")
+        weight = self.client_weights.get(client_id, self.client_weights.get(client_id.rpartition("/")[2], 1.0))
+        start_tag = max(pclass.virtual_time, pclass.last_finish.get(client_id, 0.0))
+        finish_tag = start_tag + 1.0 / weight
+        pclass.last_finish[client_id] = finish_tag
+        request = _Request(client_id, priority, start_tag, finish_tag, asyncio.get_running_loop().create_future())
+        pclass.queues.setdefault(client_id, deque()).append(request)
+        return request
+
+    def _remove(self, request: _Request):
+        pclass = self._classes[request.priority]
+        queue = pclass.queues.get(request.client_id)
+        if queue is not None and request in queue:
+            queue.remove(request)
+            if not queue:
+                del pclass.queues[request.client_id]
+
+    def _release(self):
+        self._running -= 1
+        self._dispatch()
+
+    def _bucket(self, client_id: str) -> TokenBucket:
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            if self.shared is not None:
+                bucket = SharedTokenBucket(f"sched:{client_id}", self.rate, self.burst)
+            else:
+                bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[client_id] = bucket
+        return bucket
+
+    def _dispatch(self):
+        now = time.monotonic()
+        next_wakeup = None
+        while self._running < self.concurrency:
+            request, wait = self._next_eligible(now)
+            if request is None:
+                next_wakeup = wait
+                break
+            pclass = self._classes[request.priority]
+            queue = pclass.queues[request.client_id]
+            queue.popleft()
+            if not queue:
+                del pclass.queues[request.client_id]
+            if request.granted.done():
+                # La tarea que esperaba fue cancelada antes de recibir turno
+                continue
+            pclass.virtual_time = max(pclass.virtual_time, request.start_tag)
+            pclass.waits.append(now - request.enqueued_at)
+            pclass.dispatched += 1
+            self._bucket(request.client_id).take(now)
+            self._running += 1
+            request.granted.set_result(True)
+
+        if len(self._buckets) > PRUNE_THRESHOLD:
+            self._prune(now)
+
+        # Si hay peticiones bloqueadas por su token bucket, programar un reintento. Si ya hay
+        # uno para más tarde (p. ej. otro cliente con el bucket más vacío), se adelanta
+        if next_wakeup is not None and next_wakeup != float("inf"):
+            loop = asyncio.get_running_loop()
+            when = loop.time() + next_wakeup
+            if self._timer is None or when < self._timer.when():
+                if self._timer is not None:
+                    self._timer.cancel()
+                self._timer = loop.call_at(when, self._on_timer)
+
+    def _prune(self, now: float):
+        # Olvidar clientes inactivos: sin peticiones en cola y con el bucket lleno
+        waiting = set()
+        for pclass in self._classes.values():
+            waiting.update(pclass.queues)
+            for client_id, finish in list(pclass.last_finish.items()):
+                if client_id not in pclass.queues and finish <= pclass.virtual_time:
+                    del pclass.last_finish[client_id]
+        for client_id, bucket in list(self._buckets.items()):
+            bucket._refill(now)
+            if getattr(bucket, "taken", 0):
+                # Tokens gastados que aún no se han sincronizado
+                continue
+            if client_id not in waiting and bucket.tokens >= bucket.burst:
+                del self._buckets[client_id]
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _next_eligible(self, now: float):
+        """Devuelve la siguiente petición elegible, o (None, segundos hasta la próxima)."""
+        min_wait = None
+        for priority in sorted(self._classes):
+            best = None
+            for client_id, queue in self._classes[priority].queues.items():
+                wait = self._bucket(client_id).wait_time(now)
+                if wait > 0:
+                    min_wait = wait if min_wait is None else min(min_wait, wait)
+                    continue
+                head = queue[0]
+                if best is None or head.finish_tag < best.finish_tag:
+                    best = head
+            if best is not None:
+                return best, 0.0
+        return None, min_wait
+
+    def stats(self) -> Dict[str, Any]:
+        """Latencia de cola por clase, para poder ajustar los pesos."""
+        classes = {}
+        for priority, pclass in self._classes.items():
+            waits: List[float] = sorted(pclass.waits)
+            classes[CLASS_NAMES[priority]] = {
+                "queued": len(pclass),
+                "dispatched": pclass.dispatched,
+                "wait_mean_ms": round(1000 * sum(waits) / len(waits), 2) if waits else 0.0,
+                "wait_p50_ms": round(1000 * waits[len(waits) // 2], 2) if waits else 0.0,
+                "wait_p95_ms": round(1000 * waits[min(len(waits) - 1, int(len(waits) * 0.95))], 2) if waits else 0.0,
+                "wait_max_ms": round(1000 * waits[-1], 2) if waits else 0.0,
+            }
+        return {
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "rate": self.rate,
+            "burst": self.burst,
+            "client_weights": self.client_weights,
+            "classes": classes,
+        }
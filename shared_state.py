@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Estado compartido entre los workers del servidor en un SQLite local (modo WAL).
+
+Con `BOB_WORKERS` > 1, uvicorn arranca varios procesos y cada uno tiene su
+propia memoria. Lo que tiene que verse desde todos se guarda aquí: el registro
+de workers vivos (con heartbeat), el registro de conexiones WebSocket, los token
+buckets del scheduler y un bus de mensajes que cada worker sondea para recibir
+los broadcasts y las órdenes (p. ej. recargar agents.toml) de los demás.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Configuración (se puede sobreescribir con variables de entorno)
+SHARED_STATE_PATH = os.environ.get("BOB_SHARED_STATE_DB", os.path.join(os.getcwd(), "shared_state.db"))
+# Cada cuánto mira un worker si hay mensajes nuevos de los demás en el bus
+SHARED_POLL_INTERVAL = float(os.environ.get("BOB_SHARED_POLL_INTERVAL", 0.05))
+SHARED_HEARTBEAT_INTERVAL = float(os.environ.get("BOB_SHARED_HEARTBEAT_INTERVAL", 5))
+# Un worker sin heartbeat durante este tiempo se da por muerto y se borran sus conexiones
+SHARED_WORKER_TIMEOUT = float(os.environ.get("BOB_SHARED_WORKER_TIMEOUT", 15))
+# Los mensajes del bus se borran pasado este tiempo
+SHARED_MESSAGE_RETENTION = float(os.environ.get("BOB_SHARED_MESSAGE_RETENTION", 60))
+# Un token bucket sin uso durante este tiempo ya está lleno: se puede borrar
+SHARED_BUCKET_IDLE = 3600.0
+
+
+def worker_id() -> str:
+    """Identificador de este proceso, único entre los workers de la máquina."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SharedState:
+    def __init__(self, path: str = SHARED_STATE_PATH, worker: Optional[str] = None):
+        self.path = path
+        self.worker = worker or worker_id()
+        self._lock = threading.Lock()
+        # Sin transacciones implícitas: cada sentencia es atómica por sí sola
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS workers (
+                id TEXT PRIMARY KEY,
+                started_at REAL NOT NULL,
+                heartbeat_at REAL NOT NULL,
+                info TEXT NOT NULL DEFAULT '{}'
+            );
+            CREATE TABLE IF NOT EXISTS connections (
+                id TEXT PRIMARY KEY,
+                worker TEXT NOT NULL,
+                path TEXT NOT NULL,
+                protocol TEXT NOT NULL,
+                client TEXT,
+                connected_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_connections_worker ON connections (worker);
+            CREATE TABLE IF NOT EXISTS messages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                ts REAL NOT NULL,
+                payload TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+        # Solo interesan los mensajes publicados a partir de ahora
+        self._last_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM messages").fetchone()[0]
+        self._handlers: Dict[str, List[Callable[[Dict[str, Any]], Any]]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._info: Optional[Callable[[], Dict[str, Any]]] = None
+
+    # Workers
+
+    def heartbeat(self, info: Optional[Dict[str, Any]] = None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO workers (id, started_at, heartbeat_at, info) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at, info = excluded.info",
+                (self.worker, now, now, json.dumps(info or {})),
+            )
+
+    def workers(self) -> List[Dict[str, Any]]:
+        cutoff = time.time() - SHARED_WORKER_TIMEOUT
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM workers WHERE heartbeat_at >= ? ORDER BY started_at", (cutoff,)
+            ).fetchall()
+        return [{"worker": r["id"], "started_at": r["started_at"], "heartbeat_at": r["heartbeat_at"],
+                 **json.loads(r["info"])} for r in rows]
+
+    def reap(self) -> int:
+        """Olvida los workers muertos (con sus conexiones), los mensajes antiguos y los buckets inactivos.
+
+        Devuelve cuántos workers borró.
+        """
+        now = time.time()
+        with self._lock:
+            dead = [r[0] for r in self._conn.execute(
+                "SELECT id FROM workers WHERE heartbeat_at < ?", (now - SHARED_WORKER_TIMEOUT,)
+            )]
+            if dead:
+                placeholders = ",".join("?" * len(dead))
+                self._conn.execute(f"DELETE FROM connections WHERE worker IN ({placeholders})", dead)
+                self._conn.execute(f"DELETE FROM workers WHERE id IN ({placeholders})", dead)
+            self._conn.execute("DELETE FROM messages WHERE ts < ?", (now - SHARED_MESSAGE_RETENTION,))
+            self._conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - SHARED_BUCKET_IDLE,))
+        return len(dead)
+
+    def unregister(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM connections WHERE worker = ?", (self.worker,))
+            self._conn.execute("DELETE FROM workers WHERE id = ?", (self.worker,))
+
+    # Registro de conexiones
+
+    def add_connection(self, connection_id: str, path: str, protocol: str, client: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO connections (id, worker, path, protocol, client, connected_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (connection_id, self.worker, path, protocol, client, time.time()),
+            )
+
+    def remove_connection(self, connection_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM connections WHERE id = ?", (connection_id,))
+
+    def connection_counts(self) -> Dict[str, int]:
+        """Conexiones abiertas por worker."""
+        with self._lock:
+            rows = self._conn.execute("SELECT worker, COUNT(*) FROM connections GROUP BY worker").fetchall()
+        return {worker: count for worker, count in rows}
+
+    # Token buckets (los usa el scheduler para los límites por cliente)
+
+    def bucket_sync(self, taken: Dict[str, int], rate: float, burst: float) -> Dict[str, float]:
+        """Aplica los tokens consumidos por este worker y devuelve el nivel común de cada bucket.
+
+        `taken` tiene los tokens gastados en cada bucket desde la última sincronización (puede
+        ser 0, para leer solo el nivel). Todo va en una transacción.
+        """
+        now = time.time()
+        names = list(taken)
+        if not names:
+            return {}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Recarga y consumo en una sola sentencia: atómica aunque la ejecuten dos workers a la vez
+                self._conn.executemany(
+                    "INSERT INTO buckets (name, tokens, updated_at) VALUES (?, ? - ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET "
+                    "tokens = MIN(?, tokens + (excluded.updated_at - updated_at) * ?) - ?, "
+                    "updated_at = excluded.updated_at",
+                    [(name, burst, count, now, burst, rate, count) for name, count in taken.items() if count],
+                )
+                placeholders = ",".join("?" * len(names))
+                rows = self._conn.execute(
+                    f"SELECT name, tokens, updated_at FROM buckets WHERE name IN ({placeholders})", names
+                ).fetchall()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        levels = {name: burst for name in names}
+        for row in rows:
+            levels[row["name"]] = min(burst, row["tokens"] + (now - row["updated_at"]) * rate)
+        return levels
+
+    # Bus de mensajes entre workers
+
+    def publish(self, channel: str, payload: Dict[str, Any]):
+        """Publica un mensaje para los demás workers (el que lo publica no lo recibe)."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO messages (channel, origin, ts, payload) VALUES (?, ?, ?, ?)",
+                (channel, self.worker, time.time(), json.dumps(payload)),
+            )
+
+    def subscribe(self, channel: str, handler: Callable[[Dict[str, Any]], Any]):
+        """`handler` se llama en el event loop con cada mensaje del canal publicado por otro worker."""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def poll(self) -> List[Dict[str, Any]]:
+        """Mensajes de otros workers publicados desde la última llamada."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, channel, origin, payload FROM messages WHERE seq > ? ORDER BY seq", (self._last_seq,)
+            ).fetchall()
+            if rows:
+                self._last_seq = rows[-1]["seq"]
+        return [{"channel": r["channel"], "origin": r["origin"], "payload": json.loads(r["payload"])}
+                for r in rows if r["origin"] != self.worker]
+
+    async def start(self, info: Optional[Callable[[], Dict[str, Any]]] = None):
+        """Registra el worker y arranca el heartbeat y la lectura del bus."""
+        self._info = info
+        await asyncio.to_thread(self.heartbeat, info() if info else None)
+        self._tasks = [asyncio.create_task(self._heartbeat_loop()), asyncio.create_task(self._poll_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await asyncio.to_thread(self.unregister)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(SHARED_HEARTBEAT_INTERVAL)
+            try:
+                await asyncio.to_thread(self.heartbeat, self._info() if self._info else None)
+                reaped = await asyncio.to_thread(self.reap)
+                if reaped:
+                    logger.info(f"Estado compartido: {reaped} workers sin heartbeat eliminados")
+            except Exception as e:
+                logger.error(f"Shared state heartbeat error: {e}")
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(SHARED_POLL_INTERVAL)
+            try:
+                messages = await asyncio.to_thread(self.poll)
+            except Exception as e:
+                logger.error(f"Shared state poll error: {e}")
+                continue
+            for message in messages:
+                for handler in self._handlers.get(message["channel"], ()):
+                    try:
+                        result = handler(message["payload"])
+                        if asyncio.iscoroutine(result):
+                            await result
+                    except Exception as e:
+                        logger.error(f"Error handling shared message on {message['channel']}: {e}")
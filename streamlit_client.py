@@ -5,21 +5,27 @@ Proporciona una interfaz de usuario para interactuar con el asistente de voz.
 """
 
 import streamlit as st
-import tempfile
 import os
-import json
 import time
 import hashlib
-import torch
-import websocket
-import threading
-import queue
-from gtts import gTTS
-from gtts.lang import tts_langs
 from audio_recorder_streamlit import audio_recorder
 
-# Forzar una inicialización vacía para evitar problemas con torch
-torch.classes.__path__ = []
+import audio_io
+import conversation_view
+import streamlit_perf
+import wire_protocol
+from whisper_pool import AUTO, MODEL_SIZES, WHISPER_LATENCY_TARGET, WhisperPool
+from workload_capture import capture_for
+from ws_client import AgentSocket, SessionOwner, CLOSED, CONNECTED
+
+# Respuestas habladas que se guardan en memoria por sesión
+TTS_CACHE_SIZE = int(os.environ.get("BOB_TTS_CACHE_SIZE", 32))
+
+# Captura opcional de cada turno para reproducir la carga real (BOB_CAPTURE=1)
+capture = capture_for("streamlit")
+
+# Inicio del rerun, para el panel de tiempos
+rerun_started = time.perf_counter()
 
 # Configurar la página
 st.set_page_config(
@@ -50,8 +56,6 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Inicializar el estado de la sesión
-if 'conversation' not in st.session_state:
-    st.session_state.conversation = []
 if 'whisper_model' not in st.session_state:
     st.session_state.whisper_model = None
 if 'tts_cache' not in st.session_state:
@@ -60,12 +64,29 @@ if 'tts_enabled' not in st.session_state:
     st.session_state.tts_enabled = True
 if 'tts_last_request' not in st.session_state:
     st.session_state.tts_last_request = 0
-if 'ws_queue' not in st.session_state:
-    st.session_state.ws_queue = queue.Queue()
-if 'ws_connected' not in st.session_state:
-    st.session_state.ws_connected = False
 if 'ws_client' not in st.session_state:
     st.session_state.ws_client = None
+if 'voice_client' not in st.session_state:
+    st.session_state.voice_client = None
+# Solo lo guarda la sesión: cuando Streamlit la descarta, se cierran sus sockets
+if 'socket_owner' not in st.session_state:
+    st.session_state.socket_owner = SessionOwner()
+
+# Hay un cliente activo: aunque esté reconectando, las peticiones esperan a la nueva conexión
+def ws_available():
+    client = st.session_state.ws_client
+    return client is not None and client.state != CLOSED
+
+# Recursos pesados cacheados: torch/whisper y gTTS solo se importan cuando se usan
+@st.cache_resource(show_spinner=False)
+def get_whisper_pool():
+    # Modelos Whisper residentes, compartidos por todas las sesiones
+    return WhisperPool()
+
+@st.cache_data(show_spinner=False)
+def get_tts_langs():
+    from gtts.lang import tts_langs
+    return tts_langs()
 
 # Título
 st.title("🎤 Simple Speech Assistant (WebSocket Client)")
@@ -77,63 +98,36 @@ with st.sidebar:
     # WebSocket Settings
     st.subheader("WebSocket Connection")
     websocket_url = st.text_input("WebSocket URL", value="ws://localhost:8000/ws/agent")
+    # JSON es el protocolo por defecto; msgpack usa frames binarios más compactos
+    ws_protocol = st.selectbox("Wire Protocol", wire_protocol.available_protocols())
     
     if st.button("Connect to WebSocket"):
-        try:
-            # Función para manejar mensajes WebSocket en un hilo separado
-            def on_message(ws, message):
-                st.session_state.ws_queue.put(json.loads(message))
-            
-            def on_error(ws, error):
-                st.session_state.ws_queue.put({"status": "error", "error": str(error)})
-            
-            def on_close(ws, close_status_code, close_msg):
-                st.session_state.ws_connected = False
-                st.session_state.ws_queue.put({"status": "disconnected"})
-            
-            def on_open(ws):
-                st.session_state.ws_connected = True
-                st.session_state.ws_queue.put({"status": "connected"})
-            
-            # Crear cliente WebSocket
-            ws = websocket.WebSocketApp(
-                websocket_url,
-                on_message=on_message,
-                on_error=on_error,
-                on_close=on_close,
-                on_open=on_open
-            )
-            
-            # Ejecutar WebSocket en un hilo separado
-            def run_websocket():
-                ws.run_forever()
-            
-            ws_thread = threading.Thread(target=run_websocket, daemon=True)
-            ws_thread.start()
-            
-            st.session_state.ws_client = ws
-            
-            with st.spinner("Connecting to WebSocket..."):
-                # Esperar a que se conecte o falle
-                for _ in range(30):  # 3 segundos máximo
-                    if not st.session_state.ws_queue.empty():
-                        msg = st.session_state.ws_queue.get()
-                        if msg.get("status") == "connected":
-                            st.success("Connected to WebSocket server!")
-                            break
-                        elif msg.get("status") == "error":
-                            st.error(f"Connection error: {msg.get('error')}")
-                            break
-                    time.sleep(0.1)
-                else:
-                    st.warning("Connection timeout. Check if the server is running.")
+        # La conexión vive en la sesión y sobrevive a los reruns; reconectar con otra
+        # URL o protocolo sustituye al cliente anterior
+        if st.session_state.ws_client is not None:
+            st.session_state.ws_client.close()
+        if st.session_state.voice_client is not None:
+            st.session_state.voice_client.close()
+        st.session_state.ws_client = AgentSocket(websocket_url, ws_protocol, owner=st.session_state.socket_owner)
+        # Los turnos de voz van por /ws/voice en el mismo servidor
+        st.session_state.voice_client = AgentSocket(websocket_url.replace("/ws/agent", "/ws/voice"), ws_protocol,
+                                                    st.session_state.ws_client.client_id,
+                                                    owner=st.session_state.socket_owner)
         
-        except Exception as e:
-            st.error(f"Error connecting to WebSocket: {e}")
+        with st.spinner("Connecting to WebSocket..."):
+            if st.session_state.ws_client.wait_connected(timeout=3):
+                st.success("Connected to WebSocket server!")
+            else:
+                error = st.session_state.ws_client.last_error
+                st.warning(f"Connection timeout ({error}). Retrying in the background." if error
+                           else "Connection timeout. Retrying in the background.")
     
     # Estado de conexión
-    if st.session_state.ws_connected:
+    client = st.session_state.ws_client
+    if client is not None and client.state == CONNECTED:
         st.success("WebSocket Connected")
+    elif ws_available():
+        st.info(f"WebSocket reconnecting... ({client.last_error or 'waiting for server'})")
     else:
         st.warning("WebSocket Disconnected")
     
@@ -144,7 +138,7 @@ with st.sidebar:
     st.session_state.tts_enabled = st.checkbox("Enable Text-to-Speech", value=st.session_state.tts_enabled)
     
     # Selección de idioma para TTS
-    available_langs = tts_langs()
+    available_langs = get_tts_langs()
     tts_lang = st.selectbox(
         "TTS Language",
         options=list(available_langs.keys()),
@@ -156,34 +150,83 @@ with st.sidebar:
     
     # Selección de modelo Whisper
     st.subheader("Speech Recognition")
+    # Con el pipeline del servidor, transcripción, agente y voz se hacen en /ws/voice
+    st.checkbox("Server-side voice pipeline (/ws/voice)", value=True, key="voice_pipeline")
     whisper_model = st.selectbox(
         "Whisper Model",
-        ["tiny", "base", "small", "medium"],
-        index=1  # Default a "base"
+        [AUTO] + MODEL_SIZES,
+        index=2  # Default a "base"
     )
+    # En modo automático el tamaño se elige para cada clip según su duración
+    if whisper_model == AUTO:
+        st.selectbox("Largest model", MODEL_SIZES, index=2, key="whisper_max_size")
+        st.number_input("Latency target (seconds)", min_value=0.5, value=WHISPER_LATENCY_TARGET,
+                        step=0.5, key="whisper_latency_target")
+        st.checkbox("Re-transcribe low-confidence clips with a larger model", key="whisper_retry")
+    st.checkbox("Trim silence and normalize volume", value=True, key="whisper_clean")
+    st.checkbox("Split long clips at pauses (batched decoding)", key="whisper_split")
     
     # Botón para cargar Whisper
     if st.button("Load Whisper Model"):
         with st.spinner("Loading Whisper model..."):
             try:
-                import whisper
-                st.session_state.whisper_model = whisper.load_model(whisper_model)
+                get_whisper_pool().get(MODEL_SIZES[0] if whisper_model == AUTO else whisper_model)
+                st.session_state.whisper_model = whisper_model
                 st.success("Whisper model loaded!")
             except Exception as e:
                 st.error(f"Error loading model: {e}")
+    
+    st.divider()
+    
+    # Tiempo de cada rerun de esta sesión
+    streamlit_perf.render_timing_panel()
 
 # Función para transcribir audio usando Whisper
-def transcribe_audio(audio_file):
+def transcribe_audio(audio_bytes):
     if st.session_state.whisper_model is None:
         st.error("Please load the Whisper model first")
         return None
+    # El turno de voz llega con la grabación, no con el mensaje al agente
+    arrival = capture.start()
     try:
-        result = st.session_state.whisper_model.transcribe(audio_file)
-        return result["text"].strip()
+        # Decodificar en memoria a un array de NumPy, sin pasar por el disco
+        audio = audio_io.decode_audio(audio_bytes)
+        if st.session_state.whisper_model == AUTO:
+            result = get_whisper_pool().transcribe(
+                audio,
+                AUTO,
+                st.session_state.get("whisper_latency_target", WHISPER_LATENCY_TARGET),
+                st.session_state.get("whisper_max_size", MODEL_SIZES[2]),
+                st.session_state.get("whisper_retry", False),
+                clean=st.session_state.get("whisper_clean", True),
+                split=st.session_state.get("whisper_split", False),
+            )
+        else:
+            result = get_whisper_pool().transcribe(audio, st.session_state.whisper_model,
+                                                   clean=st.session_state.get("whisper_clean", True),
+                                                   split=st.session_state.get("whisper_split", False))
+        retried = f", retried after {result['retried_from']}" if result["retried_from"] else ""
+        st.caption(f"Whisper {result['size']}: {result['duration']:.1f}s of speech "
+                   f"(from {result['original_duration']:.1f}s) in {result['latency']:.1f}s{retried}")
+        if not result["text"]:
+            st.warning("No speech detected in the recording")
+        else:
+            st.session_state.captured_audio = (arrival, {
+                "audio_seconds": round(result["original_duration"], 2),
+                "audio_bytes": len(audio_bytes),
+                "transcribe_ms": round(1000 * result["latency"], 1),
+            })
+        return result["text"]
     except Exception as e:
         st.error(f"Transcription error: {e}")
         return None
 
+# Guardar el audio en la caché de la sesión, descartando el más antiguo si está llena
+def cache_speech(text_hash, speech_audio):
+    st.session_state.tts_cache[text_hash] = speech_audio
+    while len(st.session_state.tts_cache) > TTS_CACHE_SIZE:
+        st.session_state.tts_cache.pop(next(iter(st.session_state.tts_cache)))
+
 # Función para convertir texto a voz con caché y límite de velocidad
 def text_to_speech(text, lang="es"):
     if not st.session_state.tts_enabled:
@@ -206,30 +249,26 @@ def text_to_speech(text, lang="es"):
         # Actualizar tiempo de última solicitud
         st.session_state.tts_last_request = time.time()
         
-        # Generar el archivo de audio
-        audio_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-        tts = gTTS(text=text, lang=lang, slow=False)
-        tts.save(audio_file.name)
+        # Generar el MP3 en memoria
+        speech_audio = audio_io.synthesize_speech(text, lang)
         
         # Almacenar en caché
-        st.session_state.tts_cache[text_hash] = audio_file.name
+        cache_speech(text_hash, speech_audio)
         
-        return audio_file.name
+        return speech_audio
     except Exception as e:
         # Si encontramos un límite de velocidad, esperar e intentar nuevamente una vez
         if "429" in str(e):
             st.warning("Rate limit encountered, waiting 5 seconds before retrying...")
             time.sleep(5)
             try:
-                audio_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-                tts = gTTS(text=text, lang=lang, slow=False)
-                tts.save(audio_file.name)
+                speech_audio = audio_io.synthesize_speech(text, lang)
                 
                 # Almacenar en caché
                 text_hash = hashlib.md5((text + lang).encode()).hexdigest()
-                st.session_state.tts_cache[text_hash] = audio_file.name
+                cache_speech(text_hash, speech_audio)
                 
-                return audio_file.name
+                return speech_audio
             except Exception as retry_e:
                 st.error(f"Text-to-speech retry error: {retry_e}")
                 return None
@@ -238,171 +277,226 @@ def text_to_speech(text, lang="es"):
             return None
 
 # Función para enviar mensajes a través de WebSocket
-def send_message_to_agent(text):
-    if not st.session_state.ws_connected or st.session_state.ws_client is None:
+def send_message_to_agent(text, mode="text"):
+    if not ws_available():
         st.error("WebSocket is not connected. Please connect to the server first.")
         return None
     
+    arrival, audio = st.session_state.pop("captured_audio", (None, {})) if mode == "voice" else (None, {})
+    arrival = arrival or capture.start()
     try:
-        message = {"text": text}
-        st.session_state.ws_client.send(json.dumps(message))
-        
-        # Esperar respuesta (con timeout)
-        timeout = 30  # segundos
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            if not st.session_state.ws_queue.empty():
-                response = st.session_state.ws_queue.get()
-                return response
-            time.sleep(0.1)
-        
-        return {"status": "error", "error": "Timeout waiting for response"}
-    
+        # "mode" permite al servidor priorizar los turnos de voz sobre los de texto.
+        # La espera es bloqueante hasta la respuesta con el mismo request_id (o el timeout)
+        response = st.session_state.ws_client.request({"text": text, "mode": mode}, timeout=30)
     except Exception as e:
-        return {"status": "error", "error": str(e)}
+        response = {"status": "error", "error": str(e)}
+    transcribe_ms = audio.pop("transcribe_ms", None)
+    capture.record(arrival, text, response, stages={"transcribe_ms": transcribe_ms} if transcribe_ms else None,
+                   kind=mode, client=st.session_state.ws_client.client_id, **audio)
+    return response
 
-# Layout: dos columnas - una para entrada de voz y otra para transcripción de conversación
-col1, col2 = st.columns([1, 1])
+# Recordar la última respuesta cortada por el presupuesto de salida para poder continuarla
+def note_truncation(response, voice=False):
+    if response.get("truncated"):
+        st.session_state.truncated_turn = {"request_id": response.get("request_id"), "voice": voice}
+    else:
+        st.session_state.pop("truncated_turn", None)
+
+# Turno de voz completo en el servidor: se envía la grabación y se van mostrando la
+# transcripción, la respuesta y los segmentos de voz según llegan. Con `continue_id`
+# no hay audio: el servidor continúa esa respuesta cortada
+def run_voice_turn(audio_bytes, tts_lang, continue_id=None):
+    transcript_box = st.empty()
+    response_box = st.empty()
+    audio_area = st.container()
+    transcript = "(continue)" if continue_id else ""
+    response_text = ""
+    options = {"format": "wav", "lang": tts_lang, "tts": st.session_state.tts_enabled, "final": True}
+    if continue_id:
+        options["continue"] = continue_id
+    arrival = capture.start()
+    stages = None
+    speech_seconds = None
+    for event in st.session_state.voice_client.stream(options, audio=audio_bytes, timeout=120):
+        if event.get("type") == "transcript":
+            transcript = event["text"]
+            speech_seconds = event.get("duration", speech_seconds)
+            transcript_box.markdown(f"**You:** {transcript}" + ("" if event.get("final") else " …"))
+        elif event.get("type") == "chunk":
+            response_text += event["text"]
+            response_box.markdown(f"**Assistant:** {response_text}")
+        elif event.get("type") == "audio":
+            audio_area.audio(event["audio"], format="audio/mpeg")
+        elif event.get("type") == "timings":
+            stages = event["stages"]
+            st.caption(" · ".join(f"{name.removesuffix('_ms')} {value / 1000:.1f}s" for name, value in stages.items()))
+        elif event.get("status") == "success":
+            conversation_view.add_turn(transcript, event.get("response", response_text), event.get("agent"))
+            note_truncation(event, voice=True)
+        elif event.get("status") == "error":
+            st.error(f"Error: {event.get('error', 'Unknown error')}")
+        if event.get("status") in ("success", "error"):
+            capture.record(arrival, transcript, event, stages=stages, kind="voice" if audio_bytes else "text",
+                           channel="voice", client=st.session_state.voice_client.client_id,
+                           audio_bytes=len(audio_bytes) if audio_bytes else None, speech_seconds=speech_seconds)
 
-with col1:
-    st.header("Voice Input")
+# Pedir la continuación de la última respuesta cortada (por el mismo endpoint que la generó)
+def continue_answer(tts_lang):
+    pending = st.session_state.pop("truncated_turn")
+    if pending["voice"]:
+        run_voice_turn(None, tts_lang, continue_id=pending["request_id"])
+        return
+    with st.spinner("Getting the rest of the answer..."):
+        try:
+            response_data = st.session_state.ws_client.request({"continue": pending["request_id"]}, timeout=30)
+        except Exception as e:
+            response_data = {"status": "error", "error": str(e)}
+    if response_data.get("status") == "success":
+        conversation_view.add_turn("(continue)", response_data.get("response", ""), response_data.get("agent"))
+        note_truncation(response_data)
+    else:
+        st.error(f"Error: {response_data.get('error', 'Unknown error')}")
+
+# Área principal en un fragmento: escribir un mensaje, grabar audio o limpiar la
+# conversación solo vuelve a ejecutar esta parte, no la barra lateral
+@st.fragment
+def conversation_area(tts_lang):
+    area_started = time.perf_counter()
     
-    # Advertir al usuario si el modelo Whisper no está cargado
-    if st.session_state.whisper_model is None:
-        st.warning("Please load the Whisper model from the sidebar first")
+    # Layout: dos columnas - una para entrada de voz y otra para transcripción de conversación
+    col1, col2 = st.columns([1, 1])
+
+    with col1:
+        st.header("Voice Input")
+    
+        # Advertir al usuario si el modelo Whisper no está cargado (solo hace falta sin el pipeline del servidor)
+        if st.session_state.whisper_model is None and not st.session_state.voice_pipeline:
+            st.warning("Please load the Whisper model from the sidebar first")
     
-    # Advertir si WebSocket no está conectado
-    if not st.session_state.ws_connected:
-        st.warning("WebSocket is not connected. Please connect from the sidebar first.")
+        # Advertir si WebSocket no está conectado
+        if not ws_available():
+            st.warning("WebSocket is not connected. Please connect from the sidebar first.")
     
-    st.markdown("**Record your message:**")
-    audio_bytes = audio_recorder()
+        st.markdown("**Record your message:**")
+        audio_bytes = audio_recorder()
     
-    if audio_bytes is not None:
-        st.audio(audio_bytes, format="audio/wav")
-        if st.button("Process Recorded Audio"):
+        if audio_bytes is not None:
+            st.audio(audio_bytes, format="audio/wav")
+            if st.button("Process Recorded Audio"):
+                # Verificar conexión WebSocket
+                if not ws_available():
+                    st.error("WebSocket is not connected. Please connect to the server first.")
+                elif st.session_state.voice_pipeline:
+                    run_voice_turn(audio_bytes, tts_lang)
+                else:
+                    with st.spinner("Transcribing..."):
+                        transcription = transcribe_audio(audio_bytes)
+                
+                    if transcription:
+                        st.success("Transcription complete!")
+                    
+                        with st.spinner("Getting response from Agents via WebSocket..."):
+                            response_data = send_message_to_agent(transcription, mode="voice")
+                    
+                        if response_data:
+                            if response_data.get("status") == "success":
+                                assistant_response = response_data.get("response", "")
+                                conversation_view.add_turn(transcription, assistant_response, response_data.get("agent"))
+                                note_truncation(response_data)
+                            
+                                if st.session_state.tts_enabled:
+                                    with st.spinner("Generating speech..."):
+                                        speech_audio = text_to_speech(assistant_response, lang=tts_lang)
+                                        if speech_audio:
+                                            st.audio(speech_audio, format="audio/mpeg")
+                                        else:
+                                            st.warning("Text-to-speech unavailable. Continuing without audio.")
+                            else:
+                                st.error(f"Error: {response_data.get('error', 'Unknown error')}")
+    
+        # Opción de carga de archivo
+        st.subheader("Or upload audio")
+        uploaded_file = st.file_uploader("Upload audio file", type=["wav", "mp3"])
+    
+        if uploaded_file and st.button("Process Uploaded File"):
             # Verificar conexión WebSocket
-            if not st.session_state.ws_connected:
+            if not ws_available():
                 st.error("WebSocket is not connected. Please connect to the server first.")
+            elif st.session_state.voice_pipeline:
+                run_voice_turn(uploaded_file.getvalue(), tts_lang)
+            elif st.session_state.whisper_model is None:
+                st.error("Please load the Whisper model first")
             else:
-                # Guardar los bytes de audio grabados en un archivo temporal
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_audio_file:
-                    temp_audio_file.write(audio_bytes)
-                    temp_filename = temp_audio_file.name
-                
                 with st.spinner("Transcribing..."):
-                    transcription = transcribe_audio(temp_filename)
-                
+                    transcription = transcribe_audio(uploaded_file.getvalue())
+            
                 if transcription:
                     st.success("Transcription complete!")
-                    
+                
                     with st.spinner("Getting response from Agents via WebSocket..."):
-                        response_data = send_message_to_agent(transcription)
-                    
+                        response_data = send_message_to_agent(transcription, mode="voice")
+                
                     if response_data:
                         if response_data.get("status") == "success":
                             assistant_response = response_data.get("response", "")
-                            st.session_state.conversation.append({
-                                "user": transcription,
-                                "assistant": assistant_response
-                            })
-                            
+                            conversation_view.add_turn(transcription, assistant_response, response_data.get("agent"))
+                            note_truncation(response_data)
+                        
                             if st.session_state.tts_enabled:
                                 with st.spinner("Generating speech..."):
-                                    speech_file = text_to_speech(assistant_response, lang=tts_lang)
-                                    if speech_file:
-                                        st.audio(speech_file)
+                                    speech_audio = text_to_speech(assistant_response, lang=tts_lang)
+                                    if speech_audio:
+                                        st.audio(speech_audio, format="audio/mpeg")
                                     else:
                                         st.warning("Text-to-speech unavailable. Continuing without audio.")
                         else:
                             st.error(f"Error: {response_data.get('error', 'Unknown error')}")
     
-    # Opción de carga de archivo
-    st.subheader("Or upload audio")
-    uploaded_file = st.file_uploader("Upload audio file", type=["wav", "mp3"])
+        # Entrada de texto como fallback
+        st.subheader("Or type your message")
+        text_input = st.text_input("Type and press Enter")
     
-    if uploaded_file and st.button("Process Uploaded File"):
-        # Verificar conexión WebSocket
-        if not st.session_state.ws_connected:
-            st.error("WebSocket is not connected. Please connect to the server first.")
-        elif st.session_state.whisper_model is None:
-            st.error("Please load the Whisper model first")
-        else:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as temp_file:
-                temp_file.write(uploaded_file.getvalue())
-                temp_file_name = temp_file.name
-            
-            with st.spinner("Transcribing..."):
-                transcription = transcribe_audio(temp_file_name)
-            
-            if transcription:
-                st.success("Transcription complete!")
-                
+        if text_input:
+            # Verificar conexión WebSocket
+            if not ws_available():
+                st.error("WebSocket is not connected. Please connect to the server first.")
+            else:
                 with st.spinner("Getting response from Agents via WebSocket..."):
-                    response_data = send_message_to_agent(transcription)
-                
+                    response_data = send_message_to_agent(text_input)
+            
                 if response_data:
                     if response_data.get("status") == "success":
                         assistant_response = response_data.get("response", "")
-                        st.session_state.conversation.append({
-                            "user": transcription,
-                            "assistant": assistant_response
-                        })
-                        
+                        conversation_view.add_turn(text_input, assistant_response, response_data.get("agent"))
+                        note_truncation(response_data)
+                    
                         if st.session_state.tts_enabled:
                             with st.spinner("Generating speech..."):
-                                speech_file = text_to_speech(assistant_response, lang=tts_lang)
-                                if speech_file:
-                                    st.audio(speech_file)
+                                speech_audio = text_to_speech(assistant_response, lang=tts_lang)
+                                if speech_audio:
+                                    st.audio(speech_audio, format="audio/mpeg")
                                 else:
                                     st.warning("Text-to-speech unavailable. Continuing without audio.")
                     else:
                         st.error(f"Error: {response_data.get('error', 'Unknown error')}")
-    
-    # Entrada de texto como fallback
-    st.subheader("Or type your message")
-    text_input = st.text_input("Type and press Enter")
-    
-    if text_input:
-        # Verificar conexión WebSocket
-        if not st.session_state.ws_connected:
-            st.error("WebSocket is not connected. Please connect to the server first.")
-        else:
-            with st.spinner("Getting response from Agents via WebSocket..."):
-                response_data = send_message_to_agent(text_input)
-            
-            if response_data:
-                if response_data.get("status") == "success":
-                    assistant_response = response_data.get("response", "")
-                    st.session_state.conversation.append({
-                        "user": text_input,
-                        "assistant": assistant_response
-                    })
-                    
-                    if st.session_state.tts_enabled:
-                        with st.spinner("Generating speech..."):
-                            speech_file = text_to_speech(assistant_response, lang=tts_lang)
-                            if speech_file:
-                                st.audio(speech_file)
-                            else:
-                                st.warning("Text-to-speech unavailable. Continuing without audio.")
-                else:
-                    st.error(f"Error: {response_data.get('error', 'Unknown error')}")
 
-with col2:
-    st.header("Conversation Transcript")
+        # La última respuesta se cortó por el presupuesto de salida: se puede pedir el resto
+        if st.session_state.get("truncated_turn") and ws_available():
+            if st.button("Continue answer"):
+                continue_answer(tts_lang)
+
+    with col2:
+        st.header("Conversation Transcript")
     
-    if not st.session_state.conversation:
-        st.info("Your conversation will appear here")
-    else:
-        for i, exchange in enumerate(st.session_state.conversation):
-            st.markdown(f"**You:** {exchange['user']}")
-            st.markdown(f'<div class="response-box"><strong>Assistant:</strong> {exchange["assistant"]}</div>',
-                        unsafe_allow_html=True)
-            if i < len(st.session_state.conversation) - 1:
-                st.divider()
+        # Solo se pintan los últimos turnos; los anteriores se cargan bajo demanda
+        has_turns = conversation_view.render_transcript()
+        conversation_view.render_search()
     
-    if st.session_state.conversation and st.button("Clear Conversation"):
-        st.session_state.conversation = []
-        st.rerun()
\ No newline at end of file
+        if has_turns and st.button("Clear Conversation"):
+            conversation_view.new_session()
+            st.rerun(scope="fragment")
+    
+    streamlit_perf.record(streamlit_perf.MAIN_AREA, area_started)
+
+conversation_area(tts_lang)
+streamlit_perf.record(streamlit_perf.FULL_RERUN, rerun_started)
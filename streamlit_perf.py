@@ -0,0 +1,42 @@
+"""
+Medición del tiempo de cada rerun de Streamlit, compartida por los dos clientes.
+Los tiempos se guardan en la sesión y se muestran en un panel de la barra lateral.
+"""
+
+import statistics
+import time
+from collections import deque
+
+import streamlit as st
+
+# Número de reruns que se conservan por sesión
+TIMING_WINDOW = 50
+
+# Tipos de medida
+FULL_RERUN = "full rerun"
+MAIN_AREA = "main area"
+
+
+def _timings():
+    if "rerun_timings" not in st.session_state:
+        st.session_state.rerun_timings = deque(maxlen=TIMING_WINDOW)
+    return st.session_state.rerun_timings
+
+
+def record(kind, started):
+    """Guarda el tiempo transcurrido desde `started` (time.perf_counter())."""
+    _timings().append({"kind": kind, "ms": round((time.perf_counter() - started) * 1000, 1), "at": time.time()})
+
+
+def render_timing_panel():
+    with st.expander("Rerun timings"):
+        timings = list(_timings())
+        if not timings:
+            st.caption("No reruns measured yet")
+            return
+        for kind in (FULL_RERUN, MAIN_AREA):
+            samples = [t["ms"] for t in timings if t["kind"] == kind]
+            if samples:
+                st.caption(f"**{kind}**: last {samples[-1]:.1f} ms · median {statistics.median(samples):.1f} ms "
+                           f"· max {max(samples):.1f} ms ({len(samples)} runs)")
+        st.dataframe(list(reversed(timings)), hide_index=True, use_container_width=True)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Turno de voz completo en el servidor para /ws/voice.
+
+El cliente envía el audio y recibe, por la misma conexión, la transcripción
+(parcial y final), los trozos de texto del agente y los segmentos de voz
+sintetizada. Las etapas se solapan: el agente empieza en cuanto la
+transcripción es definitiva, y la síntesis de voz empieza con la primera frase
+completa de la respuesta, mientras el agente sigue generando.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+import audio_io
+from audio_preprocess import SAMPLE_RATE, resample
+from output_budget import complete_sentences
+
+logger = logging.getLogger(__name__)
+
+# Configuración (se puede sobreescribir con variables de entorno)
+# Modelo Whisper del servidor ("auto" lo elige para cada clip)
+VOICE_WHISPER_MODEL = os.environ.get("BOB_VOICE_WHISPER_MODEL", "auto")
+# Con audio PCM por trozos, cada cuántos segundos nuevos se envía una transcripción parcial
+VOICE_PARTIAL_SECONDS = float(os.environ.get("BOB_VOICE_PARTIAL_SECONDS", 1.5))
+# Segmentos de voz que se sintetizan a la vez (se envían siempre en orden)
+VOICE_TTS_CONCURRENCY = int(os.environ.get("BOB_VOICE_TTS_CONCURRENCY", 2))
+# Las frases más cortas se juntan con la siguiente para no generar segmentos diminutos
+VOICE_MIN_SENTENCE_CHARS = int(os.environ.get("BOB_VOICE_MIN_SENTENCE_CHARS", 40))
+# Las transcripciones parciales solo miran los últimos segundos del audio, para que su
+# coste no crezca con la duración del turno
+VOICE_PARTIAL_WINDOW = float(os.environ.get("BOB_VOICE_PARTIAL_WINDOW", 30))
+# Límites de un turno: bytes de audio recibidos y segundos de audio decodificado
+VOICE_MAX_TURN_BYTES = int(os.environ.get("BOB_VOICE_MAX_TURN_BYTES", 16 * 1024 * 1024))
+VOICE_MAX_TURN_SECONDS = float(os.environ.get("BOB_VOICE_MAX_TURN_SECONDS", 120))
+# Turnos abiertos a la vez en una conexión (recibiendo audio o en marcha)
+VOICE_MAX_OPEN_TURNS = int(os.environ.get("BOB_VOICE_MAX_OPEN_TURNS", 4))
+
+# Formato del audio de entrada: PCM crudo (s16le mono) admite transcripciones parciales;
+# cualquier otro (wav, webm, mp3...) se decodifica entero al final
+PCM16 = "pcm16"
+
+# Fin de frase: puntuación final seguida de espacio, o salto de línea
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+class VoiceLimitError(ValueError):
+    """El turno supera VOICE_MAX_TURN_BYTES o VOICE_MAX_TURN_SECONDS."""
+
+
+class SentenceSplitter:
+    """Acumula el texto en streaming y devuelve las frases completas según se cierran."""
+
+    def __init__(self, min_chars: int = VOICE_MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            candidate = self._buffer[start:match.start()].strip()
+            if len(candidate) >= self.min_chars:
+                sentences.append(candidate)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self, complete_only: bool = False) -> List[str]:
+        """El texto pendiente; con `complete_only`, sin la frase final si quedó a medias."""
+        rest, self._buffer = self._buffer.strip(), ""
+        if complete_only:
+            rest = complete_sentences(rest).strip()
+        return [rest] if rest else []
+
+
+class VoiceTurn:
+    """Un turno de /ws/voice: audio (o texto) de entrada y respuesta por etapas.
+
+    Las dependencias llegan como funciones para que el turno no sepa nada de la
+    conexión ni del runner: `send(payload)` y `send_audio(header, audio)` encolan
+    mensajes para el cliente, `transcribe(audio, size)` devuelve el resultado de
+    WhisperPool, `run_agent(text, on_chunk)` ejecuta el agente llamando a
+    `on_chunk` con cada trozo, y `synthesize(text, lang)` devuelve el MP3.
+    """
+
+    def __init__(self, request_id: str, send: Callable[[Dict[str, Any]], Awaitable[None]],
+                 send_audio: Callable[[Dict[str, Any], bytes], Awaitable[None]],
+                 transcribe: Callable[..., Dict[str, Any]],
+                 run_agent: Callable[[str, Callable[[str], Awaitable[None]]], Awaitable[Dict[str, Any]]],
+                 synthesize: Callable[[str, str], bytes],
+                 audio_format: str = "wav", sample_rate: int = SAMPLE_RATE, lang: str = "es", tts: bool = True,
+                 whisper_model: str = VOICE_WHISPER_MODEL):
+        self.request_id = request_id
+        self.send = send
+        self.send_audio = send_audio
+        self.transcribe = transcribe
+        self.run_agent = run_agent
+        self.synthesize = synthesize
+        self.audio_format = audio_format
+        self.sample_rate = sample_rate
+        self.lang = lang
+        self.tts = tts
+        self.whisper_model = whisper_model
+        self.started = time.perf_counter()
+        self.transcript: Optional[str] = None
+        self.audio_bytes = 0
+        self.audio_seconds: Optional[float] = None
+        self.timings: Dict[str, float] = {}
+        # PCM en un solo búfer (las parciales leen solo el final); otros formatos, por trozos
+        self._pcm = bytearray()
+        self._audio: List[bytes] = []
+        self._partial_at = 0
+        self._partial_task: Optional[asyncio.Task] = None
+        self._final = False
+        self._tts_semaphore = asyncio.Semaphore(VOICE_TTS_CONCURRENCY)
+        self._segments: "asyncio.Queue[Optional[asyncio.Task]]" = asyncio.Queue()
+        self._segment_seq = 0
+        # Síntesis en curso, para cancelarlas si se cancela el turno
+        self._tts_tasks: Set[asyncio.Task] = set()
+        self._chunk_seq = 0
+
+    def _mark(self, stage: str):
+        self.timings.setdefault(stage, round(1000 * (time.perf_counter() - self.started), 1))
+
+    async def _reply(self, payload: Dict[str, Any]):
+        await self.send({**payload, "request_id": self.request_id})
+
+    # Entrada
+
+    def add_audio(self, audio: bytes):
+        """Añade un trozo de audio; con PCM lanza una transcripción parcial cada VOICE_PARTIAL_SECONDS.
+
+        Lanza VoiceLimitError si el turno supera los límites de tamaño o duración.
+        """
+        self.audio_bytes += len(audio)
+        if self.audio_bytes > VOICE_MAX_TURN_BYTES:
+            raise VoiceLimitError(f"Audio exceeds {VOICE_MAX_TURN_BYTES} bytes per turn")
+        if self.audio_format != PCM16:
+            self._audio.append(bytes(audio))
+            return
+        self._pcm += audio
+        if len(self._pcm) / (2 * self.sample_rate) > VOICE_MAX_TURN_SECONDS:
+            raise VoiceLimitError(f"Audio exceeds {VOICE_MAX_TURN_SECONDS:g} seconds per turn")
+        new_seconds = (len(self._pcm) - self._partial_at) / (2 * self.sample_rate)
+        if new_seconds >= VOICE_PARTIAL_SECONDS and (self._partial_task is None or self._partial_task.done()):
+            self._partial_at = len(self._pcm)
+            self._partial_task = asyncio.create_task(self._partial_transcript())
+
+    def close(self):
+        """Abandona el turno (p. ej. al superar un límite): para la transcripción parcial."""
+        self._final = True
+        if self._partial_task is not None:
+            self._partial_task.cancel()
+
+    def _decode(self, window: Optional[float] = None) -> np.ndarray:
+        """Audio a SAMPLE_RATE; con `window`, solo los últimos `window` segundos (PCM)."""
+        if self.audio_format == PCM16:
+            start = 0
+            if window is not None:
+                start = max(0, len(self._pcm) - int(window * self.sample_rate) * 2)
+            end = len(self._pcm) - (len(self._pcm) - start) % 2
+            audio = np.frombuffer(bytes(self._pcm[start:end]), dtype=np.int16).astype(np.float32) / 32768.0
+            audio = resample(audio, self.sample_rate, SAMPLE_RATE)
+        else:
+            audio = audio_io.decode_audio(b"".join(self._audio))
+        if len(audio) > VOICE_MAX_TURN_SECONDS * SAMPLE_RATE:
+            raise VoiceLimitError(f"Audio exceeds {VOICE_MAX_TURN_SECONDS:g} seconds per turn")
+        return audio
+
+    async def _partial_transcript(self):
+        # Pasada rápida con el modelo más pequeño; la definitiva se hace al final
+        try:
+            audio = await asyncio.to_thread(self._decode, VOICE_PARTIAL_WINDOW)
+            result = await asyncio.to_thread(self.transcribe, audio, "tiny")
+        except Exception as e:
+            logger.info(f"Partial transcription error: {e}")
+            return
+        if not self._final and result["text"]:
+            await self._reply({"type": "transcript", "final": False, "text": result["text"]})
+
+    # Etapas
+
+    async def run_audio(self) -> Dict[str, Any]:
+        """Transcribe todo el audio recibido y continúa con el agente y la voz."""
+        self.close()
+        try:
+            audio = await asyncio.to_thread(self._decode)
+        except VoiceLimitError as e:
+            return await self._fail(str(e))
+        try:
+            result = await asyncio.to_thread(self.transcribe, audio, self.whisper_model)
+        except Exception as e:
+            return await self._fail(f"Transcription error: {e}")
+        self._mark("transcribe_ms")
+        self.audio_seconds = round(result["original_duration"], 2)
+        await self._reply({"type": "transcript", "final": True, "text": result["text"],
+                           "model": result["size"], "duration": result["duration"]})
+        if not result["text"]:
+            return await self._fail("No speech detected")
+        return await self.run_text(result["text"])
+
+    async def run_text(self, text: str, prompt: Optional[str] = None) -> Dict[str, Any]:
+        """Ejecuta el agente con `text` y sintetiza la respuesta por frases mientras se genera.
+
+        `prompt`, si se da, es lo que recibe el agente en lugar de `text` (p. ej. al
+        continuar una respuesta cortada).
+        """
+        self._final = True
+        self.transcript = text
+        splitter = SentenceSplitter()
+        sender = asyncio.create_task(self._send_segments())
+
+        async def on_chunk(chunk: str):
+            self._mark("first_chunk_ms")
+            self._chunk_seq += 1
+            await self._reply({"type": "chunk", "seq": self._chunk_seq, "text": chunk})
+            for sentence in splitter.feed(chunk):
+                self._queue_segment(sentence)
+
+        try:
+            try:
+                response = await self.run_agent(prompt or text, on_chunk)
+            except Exception as e:
+                response = {"status": "error", "error": str(e)}
+            self._mark("agent_ms")
+            if response.get("status") == "success":
+                if self._chunk_seq == 0:
+                    # El runner no envió trozos (p. ej. respuesta no textual): hablar la respuesta entera
+                    splitter.feed(response.get("response", ""))
+                # Si el presupuesto cortó la respuesta, la última frase a medias no se lee
+                for sentence in splitter.flush(complete_only=bool(response.get("truncated"))):
+                    self._queue_segment(sentence)
+            self._segments.put_nowait(None)
+            await sender
+        except BaseException:
+            sender.cancel()
+            for task in self._tts_tasks:
+                task.cancel()
+            raise
+        self._mark("tts_ms")
+        self._mark("total_ms")
+
+        # Los tiempos van antes del resultado, que es el último mensaje del turno
+        await self._reply({"type": "timings", "stages": self.timings})
+        await self._reply({**response, "transcript": text, "segments": self._segment_seq})
+        return response
+
+    async def _fail(self, error: str) -> Dict[str, Any]:
+        response = {"status": "error", "error": error}
+        await self._reply(response)
+        return response
+
+    def _queue_segment(self, sentence: str):
+        if not self.tts:
+            return
+        self._segment_seq += 1
+        task = asyncio.create_task(self._synthesize(self._segment_seq, sentence))
+        self._tts_tasks.add(task)
+        task.add_done_callback(self._tts_tasks.discard)
+        self._segments.put_nowait(task)
+
+    async def _synthesize(self, seq: int, text: str):
+        async with self._tts_semaphore:
+            return seq, text, await asyncio.to_thread(self.synthesize, text, self.lang)
+
+    async def _send_segments(self):
+        # Los segmentos se sintetizan en paralelo pero se envían en el orden de la respuesta
+        while True:
+            task = await self._segments.get()
+            if task is None:
+                return
+            try:
+                seq, text, audio = await task
+            except Exception as e:
+                logger.info(f"Text-to-speech error: {e}")
+                await self._reply({"type": "audio_error", "error": str(e)})
+                continue
+            self._mark("first_audio_ms")
+            await self.send_audio({"type": "audio", "request_id": self.request_id, "seq": seq,
+                                   "format": "mp3", "text": text}, audio)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Pool de modelos Whisper residentes con selección automática del tamaño.
+
+En modo automático, el tamaño del modelo se elige para cada clip. La elección
+depende de la duración del clip, del factor de tiempo real (segundos de proceso
+por segundo de audio) medido para cada tamaño y del objetivo de latencia. Si se
+pide, un clip con baja confianza se vuelve a transcribir con el modelo siguiente.
+Los modelos cargados se comparten entre todas las sesiones. Antes de
+transcribir, el audio pasa por audio_preprocess (volumen y recorte de silencio)
+y, si se pide, los clips largos se parten en las pausas y se decodifican en lote.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from audio_preprocess import SAMPLE_RATE, preprocess, split_at_pauses
+
+MODEL_SIZES = ["tiny", "base", "small", "medium"]
+AUTO = "auto"
+
+# Objetivo de latencia de la transcripción en modo automático (segundos)
+WHISPER_LATENCY_TARGET = float(os.environ.get("BOB_WHISPER_LATENCY_TARGET", 3.0))
+# Por debajo de este avg_logprob medio se considera que la transcripción es poco fiable
+WHISPER_MIN_LOGPROB = float(os.environ.get("BOB_WHISPER_MIN_LOGPROB", -0.8))
+# Factores de tiempo real iniciales, hasta que haya medidas
+DEFAULT_RTF = {"tiny": 0.05, "base": 0.1, "small": 0.3, "medium": 0.8}
+RTF_ALPHA = 0.3
+
+
+class WhisperPool:
+    def __init__(self):
+        self._models: Dict[str, Any] = {}
+        self._model_locks = {size: threading.Lock() for size in MODEL_SIZES}
+        self._load_lock = threading.Lock()
+        self._rtf = dict(DEFAULT_RTF)
+        self._counts = {size: 0 for size in MODEL_SIZES}
+
+    def get(self, size: str):
+        """Devuelve el modelo `size`, cargándolo la primera vez."""
+        model = self._models.get(size)
+        if model is None:
+            with self._load_lock:
+                model = self._models.get(size)
+                if model is None:
+                    import torch
+                    import whisper
+                    # Forzar una inicialización vacía para evitar problemas con torch
+                    torch.classes.__path__ = []
+                    model = self._models[size] = whisper.load_model(size)
+        return model
+
+    def loaded(self):
+        return [size for size in MODEL_SIZES if size in self._models]
+
+    def choose(self, duration: float, latency_target: float = WHISPER_LATENCY_TARGET,
+               max_size: str = MODEL_SIZES[-1]) -> str:
+        """El modelo más grande (hasta `max_size`) cuya latencia estimada cabe en el objetivo."""
+        sizes = MODEL_SIZES[:MODEL_SIZES.index(max_size) + 1]
+        for size in reversed(sizes):
+            if self._rtf[size] * duration <= latency_target:
+                return size
+        return sizes[0]
+
+    def transcribe(self, audio, size: str = AUTO, latency_target: float = WHISPER_LATENCY_TARGET,
+                   max_size: str = MODEL_SIZES[-1], retry_low_confidence: bool = False,
+                   clean: bool = True, split: bool = False) -> Dict[str, Any]:
+        """Transcribe `audio` (ruta o array float32 a 16 kHz).
+
+        Con `clean` se normaliza el volumen y se recorta el silencio antes de elegir el
+        modelo; con `split` los clips largos se parten en las pausas y los trozos se
+        decodifican en un solo lote. Devuelve el texto junto con el modelo usado, la
+        duración del clip (y la original), la latencia y la confianza (avg_logprob medio).
+        """
+        if isinstance(audio, str):
+            import whisper
+            audio = whisper.load_audio(audio)
+        started = time.perf_counter()
+        original_duration = len(audio) / SAMPLE_RATE
+        if clean:
+            audio = preprocess(audio)
+        duration = len(audio) / SAMPLE_RATE
+        chunks = split_at_pauses(audio) if split else [audio]
+
+        if size == AUTO:
+            size = self.choose(duration, latency_target, max_size)
+        retried_from = None
+        if duration < 0.1:
+            # Solo silencio: no hace falta pasar por el modelo
+            result = {"text": "", "confidence": 0.0}
+        else:
+            result = self._run(size, chunks, duration)
+            if retry_low_confidence and result["confidence"] < WHISPER_MIN_LOGPROB:
+                # Pasada rápida poco fiable: repetir con el modelo siguiente, aunque supere el objetivo
+                index = MODEL_SIZES.index(size)
+                if index < MODEL_SIZES.index(max_size):
+                    retried_from, size = size, MODEL_SIZES[index + 1]
+                    result = self._run(size, chunks, duration)
+
+        result.update({
+            "size": size,
+            "duration": duration,
+            "original_duration": original_duration,
+            "chunks": len(chunks),
+            "latency": time.perf_counter() - started,
+            "retried_from": retried_from,
+        })
+        return result
+
+    def _run(self, size: str, chunks: List[Any], duration: float) -> Dict[str, Any]:
+        model = self.get(size)
+        # Un mismo modelo no transcribe dos clips a la vez (whisper instala hooks en el modelo)
+        with self._model_locks[size]:
+            started = time.perf_counter()
+            if len(chunks) == 1:
+                result = self._transcribe_one(model, chunks[0])
+            else:
+                result = self._decode_batch(model, chunks)
+            elapsed = time.perf_counter() - started
+        if duration > 0:
+            self._rtf[size] += RTF_ALPHA * (elapsed / duration - self._rtf[size])
+            self._counts[size] += 1
+        return result
+
+    @staticmethod
+    def _transcribe_one(model, audio) -> Dict[str, Any]:
+        result = model.transcribe(audio)
+        segments = result.get("segments") or []
+        total = sum(segment["end"] - segment["start"] for segment in segments)
+        if total > 0:
+            confidence = sum(segment["avg_logprob"] * (segment["end"] - segment["start"])
+                             for segment in segments) / total
+        else:
+            confidence = 0.0
+        return {"text": result["text"].strip(), "confidence": confidence}
+
+    @staticmethod
+    def _decode_batch(model, chunks: List[Any]) -> Dict[str, Any]:
+        # Cada trozo cabe en una ventana de 30 s: se decodifican todos en una sola pasada del modelo
+        import torch
+        import whisper
+
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(chunk)), model.dims.n_mels)
+            for chunk in chunks
+        ]).to(model.device)
+        options = whisper.DecodingOptions(fp16=model.device.type != "cpu")
+        results = whisper.decode(model, mels, options)
+        weights = [len(chunk) for chunk in chunks]
+        confidence = sum(r.avg_logprob * w for r, w in zip(results, weights)) / sum(weights)
+        return {"text": " ".join(r.text.strip() for r in results if r.text.strip()), "confidence": confidence}
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {size: {"loaded": size in self._models, "rtf": round(self._rtf[size], 3),
+                       "transcriptions": self._counts[size]}
+                for size in MODEL_SIZES}
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Codificación de los mensajes WebSocket entre los clientes y el servidor.
+JSON en frames de texto es el modo por defecto; con el subprotocolo
+"bob.msgpack.v1" los mensajes viajan como msgpack en frames binarios.
+En ambos modos el audio se envía en frames binarios crudos (ver `encode_audio`).
+"""
+
+import json
+import struct
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:  # msgpack es opcional: sin él solo se ofrece JSON
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+# Subprotocolos WebSocket (Sec-WebSocket-Protocol) que entiende el servidor
+SUBPROTOCOLS = {
+    "bob.json.v1": JSON,
+    "bob.msgpack.v1": MSGPACK,
+}
+PROTOCOL_SUBPROTOCOL = {protocol: name for name, protocol in SUBPROTOCOLS.items()}
+
+# Primer byte de un frame binario de audio. Un mensaje msgpack es siempre un
+# mapa (0x80-0x8f, 0xde o 0xdf), así que nunca empieza por este byte.
+AUDIO_TAG = 0x01
+_AUDIO_HEADER = struct.Struct("!BH")
+
+Frame = Union[str, bytes]
+
+
+def available_protocols() -> Tuple[str, ...]:
+    return (JSON, MSGPACK) if msgpack is not None else (JSON,)
+
+
+def negotiate(requested: Iterable[str], fallback: Optional[str] = None) -> Tuple[Optional[str], str]:
+    """Elige el subprotocolo a aceptar y el protocolo resultante.
+
+    `requested` son los subprotocolos que ofrece el cliente, por orden de preferencia.
+    `fallback` permite pedir el protocolo con un parámetro de la URL (`?protocol=msgpack`).
+    """
+    for name in requested:
+        protocol = SUBPROTOCOLS.get(name)
+        if protocol in available_protocols():
+            return name, protocol
+    if fallback in available_protocols():
+        return None, fallback
+    return None, JSON
+
+
+def encode(payload: Dict[str, Any], protocol: str = JSON) -> Frame:
+    if protocol == MSGPACK:
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload)
+
+
+def decode(frame: Frame, protocol: str = JSON) -> Dict[str, Any]:
+    """Decodifica un mensaje; cualquier frame mal formado lanza ValueError."""
+    try:
+        if isinstance(frame, (bytes, bytearray)) and protocol == MSGPACK:
+            return msgpack.unpackb(frame, raw=False)
+        return json.loads(frame)
+    except ValueError:
+        raise
+    except Exception as e:
+        # msgpack (y json con bytes que no son texto) también lanza TypeError y otros
+        raise ValueError(f"Invalid message: {e}") from e
+
+
+def encode_audio(header: Dict[str, Any], audio: bytes, protocol: str = JSON) -> bytes:
+    """Frame binario de audio: etiqueta, longitud de la cabecera, cabecera y audio sin codificar."""
+    header_bytes = encode(header, protocol)
+    if isinstance(header_bytes, str):
+        header_bytes = header_bytes.encode()
+    return _AUDIO_HEADER.pack(AUDIO_TAG, len(header_bytes)) + header_bytes + audio
+
+
+def is_audio(frame: Frame) -> bool:
+    return isinstance(frame, (bytes, bytearray, memoryview)) and len(frame) > 0 and frame[0] == AUDIO_TAG
+
+
+def decode_audio(frame: bytes, protocol: str = JSON) -> Tuple[Dict[str, Any], memoryview]:
+    """Devuelve la cabecera y una vista (sin copia) de los bytes de audio.
+
+    Un frame más corto que su cabecera o con una cabecera ilegible lanza ValueError.
+    """
+    view = memoryview(frame)
+    start = _AUDIO_HEADER.size
+    if len(view) < start:
+        raise ValueError("Audio frame shorter than its header")
+    _, header_len = _AUDIO_HEADER.unpack_from(view)
+    if len(view) < start + header_len:
+        raise ValueError("Audio frame shorter than its header")
+    header = decode(bytes(view[start:start + header_len]), protocol)
+    return header, view[start + header_len:]
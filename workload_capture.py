@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Captura opcional de la carga real para reproducirla después.
+
+Con BOB_CAPTURE=1, el servidor y los clientes de Streamlit añaden cada turno a
+un log JSONL comprimido con gzip en BOB_CAPTURE_DIR. Cada turno lleva la
+llegada y el tiempo desde la anterior, el prompt (redactado según
+BOB_CAPTURE_REDACT), los tamaños (caracteres, tokens, audio) y los tiempos de
+cada etapa. Las escrituras las hace un hilo de fondo: registrar un turno solo
+lo encola, y si la cola se llena el turno se descarta en lugar de esperar.
+Cada proceso escribe su propio archivo y lo rota al llegar a
+BOB_CAPTURE_ROTATE_MB.
+
+Un turno que un cliente de Streamlit envía al servidor se captura dos veces
+(en el cliente y en el servidor), así que el resumen y la exportación solo
+leen por defecto los orígenes del servidor (SERVER_SOURCES).
+
+Este script exporta un archivo de replay muestreado y con la escala de tiempo
+cambiada, o resume lo capturado:
+
+    python workload_capture.py summary --since 24
+    python workload_capture.py export --sample 0.25 --speed 4 --out replay.jsonl
+"""
+
+import argparse
+import atexit
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import statistics
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Configuración (se puede sobreescribir con variables de entorno)
+CAPTURE_ENABLED = os.environ.get("BOB_CAPTURE", "0").lower() not in ("0", "false", "no", "")
+CAPTURE_DIR = os.environ.get("BOB_CAPTURE_DIR", os.path.join(os.getcwd(), "captures"))
+# "pii" enmascara correos, teléfonos y números largos; "hash" guarda solo un hash del
+# prompt; "drop" no guarda el prompt; "none" lo guarda tal cual. Siempre se guarda su longitud
+CAPTURE_REDACT = os.environ.get("BOB_CAPTURE_REDACT", "pii")
+CAPTURE_ROTATE_BYTES = int(float(os.environ.get("BOB_CAPTURE_ROTATE_MB", 8)) * 1024 * 1024)
+# Archivos que se conservan por origen (los más antiguos se borran al rotar, salvo los
+# de otros procesos que siguen vivos)
+CAPTURE_KEEP_FILES = int(os.environ.get("BOB_CAPTURE_KEEP_FILES", 50))
+CAPTURE_FLUSH_SECONDS = float(os.environ.get("BOB_CAPTURE_FLUSH_SECONDS", 5))
+CAPTURE_QUEUE_SIZE = int(os.environ.get("BOB_CAPTURE_QUEUE_SIZE", 10000))
+
+REDACT_MODES = ("none", "pii", "hash", "drop")
+# Orígenes del servidor. Los clientes ("streamlit", "safe_app") repiten los turnos que
+# envían al servidor, con los tiempos vistos desde el cliente
+SERVER_SOURCES = ("ws_agent", "ws_voice", "job")
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_PHONE = re.compile(r"\+?\d[\d\s().-]{7,}\d")
+_LONG_NUMBER = re.compile(r"\d{5,}")
+
+
+def redact(text: str, mode: str = CAPTURE_REDACT) -> Optional[str]:
+    if mode == "none":
+        return text
+    if mode == "hash":
+        return "sha256:" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    if mode == "drop":
+        return None
+    text = _EMAIL.sub("<email>", text)
+    text = _PHONE.sub("<phone>", text)
+    return _LONG_NUMBER.sub("<number>", text)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _file_pid(path: str) -> Optional[int]:
+    # capture-<origen>-<fecha>-<hora>-<pid>-<número>.jsonl.gz
+    parts = os.path.basename(path)[:-len(".jsonl.gz")].rsplit("-", 2)
+    return int(parts[1]) if len(parts) == 3 and parts[1].isdigit() else None
+
+
+def _client_hash(client: Optional[str]) -> Optional[str]:
+    # Se distinguen los clientes sin guardar su identidad
+    return hashlib.blake2b(client.encode("utf-8"), digest_size=6).hexdigest() if client else None
+
+
+class WorkloadCapture:
+    """Log de turnos de un proceso. Sin BOB_CAPTURE, todos los métodos no hacen nada."""
+
+    def __init__(self, source: str, directory: str = CAPTURE_DIR, enabled: bool = CAPTURE_ENABLED,
+                 redact_mode: str = CAPTURE_REDACT, rotate_bytes: int = CAPTURE_ROTATE_BYTES):
+        if redact_mode not in REDACT_MODES:
+            raise ValueError(f"Unknown redaction mode: {redact_mode}")
+        self.source = source
+        self.directory = directory
+        self.enabled = enabled
+        self.redact_mode = redact_mode
+        self.rotate_bytes = rotate_bytes
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._last_arrival: Optional[float] = None
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(CAPTURE_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._raw = None
+        self._files_opened = 0
+
+    def start(self) -> Optional[Dict[str, float]]:
+        """Marca la llegada de un turno; se pasa después a `record`."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            gap = None if self._last_arrival is None else round(now - self._last_arrival, 3)
+            self._last_arrival = now
+        return {"ts": round(now, 3), "gap": gap, "started": time.perf_counter()}
+
+    def record(self, arrival: Optional[Dict[str, float]], prompt: str, response: Any = None,
+               stages: Optional[Dict[str, float]] = None, **fields):
+        """Encola un turno. `response` es el resultado del runner (dict) o el texto de la respuesta.
+
+        `fields` añade datos del turno (kind, channel, client, audio_seconds, audio_bytes...);
+        los que valen None no se guardan.
+        """
+        if not self.enabled or arrival is None:
+            return
+        entry: Dict[str, Any] = {
+            "ts": arrival["ts"],
+            "gap": arrival["gap"],
+            "source": self.source,
+            "prompt": redact(prompt, self.redact_mode),
+            "prompt_chars": len(prompt),
+        }
+        if isinstance(response, dict):
+            metrics = response.get("metrics") or {}
+            entry.update({
+                "status": response.get("status"),
+                "agent": response.get("agent"),
+                "response_chars": len(response.get("response") or ""),
+                "input_tokens": metrics.get("input_tokens"),
+                "output_tokens": metrics.get("output_tokens"),
+                "truncated": response.get("truncated") or None,
+            })
+            if metrics.get("run_time") is not None:
+                stages = {"agent_ms": round(1000 * metrics["run_time"], 1), **(stages or {})}
+        elif response is not None:
+            entry.update({"status": "success", "response_chars": len(response)})
+        else:
+            entry["status"] = "error"
+        entry["client"] = _client_hash(fields.pop("client", None))
+        entry.update(fields)
+        entry["stages"] = {**(stages or {}), "total_ms": round(1000 * (time.perf_counter() - arrival["started"]), 1)}
+        entry = {key: value for key, value in entry.items() if value is not None}
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    # Escritura en segundo plano
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self._thread = threading.Thread(target=self._run, name="workload-capture", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+
+    def _open(self):
+        self._files_opened += 1
+        name = f"capture-{self.source}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._files_opened:04d}.jsonl.gz"
+        self._raw = open(os.path.join(self.directory, name), "ab")
+        self._file = gzip.GzipFile(fileobj=self._raw, mode="ab")
+        files = sorted(glob.glob(os.path.join(self.directory, f"capture-{self.source}-*.jsonl.gz")))
+        for old in files[:-CAPTURE_KEEP_FILES]:
+            # Otro worker del mismo origen puede estar escribiendo en el suyo
+            pid = _file_pid(old)
+            if pid is not None and pid != os.getpid() and _pid_alive(pid):
+                continue
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                # Otro proceso lo acaba de borrar
+                pass
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = self._raw = None
+
+    def _run(self):
+        flushed_at = time.monotonic()
+        while True:
+            try:
+                entry = self._queue.get(timeout=CAPTURE_FLUSH_SECONDS)
+            except queue.Empty:
+                entry = False
+            try:
+                if entry is None:
+                    self._close_file()
+                    return
+                if entry:
+                    if self._file is None:
+                        self._open()
+                    self._file.write((json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode())
+                if self._file is not None and time.monotonic() - flushed_at >= CAPTURE_FLUSH_SECONDS:
+                    # Un bloque gzip completo: lo escrito hasta aquí se puede leer aunque el proceso muera
+                    self._file.flush()
+                    flushed_at = time.monotonic()
+                    if self._raw.tell() >= self.rotate_bytes:
+                        self._close_file()
+            except Exception as e:
+                logger.error(f"Workload capture error: {e}")
+                self._close_file()
+
+
+_captures: Dict[str, WorkloadCapture] = {}
+
+
+def capture_for(source: str) -> WorkloadCapture:
+    """Captura compartida por el proceso para `source` (p. ej. "ws_agent" o "streamlit")."""
+    capture = _captures.get(source)
+    if capture is None:
+        capture = _captures.setdefault(source, WorkloadCapture(source))
+    return capture
+
+
+def close_captures():
+    """Termina los archivos de todas las capturas del proceso (al parar el servidor).
+
+    atexit no basta: uvicorn vuelve a lanzar la señal que lo detuvo al terminar.
+    """
+    for capture in list(_captures.values()):
+        capture.close()
+
+
+# Lectura y exportación
+
+def read_entries(directory: str = CAPTURE_DIR, since: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    for path in sorted(glob.glob(os.path.join(directory, "capture-*.jsonl.gz"))):
+        try:
+            with gzip.open(path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if since is None or entry["ts"] >= since:
+                        yield entry
+        except (EOFError, OSError):
+            # Archivo que se está escribiendo o de un proceso que murió: se lee hasta donde se pueda
+            continue
+
+
+def _percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))], 3)
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": values[-1]}
+
+
+def summarize(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    entries = sorted(entries, key=lambda e: e["ts"])
+    if not entries:
+        return {"turns": 0}
+    span = entries[-1]["ts"] - entries[0]["ts"]
+    gaps = [b["ts"] - a["ts"] for a, b in zip(entries, entries[1:])]
+    return {
+        "turns": len(entries),
+        "span_s": round(span, 1),
+        "turns_per_min": round(60 * len(entries) / span, 2) if span else None,
+        "sources": dict(Counter(e["source"] for e in entries)),
+        "agents": dict(Counter(e.get("agent", "-") for e in entries)),
+        "errors": sum(e.get("status") != "success" for e in entries),
+        "inter_arrival_s": _percentiles(gaps),
+        "prompt_chars": _percentiles([e["prompt_chars"] for e in entries]),
+        "response_chars": _percentiles([e["response_chars"] for e in entries if "response_chars" in e]),
+        "audio_seconds": _percentiles([e["audio_seconds"] for e in entries if "audio_seconds" in e]),
+        "total_ms": _percentiles([e["stages"]["total_ms"] for e in entries]),
+        "mean_total_ms": round(statistics.mean(e["stages"]["total_ms"] for e in entries), 1),
+    }
+
+
+def _replay_text(entry: Dict[str, Any]) -> str:
+    prompt = entry.get("prompt")
+    if prompt and not prompt.startswith("sha256:"):
+        return prompt
+    # Prompt no guardado: un texto de relleno de la misma longitud mantiene el tamaño de la petición
+    filler = "renovar la cocina con muebles nuevos y luz natural "
+    return (filler * (entry["prompt_chars"] // len(filler) + 1))[:entry["prompt_chars"]]
+
+
+def export_replay(entries: List[Dict[str, Any]], sample: float = 1.0, speed: float = 1.0,
+                  max_gap: Optional[float] = None, seed: int = 0) -> List[Dict[str, Any]]:
+    """Turnos muestreados con su instante de envío (`at`, segundos desde el primero) escalado por `speed`.
+
+    `max_gap` acorta las pausas más largas (p. ej. las noches) antes de aplicar la escala.
+    """
+    rng = random.Random(seed)
+    entries = sorted(entries, key=lambda e: e["ts"])
+    replay = []
+    clock = 0.0
+    previous = None
+    for entry in entries:
+        if previous is not None:
+            gap = entry["ts"] - previous
+            clock += min(gap, max_gap) if max_gap is not None else gap
+        previous = entry["ts"]
+        if rng.random() >= sample:
+            continue
+        item = {
+            "at": round(clock / speed, 3),
+            "source": entry["source"],
+            "kind": entry.get("kind", "text"),
+            "channel": entry.get("channel"),
+            "text": _replay_text(entry),
+            "agent": entry.get("agent"),
+            "audio_seconds": entry.get("audio_seconds"),
+            "expected_ms": entry["stages"]["total_ms"],
+            "stages": entry["stages"],
+        }
+        replay.append({key: value for key, value in item.items() if value is not None})
+    return replay
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Exportar y resumir la carga capturada")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    summary = subparsers.add_parser("summary", help="resumen de los turnos capturados")
+    export = subparsers.add_parser("export", help="archivo de replay muestreado y escalado en el tiempo")
+    for command in (summary, export):
+        command.add_argument("--dir", default=CAPTURE_DIR)
+        command.add_argument("--since", type=float, help="solo las últimas N horas")
+        command.add_argument("--source", nargs="*", default=list(SERVER_SOURCES),
+                             help="orígenes a leer (por defecto los del servidor: ws_agent, ws_voice y job; "
+                                  "los clientes streamlit y safe_app repiten los turnos que envían al servidor)")
+    summary.add_argument("--json", action="store_true", help="salida en JSON")
+    export.add_argument("--out", default="replay.jsonl")
+    export.add_argument("--sample", type=float, default=1.0, help="fracción de turnos que se conservan")
+    export.add_argument("--speed", type=float, default=1.0, help="factor de aceleración del tiempo")
+    export.add_argument("--max-gap", type=float, help="pausa máxima entre turnos, en segundos de la captura")
+    export.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    since = time.time() - args.since * 3600 if args.since else None
+    entries = [e for e in read_entries(args.dir, since) if e["source"] in args.source]
+    if args.command == "summary":
+        result = summarize(entries)
+        if args.json:
+            print(json.dumps(result, indent=2))
+        else:
+            for key, value in result.items():
+                print(f"{key:<18}{value}")
+        return
+
+    replay = export_replay(entries, args.sample, args.speed, args.max_gap, args.seed)
+    with open(args.out, "w") as f:
+        for item in replay:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    duration = replay[-1]["at"] if replay else 0.0
+    print(f"{len(replay)} de {len(entries)} turnos en {args.out} ({duration:.1f}s de replay)")
+
+
+if __name__ == "__main__":
+    main()
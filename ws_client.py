@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Cliente WebSocket persistente para streamlit_client.
+
+Un solo hilo por sesión mantiene la conexión con /ws/agent. El hilo pide el
+heartbeat de la aplicación (?heartbeat=1), responde a sus pings y reconecta con backoff exponencial si la conexión se
+cae. Las peticiones se emparejan con su respuesta por `request_id`, el llamador
+espera con un Event en lugar de sondear una cola, y las que siguen sin respuesta
+se reenvían tras reconectar (el servidor reconoce el request_id y no repite el
+turno). Con `stream` (para /ws/voice) el llamador recibe todos los mensajes del
+turno, audio incluido, hasta la respuesta final; esos turnos no se reenvían, y
+si la conexión se cae terminan con un error.
+
+Con `owner`, el socket se cierra cuando ese objeto se libera (p. ej. cuando
+Streamlit descarta la sesión que lo guarda).
+"""
+
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+import weakref
+from typing import Any, Dict, Iterator, Optional
+
+import websocket
+
+import wire_protocol
+
+logger = logging.getLogger(__name__)
+
+# Sin ningún mensaje del servidor (ni siquiera el ping del heartbeat) durante este
+# tiempo, la conexión se da por muerta y se reconecta
+WS_CLIENT_IDLE_TIMEOUT = float(os.environ.get("BOB_WS_CLIENT_IDLE_TIMEOUT", 45))
+WS_RECONNECT_MIN_DELAY = float(os.environ.get("BOB_WS_RECONNECT_MIN_DELAY", 0.5))
+WS_RECONNECT_MAX_DELAY = float(os.environ.get("BOB_WS_RECONNECT_MAX_DELAY", 10))
+
+# Estados de la conexión
+CONNECTING = "connecting"
+CONNECTED = "connected"
+RECONNECTING = "reconnecting"
+CLOSED = "closed"
+
+
+class _PendingRequest:
+    def __init__(self, payload: Dict[str, Any], audio: Optional[bytes] = None, streaming: bool = False):
+        self.payload = payload
+        # Con audio, la petición viaja como frame binario con `payload` de cabecera
+        self.audio = audio
+        self.done = threading.Event()
+        self.response: Optional[Dict[str, Any]] = None
+        # Mensajes intermedios del turno (solo en streaming)
+        self.events: Optional[queue.Queue] = queue.Queue() if streaming else None
+        # Los turnos en streaming no se reenvían: el servidor no puede repetir sus mensajes
+        self.resend = not streaming
+        # Conexión en la que se envió por última vez, para no enviarla dos veces en la misma
+        self.generation = -1
+
+
+class SessionOwner:
+    """Objeto que guarda la sesión del cliente; al liberarse cierra los sockets asociados."""
+
+
+class AgentSocket:
+    def __init__(self, url: str, protocol: str = wire_protocol.JSON, client_id: Optional[str] = None,
+                 owner: Optional[SessionOwner] = None):
+        self.url = url
+        self.protocol = protocol
+        # Identificador estable para el scheduler del servidor aunque cambie la conexión
+        self.client_id = client_id or uuid.uuid4().hex
+        self.state = CONNECTING
+        self.last_error: Optional[str] = None
+        self.reconnects = 0
+        self._ws: Optional[websocket.WebSocket] = None
+        self._send_lock = threading.Lock()
+        self._pending: Dict[str, _PendingRequest] = {}
+        self._pending_lock = threading.Lock()
+        self._generation = 0
+        self._connected = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="agent-socket", daemon=True)
+        self._thread.start()
+        if owner is not None:
+            # El hilo mantiene vivo el socket: sin esto, una sesión abandonada lo dejaría abierto
+            weakref.finalize(owner, self.close)
+
+    @property
+    def connected(self) -> bool:
+        return self.state == CONNECTED
+
+    def wait_connected(self, timeout: float) -> bool:
+        return self._connected.wait(timeout)
+
+    def request(self, payload: Dict[str, Any], timeout: float = 30.0) -> Dict[str, Any]:
+        """Envía un mensaje y espera su respuesta final (no el "processing")."""
+        request_id = uuid.uuid4().hex
+        pending = _PendingRequest({**payload, "request_id": request_id, "client_id": self.client_id})
+        with self._pending_lock:
+            self._pending[request_id] = pending
+        try:
+            # Si ahora no hay conexión, se enviará al reconectar
+            self._send_request(pending)
+            if not pending.done.wait(timeout):
+                return {"status": "error", "error": "Timeout waiting for response"}
+            return pending.response
+        finally:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+
+    def stream(self, payload: Dict[str, Any], audio: Optional[bytes] = None,
+               timeout: float = 120.0) -> Iterator[Dict[str, Any]]:
+        """Envía un mensaje (o un frame de audio con `payload` de cabecera) y devuelve sus mensajes.
+
+        Se devuelven todos los mensajes con el mismo request_id salvo el "processing", y el
+        último es la respuesta final (con "status"). Los de audio llevan los bytes en "audio".
+        """
+        request_id = uuid.uuid4().hex
+        pending = _PendingRequest({**payload, "request_id": request_id, "client_id": self.client_id},
+                                  audio, streaming=True)
+        with self._pending_lock:
+            self._pending[request_id] = pending
+        deadline = time.monotonic() + timeout
+        try:
+            self._send_request(pending)
+            while True:
+                try:
+                    event = pending.events.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    yield {"status": "error", "error": "Timeout waiting for response"}
+                    return
+                yield event
+                if "status" in event:
+                    return
+        finally:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+
+    def close(self):
+        self._closed.set()
+        self.state = CLOSED
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        self._fail_pending(lambda pending: True, "Connection closed")
+
+    def _fail_pending(self, condition, error: str):
+        with self._pending_lock:
+            for pending in self._pending.values():
+                if pending.done.is_set() or not condition(pending):
+                    continue
+                pending.response = {"status": "error", "error": error}
+                pending.done.set()
+                if pending.events is not None:
+                    pending.events.put(pending.response)
+
+    def _send_request(self, pending: _PendingRequest):
+        with self._pending_lock:
+            if pending.done.is_set() or pending.generation == self._generation:
+                return
+            if pending.generation >= 0 and not pending.resend:
+                return
+            previous, pending.generation = pending.generation, self._generation
+        if not self._send(pending.payload, pending.audio):
+            # No ha salido: un turno que no se reenvía tiene que poder enviarse al reconectar
+            with self._pending_lock:
+                if pending.generation == self._generation:
+                    pending.generation = previous
+
+    def _send(self, payload: Dict[str, Any], audio: Optional[bytes] = None) -> bool:
+        ws = self._ws
+        if ws is None or not self._connected.is_set():
+            return False
+        if audio is not None:
+            frame = wire_protocol.encode_audio(payload, audio, self.protocol)
+        else:
+            frame = wire_protocol.encode(payload, self.protocol)
+        try:
+            with self._send_lock:
+                if isinstance(frame, bytes):
+                    ws.send(frame, opcode=websocket.ABNF.OPCODE_BINARY)
+                else:
+                    ws.send(frame)
+            return True
+        except Exception as e:
+            # El hilo de lectura detectará la caída y reconectará
+            logger.info(f"Error enviando por WebSocket: {e}")
+            return False
+
+    def _run(self):
+        delay = WS_RECONNECT_MIN_DELAY
+        while not self._closed.is_set():
+            try:
+                self._ws = websocket.create_connection(
+                    self.url + ("&" if "?" in self.url else "?") + "heartbeat=1",
+                    timeout=WS_CLIENT_IDLE_TIMEOUT,
+                    subprotocols=[wire_protocol.PROTOCOL_SUBPROTOCOL[self.protocol]],
+                )
+            except Exception as e:
+                self.last_error = str(e)
+            else:
+                with self._pending_lock:
+                    self._generation += 1
+                self.state = CONNECTED
+                self.last_error = None
+                self._connected.set()
+                delay = WS_RECONNECT_MIN_DELAY
+                self._resend_pending()
+                self._read_loop()
+                self._connected.clear()
+                # Los turnos en streaming enviados por la conexión caída no se reenvían
+                generation = self._generation
+                self._fail_pending(lambda pending: not pending.resend and pending.generation == generation,
+                                   "Connection lost during the turn")
+            if self._closed.is_set():
+                break
+            self.state = RECONNECTING
+            self.reconnects += 1
+            # Backoff exponencial con jitter para no reconectar todos a la vez
+            self._closed.wait(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, WS_RECONNECT_MAX_DELAY)
+
+    def _resend_pending(self):
+        with self._pending_lock:
+            pending_requests = list(self._pending.values())
+        for pending in pending_requests:
+            self._send_request(pending)
+
+    def _read_loop(self):
+        ws = self._ws
+        try:
+            while not self._closed.is_set():
+                # recv se bloquea hasta que llega un frame o vence WS_CLIENT_IDLE_TIMEOUT
+                message = ws.recv()
+                if not message:
+                    break
+                if wire_protocol.is_audio(message):
+                    header, audio = wire_protocol.decode_audio(message, self.protocol)
+                    self._dispatch({**header, "audio": bytes(audio)})
+                    continue
+                self._dispatch(wire_protocol.decode(message, self.protocol))
+        except websocket.WebSocketTimeoutException:
+            self.last_error = "No heartbeat from server"
+        except Exception as e:
+            self.last_error = str(e)
+        finally:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    def _dispatch(self, data: Dict[str, Any]):
+        # Responder al heartbeat del servidor
+        if data.get("type") == "ping":
+            self._send({"type": "pong"})
+            return
+        if data.get("status") == "processing":
+            return
+        with self._pending_lock:
+            pending = self._pending.get(data.get("request_id"))
+        if pending is None:
+            return
+        if pending.events is not None:
+            pending.events.put(data)
+            if "status" not in data:
+                return
+        pending.response = data
+        pending.done.set()